@@ -69,6 +69,8 @@ class Settings(BaseSettings):
         default="http://localhost:11434",
         description="URL base de Ollama"
     )
+    OLLAMA_TIMEOUT_SECONDS: float = Field(
+        default=120.0, description="Timeout (s) de las peticiones a Ollama")
 
     # ============================================================================
     # CONFIGURACIÓN DE EMBEDDINGS
@@ -77,6 +79,54 @@ class Settings(BaseSettings):
         default="paraphrase-MiniLM-L3-v2",
         description="Modelo de embeddings a usar"
     )
+    EMBEDDING_BACKEND: str = Field(
+        default="torch", description="Backend de inferencia del encoder de etiquetas: torch, onnx u openvino")
+    SMART_TAGGING_INT8_TAGS: bool = Field(
+        default=False, description="Guardar los embeddings de etiquetas cuantizados a int8 (1 byte por componente)")
+    VECTOR_BINARY_QUANTIZATION: bool = Field(
+        default=False, description="Preseleccionar candidatos con un índice binario (Hamming) antes del producto punto")
+    VECTOR_RERANK_CANDIDATES: int = Field(
+        default=50, description="Candidatos del índice binario que se reordenan con los embeddings completos")
+
+    # ============================================================================
+    # CONFIGURACIÓN DE CACHÉ DEL LLM
+    # ============================================================================
+    LLM_CACHE_MAXSIZE: int = Field(
+        default=2000, description="Máximo de respuestas del LLM en caché")
+    LLM_CACHE_TTL_SECONDS: float = Field(
+        default=3600, description="Tiempo de vida (s) de una respuesta en caché")
+    LLM_CACHE_MAX_TEMPERATURE: float = Field(
+        default=0.3, description="Temperatura máxima para cachear respuestas (solo llamadas deterministas)")
+    LLM_CACHE_SEMANTIC: bool = Field(
+        default=False, description="Permitir la búsqueda de prompts semánticamente equivalentes (solo en llamadas que la pidan)")
+    LLM_CACHE_SIMILARITY_THRESHOLD: float = Field(
+        default=0.95, description="Similitud coseno mínima para reutilizar una respuesta")
+    CONV_CACHE_TTL_SECONDS: float = Field(
+        default=3600, description="Tiempo de vida (s) de la clasificación/entidades cacheadas en disco por conversación")
+    ROUTING_CACHE_MAXSIZE: int = Field(
+        default=1024, description="Máximo de resultados de búsquedas de enrutamiento del Super Agente en caché")
+    ROUTING_CACHE_TTL_SECONDS: float = Field(
+        default=300, description="Tiempo de vida (s) de las búsquedas de enrutamiento cacheadas")
+
+    # ============================================================================
+    # CONFIGURACIÓN DE MICRO-BATCHING DE ANÁLISIS
+    # ============================================================================
+    ANALYSIS_BATCH_SIZE: int = Field(
+        default=32,
+        description="Máximo de conversaciones por lote de análisis"
+    )
+    ANALYSIS_BATCH_WAIT_MS: float = Field(
+        default=10.0,
+        description="Espera máxima (ms) para completar un lote de análisis"
+    )
+    PATTERN_LOOKUP_BATCH_SIZE: int = Field(
+        default=16,
+        description="Máximo de conversaciones por lote de búsqueda de patrones similares"
+    )
+    PATTERN_LOOKUP_BATCH_WAIT_MS: float = Field(
+        default=20.0,
+        description="Espera máxima (ms) para completar un lote de búsqueda de patrones"
+    )
 
     # ============================================================================
     # CONFIGURACIÓN DE WHATSAPP BUSINESS API
@@ -101,7 +101,8 @@ def create_all_tables():
 def get_session():
     """Obtiene una sesión de base de datos"""
     validate_database_environment()
-    return Session(engine)
+    # Sin expirar al commit: leer atributos después del commit no recarga la fila
+    return Session(engine, expire_on_commit=False)
 
 
 def test_connection():
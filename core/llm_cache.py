@@ -0,0 +1,197 @@
+"""
+Agent 99 - Caché de Respuestas del LLM
+======================================
+
+Caché LRU con TTL para respuestas deterministas del LLM, con búsqueda
+semántica opcional (embeddings + FAISS) cuando no hay coincidencia exacta
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LLMCache:
+    """Caché de respuestas del LLM indexada por sha256(modelo|system_prompt|prompt|temperatura)"""
+
+    def __init__(self, maxsize: int = 2000, ttl_seconds: float = 3600,
+                 semantic: bool = True, similarity_threshold: float = 0.95,
+                 embedding_model: str = "all-MiniLM-L6-v2"):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.similarity_threshold = similarity_threshold
+        self.embedding_model = embedding_model
+
+        # key -> (expira_en, respuesta, scope, id_semántico)
+        self._entries: "OrderedDict[str, Tuple[float, Any, str, Optional[int]]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.stats = {"hits": 0, "semantic_hits": 0, "misses": 0}
+
+        # Índice semántico (se carga en el primer uso)
+        self._encoder = None
+        self._index = None
+        self._semantic_keys: Dict[int, str] = {}
+        self._next_semantic_id = 0
+
+    @staticmethod
+    def make_key(model: str, system_prompt: Optional[str], prompt: str, temperature: float) -> str:
+        """Calcula la clave exacta de una petición al LLM"""
+        payload = json.dumps(
+            {"m": model, "s": system_prompt, "p": prompt, "t": temperature}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def make_scope(model: str, system_prompt: Optional[str], temperature: float) -> str:
+        """Ámbito de la búsqueda semántica: solo se comparan prompts con el mismo modelo, system_prompt y temperatura"""
+        return LLMCache.make_key(model, system_prompt, "", temperature)
+
+    def get(self, key: str, scope: Optional[str] = None, prompt: Optional[str] = None) -> Optional[Any]:
+        """Busca una respuesta por clave exacta y, si no existe, por similitud semántica"""
+        with self._lock:
+            value = self._get_exact(key)
+            if value is not None:
+                self.stats["hits"] += 1
+                return value
+
+        if self.semantic and scope is not None and prompt:
+            value = self._get_similar(scope, prompt)
+            if value is not None:
+                with self._lock:
+                    self.stats["semantic_hits"] += 1
+                return value
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: Any, scope: Optional[str] = None, prompt: Optional[str] = None):
+        """Guarda una respuesta, indexándola semánticamente si hay prompt"""
+        semantic_id = None
+        if self.semantic and scope is not None and prompt:
+            embedding = self._encode(prompt)
+            if embedding is not None:
+                semantic_id = self._add_to_index(key, embedding)
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (
+                time.monotonic() + self.ttl_seconds, value, scope, semantic_id)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        """Vacía la caché (p. ej. al cambiar de modelo)"""
+        with self._lock:
+            self._entries.clear()
+            self._semantic_keys.clear()
+            if self._index is not None:
+                self._index.reset()
+
+    def _get_exact(self, key: str) -> Optional[Any]:
+        """Devuelve la entrada vigente y la marca como usada recientemente (requiere el lock)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _get_similar(self, scope: str, prompt: str) -> Optional[Any]:
+        """Busca la respuesta de un prompt semánticamente equivalente dentro del mismo ámbito"""
+        embedding = self._encode(prompt)
+        if embedding is None:
+            return None
+
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return None
+            scores, ids = self._index.search(
+                embedding, min(5, self._index.ntotal))
+            for score, semantic_id in zip(scores[0], ids[0]):
+                if score < self.similarity_threshold:
+                    break
+                key = self._semantic_keys.get(int(semantic_id))
+                entry = self._entries.get(key) if key else None
+                if entry is not None and entry[2] == scope:
+                    return self._get_exact(key)
+        return None
+
+    def _encode(self, text: str):
+        """Embedding normalizado del texto (None si los embeddings no están disponibles)"""
+        encoder = self._load_encoder()
+        if encoder is None:
+            return None
+        try:
+            return encoder.encode([text], normalize_embeddings=True).astype("float32")
+        except Exception as e:
+            logger.error(f"❌ Error generando embedding para caché LLM: {e}")
+            return None
+
+    def _load_encoder(self):
+        """Carga el modelo de embeddings y el índice FAISS en el primer uso"""
+        if self._encoder is not None or not self.semantic:
+            return self._encoder
+        with self._lock:
+            if self._encoder is None and self.semantic:
+                try:
+                    import faiss
+                    from sentence_transformers import SentenceTransformer
+
+                    encoder = SentenceTransformer(self.embedding_model)
+                    dimension = encoder.get_sentence_embedding_dimension()
+                    self._index = faiss.IndexIDMap2(
+                        faiss.IndexFlatIP(dimension))
+                    self._encoder = encoder
+                    logger.info(
+                        f"🧠 Caché semántica del LLM activa ({self.embedding_model})")
+                except Exception as e:
+                    logger.warning(
+                        f"⚠️ Caché semántica del LLM deshabilitada: {e}")
+                    self.semantic = False
+        return self._encoder
+
+    def _add_to_index(self, key: str, embedding) -> Optional[int]:
+        """Agrega el embedding de una entrada al índice semántico"""
+        with self._lock:
+            if self._index is None:
+                return None
+            semantic_id = self._next_semantic_id
+            self._next_semantic_id += 1
+            self._index.add_with_ids(
+                embedding, np.array([semantic_id], dtype="int64"))
+            self._semantic_keys[semantic_id] = key
+            return semantic_id
+
+    def _drop(self, key: str):
+        """Elimina una entrada y su embedding (requiere el lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[3] is None:
+            return
+
+        self._semantic_keys.pop(entry[3], None)
+        if self._index is not None:
+            self._index.remove_ids(np.array([entry[3]], dtype="int64"))
+
+
+# Instancia global de la caché del LLM
+llm_cache = LLMCache(
+    maxsize=settings.LLM_CACHE_MAXSIZE,
+    ttl_seconds=settings.LLM_CACHE_TTL_SECONDS,
+    semantic=settings.LLM_CACHE_SEMANTIC,
+    similarity_threshold=settings.LLM_CACHE_SIMILARITY_THRESHOLD,
+    embedding_model=settings.EMBEDDING_MODEL
+)
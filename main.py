@@ -1,4 +1,6 @@
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from routes.api import api_router
@@ -8,6 +10,19 @@ import uvicorn
 from core.db import create_all_tables
 from core.config import settings, get_environment_info
 from core.init_data import init_data
+from services.analysis_batcher import analysis_batcher
+from services.pattern_batcher import pattern_lookup_batcher
+from services.whatsapp_api import whatsapp_api_service
+from services.llm import llm_service
+from services.scraping import shutdown as shutdown_scraping
+import logging
+
+# Nivel de logging desde LOG_LEVEL (INFO en producción, DEBUG para diagnóstico)
+logging.basicConfig(
+    level=settings.LOG_LEVEL.upper(),
+    format=settings.LOG_FORMAT,
+    force=True
+)
 
 
 @asynccontextmanager
@@ -27,14 +42,24 @@ async def lifespan(app: FastAPI):
     # Inicializar datos (con validaciones automáticas)
     init_data()
 
+    # Consumidores de micro-lotes (/whatsapp/analyze y patrones del Super Agente)
+    analysis_batcher.start()
+    pattern_lookup_batcher.start()
+
     print("✅ Agent 99 iniciado correctamente")
     yield
     print("🔚 Cerrando Agent 99...")
+    await analysis_batcher.stop()
+    await pattern_lookup_batcher.stop()
+    await whatsapp_api_service.aclose()
+    await llm_service.aclose()
+    await asyncio.to_thread(shutdown_scraping)
 
 
 # Crear aplicación FastAPI con lifespan
 app = FastAPI(
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     title=settings.APP_NAME,
     description=settings.APP_DESCRIPTION,
     version=settings.APP_VERSION
@@ -11,7 +11,7 @@ from typing import Optional, List, Any
 from datetime import datetime
 from uuid import UUID, uuid4
 import pytz
-from sqlalchemy import JSON, Column
+from sqlalchemy import JSON, Column, Index, text
 
 # Configuración de zona horaria
 COLOMBIA_TZ = pytz.timezone("America/Bogota")
@@ -34,6 +34,14 @@ class AgentLearningBase(SQLModel):
 class AgentLearning(AgentLearningBase, table=True):
     """Modelo principal de aprendizajes de agentes"""
     __tablename__ = "agent_learnings"
+    __table_args__ = (
+        # Últimos aprendizajes por tipo de agente (ORDER BY created_at DESC)
+        Index("ix_agent_learnings_type_created", "agent_type", "created_at"),
+        # Mejores aprendizajes por categoría (confidence_score > 0.6 ORDER BY confidence_score DESC)
+        Index("ix_agent_learnings_category_confidence", "category", text("confidence_score DESC"),
+              postgresql_include=["agent_type", "learning_type", "created_at"],
+              postgresql_where=text("confidence_score > 0.6")),
+    )
 
     # Identificación
     id: Optional[UUID] = Field(default_factory=uuid4, primary_key=True)
@@ -7,6 +7,7 @@ Siguiendo la estructura de milla99-backend con SQLModel
 """
 
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, text
 from typing import Optional, List
 from datetime import datetime
 from uuid import UUID, uuid4
@@ -58,6 +59,11 @@ class ConversationBase(SQLModel):
 class Conversation(ConversationBase, table=True):
     """Modelo principal de conversaciones"""
     __tablename__ = "conversations"
+    __table_args__ = (
+        # Búsqueda por solapamiento de tags (tags_json::jsonb ?| array[...])
+        Index("ix_conversations_tags_gin", text("(tags_json::jsonb)"),
+              postgresql_using="gin"),
+    )
 
     # Identificación
     id: Optional[UUID] = Field(default_factory=uuid4, primary_key=True)
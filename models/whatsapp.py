@@ -1,8 +1,8 @@
 """
 Modelos para WhatsApp y análisis de conversaciones
 """
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Callable
+from dataclasses import dataclass, field
 from datetime import datetime
 
 
@@ -27,3 +27,33 @@ class WhatsAppConversation:
     category: Optional[str] = None
     tags: List[str] = None
     sentiment: Optional[str] = None
+    # Transcripción cacheada y (lista, número de mensajes) con los que se generó
+    _transcript: Optional[str] = field(
+        default=None, init=False, repr=False, compare=False)
+    _transcript_key: Optional[tuple] = field(
+        default=None, init=False, repr=False, compare=False)
+    # Embedding de la transcripción y clave de la transcripción con la que se calculó
+    _embedding: Optional[Any] = field(
+        default=None, init=False, repr=False, compare=False)
+    _embedding_key: Optional[tuple] = field(
+        default=None, init=False, repr=False, compare=False)
+
+    @property
+    def transcript(self) -> str:
+        """Texto "[HH:MM] remitente: mensaje" de la conversación; se regenera solo si cambian los mensajes"""
+        key = (id(self.messages), len(self.messages))
+        if self._transcript_key != key:
+            self._transcript = "\n".join([
+                f"[{msg.timestamp.strftime('%H:%M')}] {msg.sender}: {msg.content}"
+                for msg in self.messages
+            ])
+            self._transcript_key = key
+        return self._transcript
+
+    def get_embedding(self, encode: Callable[[str], Any]) -> Any:
+        """Embedding de la transcripción; `encode` solo se llama si cambian los mensajes"""
+        transcript = self.transcript
+        if self._embedding is None or self._embedding_key != self._transcript_key:
+            self._embedding = encode(transcript)
+            self._embedding_key = self._transcript_key
+        return self._embedding
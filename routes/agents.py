@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from services.agents import agent_manager
+# Módulo (no sus instancias): los agentes globales se crean en el primer uso
+from services import agents as agents_service
 from models.whatsapp import WhatsAppConversation, WhatsAppMessage
 from datetime import datetime
 
@@ -37,7 +38,7 @@ def process_with_agents(body: AgentProcessBody):
         )
 
         # Procesar con agentes
-        result = agent_manager.route_WhatsAppConversation(temp_conversation)
+        result = agents_service.agent_manager.route_WhatsAppConversation(temp_conversation)
 
         return {
             "conversation_id": temp_conversation.id,
@@ -53,7 +54,7 @@ def process_with_agents(body: AgentProcessBody):
 def get_agent_performance():
     """Obtiene métricas de rendimiento de todos los agentes"""
     try:
-        performance = agent_manager.get_agent_performance()
+        performance = agents_service.agent_manager.get_agent_performance()
         return {"agent_performance": performance}
     except Exception as e:
         raise HTTPException(
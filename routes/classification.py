@@ -1,12 +1,13 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List
-from services.classify import load_seed_csv, train_and_save, predict
+from services.classify import load_seed_csv, train_and_save, train_streaming, predict
 
 router = APIRouter(prefix="/classification", tags=["classification"])
 
 class TrainBody(BaseModel):
     csv_path: str = "data/seed.csv"
+    streaming: bool = False
 
 class PredictBody(BaseModel):
     texts: List[str]
@@ -15,6 +16,10 @@ class PredictBody(BaseModel):
 def train(body: TrainBody):
     """Entrena el modelo de clasificación"""
     try:
+        if body.streaming:
+            # CSV grandes: hashing + SGD por lotes, sin cargar todo en memoria
+            model_path, samples = train_streaming(body.csv_path)
+            return {"model_path": model_path, "samples": samples}
         data = load_seed_csv(body.csv_path)
         model_path = train_and_save(data)
         return {"model_path": model_path, "samples": len(data)}
@@ -2,6 +2,8 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 from services.llm import llm_service
+from services.conv_cache import conv_cache
+from core.llm_cache import llm_cache
 
 router = APIRouter(prefix="/llm", tags=["llm"])
 
@@ -44,3 +46,12 @@ def extract_entities(body: WhatsAppAnalysisBody):
         return {"entities": entities}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting entities: {str(e)}")
+
+@router.get("/cache-stats")
+def get_cache_stats():
+    """Obtiene aciertos/fallos de las cachés de respuestas del LLM"""
+    return {
+        "llm_cache": dict(llm_cache.stats),
+        "conversation_cache": conv_cache.get_stats(),
+        "ollama_calls": llm_service.metrics()
+    }
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
-from services.scraping import fetch_html, extract_products
+from services.scraping import scrape as scrape_products
 
 router = APIRouter(prefix="/scraping", tags=["scraping"])
 
@@ -13,8 +13,7 @@ class ScrapeBody(BaseModel):
 def scrape(body: ScrapeBody):
     """Hace scraping de una URL y extrae productos"""
     try:
-        html = fetch_html(body.url, body.wait_selector)
-        items = extract_products(html)
+        items = scrape_products(body.url, body.wait_selector)
         return {"count": len(items), "items": items[:50]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error scraping URL: {str(e)}")
@@ -33,7 +33,7 @@ async def process_conversation_with_super_agent(request: ConversationRequest):
         )
 
         # Procesar con Super Agente
-        result = super_agent.process_conversation(conversation)
+        result = await super_agent.aprocess_conversation(conversation)
 
         return {
             "success": True,
@@ -148,8 +148,8 @@ async def get_learning_cycles():
 
         return {
             "success": True,
-            "total_cycles": len(cycles),
-            "cycles": cycles
+            "total_cycles": super_agent.total_learning_cycles,
+            "cycles": list(cycles)
         }
 
     except Exception as e:
@@ -168,7 +168,7 @@ async def get_optimization_history():
         return {
             "success": True,
             "total_optimizations": len(history),
-            "history": history
+            "history": list(history)
         }
 
     except Exception as e:
@@ -183,14 +183,8 @@ async def reset_global_memory():
     """Resetea la memoria global del Super Agente (solo para desarrollo)"""
     try:
         # Resetear memoria
-        super_agent.global_memory = {
-            "customer_patterns": {},
-            "conversation_trends": {},
-            "agent_performance": {},
-            "business_insights": {},
-            "learning_cycles": [],
-            "optimization_history": []
-        }
+        super_agent.global_memory = super_agent.new_global_memory()
+        super_agent.total_learning_cycles = 0
 
         # Resetear métricas
         super_agent.aggregated_metrics = {
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, List
 from services.vector_store import vector_store, VectorItem
 import uuid
 
@@ -10,6 +10,10 @@ class VectorSearchBody(BaseModel):
     query: str
     k: int = 5
 
+class VectorBatchSearchBody(BaseModel):
+    queries: List[str]
+    k: int = 5
+
 @router.post("/search")
 def vector_search(body: VectorSearchBody):
     """Busca en el vector store"""
@@ -19,6 +23,20 @@ def vector_search(body: VectorSearchBody):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching vector store: {str(e)}")
 
+@router.post("/batch-search")
+def vector_batch_search(body: VectorBatchSearchBody):
+    """Busca en el vector store varios queries a la vez"""
+    try:
+        results = vector_store.batch_search(body.queries, body.k)
+        return {
+            "results": [
+                {"query": query, "results": query_results}
+                for query, query_results in zip(body.queries, results)
+            ]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching vector store: {str(e)}")
+
 @router.post("/add")
 def add_to_vector_store(text: str, metadata: Dict[str, Any]):
     """Añade un item al vector store"""
@@ -1,23 +1,71 @@
 """
 Endpoints para análisis de conversaciones de WhatsApp
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Request, Query
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Request, Query, BackgroundTasks
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
-from services.whatsapp_analyzer import whatsapp_analyzer
+from services.analysis_batcher import analysis_batcher
 from services.super_agent import super_agent
-from services.tag_persistence import tag_persistence_service
+from services.tag_persistence import tag_persistence_service, ALL_TAGS_CACHE_TTL_SECONDS
+from services.whatsapp_api import whatsapp_api_service
+from services.vector_store import vector_store
+# Módulo (no sus instancias): los agentes globales se crean en el primer uso
+from services import agents as agents_service
 from models.conversation import Conversation, ConversationCreate
+from models.tag import Tag
+from models.vector import VectorItem
+from models.agent import AgentLearning as AgentLearningModel
 from core.db import get_session
 from sqlmodel import Session, select
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime
+from collections import OrderedDict
+import asyncio
+import codecs
+import hashlib
+import io
+import threading
+import time
+import re
 import uuid
 import logging
+import orjson
+import traceback
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/whatsapp", tags=["WhatsApp"])
 
+# Caché LRU+TTL de análisis por cliente y texto normalizado
+ANALYSIS_CACHE_MAXSIZE = 10_000
+ANALYSIS_CACHE_TTL_SECONDS = 3600
+_analysis_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+# Tamaño de bloque para leer archivos subidos
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Máximo de mensajes del webhook procesándose a la vez
+WEBHOOK_MAX_CONCURRENCY = 16
+_webhook_semaphore = asyncio.Semaphore(WEBHOOK_MAX_CONCURRENCY)
+
+# Máximo de aprendizajes del Super Agente devueltos por /super-agent-learnings
+SUPER_AGENT_LEARNINGS_LIMIT = 200
+
+# Respuestas automáticas por categoría (None = respuesta por defecto)
+CATEGORY_RESPONSES = {
+    "ventas": "¡Hola! Gracias por tu consulta sobre ventas. Nuestro equipo especializado te atenderá en breve. 🛍️",
+    "soporte": "¡Hola! Entiendo que necesitas soporte técnico. Nuestro equipo de asistencia te ayudará pronto. 🔧",
+    "reclamo": "¡Hola! Lamento que hayas tenido una experiencia negativa. Nuestro equipo de atención al cliente se pondrá en contacto contigo. 📞",
+    None: "¡Hola! Gracias por contactarnos. Nuestro equipo te atenderá en breve. 😊",
+}
+
+WHITESPACE_RE = re.compile(r"\s+")
+GREETING_RE = re.compile(
+    r"^(hi|hola|buenas|buenos dias|buenos días|gracias|muchas gracias|ok|okay|thanks)\W*$")
+
 
 class WhatsAppAnalysisRequest(BaseModel):
     conversation_text: str
@@ -28,110 +76,213 @@ class WhatsAppAnalysisResponse(BaseModel):
     conversation_id: str
     analysis: Dict[str, Any]
     database_saved: bool
-    super_agent_processed: bool
+    super_agent_queued: bool
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza el texto para usarlo como llave de caché"""
+    return WHITESPACE_RE.sub(" ", text.strip().lower())
+
+
+def _greeting_analysis(conversation_text: str) -> Dict[str, Any]:
+    """Resultado fijo para saludos y agradecimientos, sin llamar al LLM"""
+    return {
+        "conversation_id": str(uuid.uuid4()),
+        "classification": {"category": "otro", "confidence": 1.0,
+                           "sentiment": "positivo", "tags": ["saludo"]},
+        "entities": {},
+        "vector_id": None,
+        "total_messages": 0,
+        "duration_hours": 0,
+        "customer_name": "Cliente",
+        "category": "otro",
+        "sentiment": "positivo",
+        "insights": {
+            "total_messages": 0,
+            "duration_hours": 0,
+            "avg_response_time_minutes": 0,
+            "avg_message_length": len(conversation_text),
+            "category": "otro",
+            "sentiment": "positivo",
+            "tags": ["saludo"]
+        }
+    }
+
+
+async def _reuse_cached_analysis(cached: Dict[str, Any], conversation_text: str,
+                                 customer_id: str) -> Dict[str, Any]:
+    """Análisis cacheado con ID propio para la nueva conversación, indexada en el vector store"""
+    conversation_id = str(uuid.uuid4())
+    vector_id = None
+    if cached["vector_id"] is not None:
+        vector_id = await asyncio.to_thread(vector_store.add_item, VectorItem(
+            id=conversation_id,
+            text=conversation_text,
+            metadata={
+                "category": cached["category"],
+                "sentiment": cached["sentiment"],
+                "tags": cached["insights"]["tags"],
+                "customer_id": customer_id
+            }
+        ))
+    return {**cached, "conversation_id": conversation_id, "vector_id": vector_id}
+
+
+async def analyze_conversation_cached(conversation_text: str, customer_id: str) -> Dict[str, Any]:
+    """Analiza una conversación usando caché LRU+TTL (por cliente y texto) y pre-filtro de saludos"""
+    normalized = normalize_text(conversation_text)
+    key = hashlib.blake2b(
+        f"{customer_id}\0{normalized}".encode(), digest_size=16).digest()
+    now = time.monotonic()
+
+    with _analysis_cache_lock:
+        cached = _analysis_cache.get(key)
+        if cached and now - cached[0] < ANALYSIS_CACHE_TTL_SECONDS:
+            _analysis_cache.move_to_end(key)
+            cached = cached[1]
+        else:
+            cached = None
 
+    if cached is not None:
+        # Cada conversación necesita su propio ID y su entrada en el vector store
+        return await _reuse_cached_analysis(cached, conversation_text, customer_id)
 
-@router.post("/analyze", response_model=WhatsAppAnalysisResponse)
-async def analyze_whatsapp_conversation(request: WhatsAppAnalysisRequest):
-    """Analiza una conversación de WhatsApp y la guarda en la base de datos"""
-    try:
-        # 1. Analizar la conversación (SIN persistir tags aún)
-        analysis_result = whatsapp_analyzer.analyze_conversation_text(
-            request.conversation_text,
-            request.customer_id
-        )
+    if GREETING_RE.match(normalized):
+        analysis_result = _greeting_analysis(conversation_text)
+    else:
+        analysis_result = await analysis_batcher.analyze(
+            conversation_text, customer_id)
 
-        # 2. Guardar la conversación en la base de datos PRIMERO
-        conversation_data = ConversationCreate(
-            id=analysis_result["conversation_id"],
-            customer_id=request.customer_id,
-            category=analysis_result["category"],
-            tags=analysis_result["insights"]["tags"],
-            sentiment=analysis_result["sentiment"],
-            status="active",
-            created_at=datetime.now(),
-            updated_at=datetime.now()
-        )
+    with _analysis_cache_lock:
+        _analysis_cache[key] = (now, analysis_result)
+        _analysis_cache.move_to_end(key)
+        while len(_analysis_cache) > ANALYSIS_CACHE_MAXSIZE:
+            _analysis_cache.popitem(last=False)
 
-        database_saved = False
-        with get_session() as session:
-            # Verificar si ya existe
-            existing = session.exec(
-                select(Conversation).where(
-                    Conversation.id == conversation_data.id)
-            ).first()
+    return analysis_result
 
-            if not existing:
-                conversation = Conversation.from_orm(conversation_data)
-                session.add(conversation)
-                session.commit()
-                session.refresh(conversation)
-                database_saved = True
-                print(
-                    f"✅ Conversación guardada en BD con ID: {conversation.id}")
-            else:
-                database_saved = False
-                print(
-                    f"⚠️ Conversación ya existe en BD: {conversation_data.id}")
 
-        # 3. AHORA persistir los tags (después de que la conversación existe)
+def insert_conversation_if_absent(session: Session, conversation: Conversation) -> bool:
+    """Inserta la conversación con ON CONFLICT DO NOTHING; retorna True si se insertó"""
+    values = conversation.model_dump()
+
+    if session.get_bind().dialect.name == "sqlite":
+        stmt = insert(Conversation).values(**values).prefix_with("OR IGNORE")
+        return session.execute(stmt).rowcount > 0
+
+    stmt = (
+        pg_insert(Conversation)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=["id"])
+        .returning(Conversation.id)
+    )
+    return session.execute(stmt).first() is not None
+
+
+def run_super_agent(conversation_data):
+    """Procesa una conversación con el Super Agente fuera del ciclo del request"""
+    try:
+        super_agent.process_conversation(conversation_data)
+    except Exception as e:
+        logger.error("❌ Error en Super Agente: %s", e)
+
+
+async def _analyze_and_persist(conversation_text: str, customer_id: str,
+                               background_tasks: BackgroundTasks) -> Dict[str, Any]:
+    """Analiza una conversación, la guarda con sus tags y encola el Super Agente"""
+    # 1. Analizar la conversación (SIN persistir tags aún)
+    analysis_result = await analyze_conversation_cached(
+        conversation_text,
+        customer_id
+    )
+
+    # 2. Guardar la conversación en la base de datos PRIMERO
+    now = datetime.now()
+    conversation_data = ConversationCreate(
+        id=analysis_result["conversation_id"],
+        customer_id=customer_id,
+        category=analysis_result["category"],
+        tags=analysis_result["insights"]["tags"],
+        sentiment=analysis_result["sentiment"],
+        status="active",
+        created_at=now,
+        updated_at=now
+    )
+
+    with get_session() as session:
+        # Insertar solo si no existe, en un único round-trip
+        # model_validate (no model_construct): el modelo de tabla necesita su estado de SQLAlchemy
+        conversation = Conversation.model_validate(conversation_data)
+        database_saved = insert_conversation_if_absent(
+            session, conversation)
+
         if database_saved:
-            print(f"🔍 DEBUG: Persistiendo tags DESPUÉS de crear conversación...")
-            try:
-                # Extraer smart_tags del análisis
-                smart_tags = []
-                if "insights" in analysis_result and "tags" in analysis_result["insights"]:
-                    # Convertir tags simples a formato smart_tags
-                    for tag_name in analysis_result["insights"]["tags"]:
-                        smart_tags.append({
-                            "name": tag_name,
-                            "category": analysis_result["category"],
-                            "type": "llm_generated",
-                            "confidence_score": 0.8,
-                            "source": "llm_classification",
-                            "weight": 0.8,
-                            "context": request.conversation_text[:100],
-                            "related_tags": []
-                        })
-
-                if smart_tags:
-                    print(f"🔍 DEBUG: Persistiendo {len(smart_tags)} tags...")
-                    from services.tag_persistence import tag_persistence_service
-                    tags_persisted = tag_persistence_service.save_tags_to_database(
-                        tags=smart_tags,
-                        conversation_id=analysis_result["conversation_id"],
-                        customer_id=request.customer_id,
-                        category=analysis_result["category"]
-                    )
-
-                    if tags_persisted:
-                        print(
-                            f"✅ Tags persistidos exitosamente: {len(smart_tags)} tags")
-                    else:
-                        print(f"❌ Tags NO se persistieron")
+            # 3. Persistir los tags en la MISMA transacción de la conversación
+            category = analysis_result["category"]
+            context = conversation_text[:100]
+            tag_names = analysis_result.get("insights", {}).get("tags", ())
+            smart_tags = [
+                Tag(
+                    name=tag_name,
+                    category=category,
+                    tag_type="llm_generated",
+                    confidence_score=0.8,
+                    source="llm_classification",
+                    weight=0.8,
+                    context=context
+                )
+                for tag_name in tag_names
+            ]
+
+            if smart_tags:
+                tags_persisted = tag_persistence_service.save_tags_bulk(
+                    session,
+                    smart_tags,
+                    conversation_id=analysis_result["conversation_id"],
+                    customer_id=customer_id,
+                    category=category
+                )
+
+                if tags_persisted:
+                    logger.debug(
+                        "✅ Tags persistidos exitosamente: %d tags", len(smart_tags))
                 else:
-                    print(f"⚠️ No hay tags para persistir")
-
-            except Exception as e:
-                import traceback
-                print(f"❌ Error persistiendo tags: {e}")
-                print(f"🔍 Traceback: {traceback.format_exc()}")
-
-        # 4. Procesar con el Super Agente
-        try:
-            super_agent_result = super_agent.process_conversation(
-                conversation_data)
-            super_agent_processed = True
-        except Exception as e:
-            print(f"Error en Super Agente: {e}")
-            super_agent_processed = False
-
-        return WhatsAppAnalysisResponse(
-            conversation_id=analysis_result["conversation_id"],
-            analysis=analysis_result,
-            database_saved=database_saved,
-            super_agent_processed=super_agent_processed
-        )
+                    logger.warning("❌ Tags NO se persistieron")
+            else:
+                logger.debug("⚠️ No hay tags para persistir")
+
+            session.commit()
+            tag_persistence_service.invalidate_tags_cache()
+            logger.debug(
+                "✅ Conversación guardada en BD con ID: %s", conversation_data.id)
+        else:
+            logger.debug(
+                "⚠️ Conversación ya existe en BD: %s", conversation_data.id)
+
+    # 4. Encolar el Super Agente solo para conversaciones nuevas (un reintento con el
+    # mismo ID ya fue encolado); la respuesta no espera su procesamiento
+    if database_saved:
+        background_tasks.add_task(run_super_agent, conversation_data)
+
+    return {
+        "conversation_id": analysis_result["conversation_id"],
+        "analysis": analysis_result,
+        "database_saved": database_saved,
+        "super_agent_queued": database_saved
+    }
+
+
+@router.post("/analyze", response_model=WhatsAppAnalysisResponse)
+async def analyze_whatsapp_conversation(request: WhatsAppAnalysisRequest,
+                                        background_tasks: BackgroundTasks):
+    """Analiza una conversación de WhatsApp y la guarda en la base de datos"""
+    try:
+        # El dict ya tiene la forma de WhatsAppAnalysisResponse: se serializa sin revalidar
+        return ORJSONResponse(await _analyze_and_persist(
+            request.conversation_text,
+            request.customer_id,
+            background_tasks
+        ))
 
     except Exception as e:
         raise HTTPException(
@@ -142,8 +293,6 @@ async def analyze_whatsapp_conversation(request: WhatsAppAnalysisRequest):
 async def test_tags_persistence():
     """Endpoint de prueba para verificar la persistencia de tags"""
     try:
-        from services.tag_persistence import tag_persistence_service
-
         print(f"🧪 DEBUG: Iniciando prueba de persistencia de tags...")
         result = tag_persistence_service.test_persistence()
 
@@ -161,7 +310,6 @@ async def test_tags_persistence():
             }
 
     except Exception as e:
-        import traceback
         print(f"❌ ERROR en endpoint de prueba: {e}")
         print(f"🔍 Traceback: {traceback.format_exc()}")
         raise HTTPException(
@@ -173,22 +321,35 @@ async def get_conversations():
     """Obtiene todas las conversaciones guardadas en la BD"""
     try:
         with get_session() as session:
-            conversations = session.exec(select(Conversation)).all()
-            return {
-                "success": True,
-                "conversations": [
-                    {
-                        "id": str(conv.id),
-                        "customer_profile_id": str(conv.customer_profile_id) if conv.customer_profile_id else None,
-                        "category": conv.category,
-                        "tags": conv.tags,
-                        "sentiment": conv.sentiment,
-                        "status": conv.status,
-                        "created_at": conv.created_at.isoformat() if conv.created_at else None
-                    }
-                    for conv in conversations
-                ]
-            }
+            # Solo las columnas necesarias, sin hidratar objetos ORM
+            rows = session.exec(
+                select(
+                    Conversation.id,
+                    Conversation.customer_profile_id,
+                    Conversation.category,
+                    Conversation.tags_json,
+                    Conversation.sentiment,
+                    Conversation.status,
+                    Conversation.created_at
+                )
+            ).all()
+
+        # orjson serializa UUID y datetime de forma nativa
+        return ORJSONResponse({
+            "success": True,
+            "conversations": [
+                {
+                    "id": row.id,
+                    "customer_profile_id": row.customer_profile_id,
+                    "category": row.category,
+                    "tags": orjson.loads(row.tags_json) if row.tags_json else [],
+                    "sentiment": row.sentiment,
+                    "status": row.status,
+                    "created_at": row.created_at
+                }
+                for row in rows
+            ]
+        })
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error getting conversations: {str(e)}")
@@ -216,7 +377,7 @@ async def get_conversation(conversation_id: str):
                     "tags": conversation.tags,
                     "sentiment": conversation.sentiment,
                     "status": conversation.status,
-                    "created_at": conversation.created_at.isoformat() if conversation.created_at else None
+                    "created_at": conversation.created_at
                 }
             }
     except Exception as e:
@@ -224,23 +385,29 @@ async def get_conversation(conversation_id: str):
             status_code=500, detail=f"Error getting conversation: {str(e)}")
 
 
+async def read_upload_text(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE) -> str:
+    """Decodifica un archivo subido por bloques con un decoder UTF-8 incremental"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = io.StringIO()
+    while chunk := await file.read(chunk_size):
+        buffer.write(decoder.decode(chunk))
+    buffer.write(decoder.decode(b"", final=True))
+    return buffer.getvalue()
+
+
 @router.post("/upload")
 async def upload_whatsapp_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     customer_id: str = Form(...)
 ):
     """Sube y analiza un archivo de conversación de WhatsApp"""
     try:
-        content = await file.read()
-        conversation_text = content.decode("utf-8")
+        conversation_text = await read_upload_text(file)
 
         # Analizar y guardar
-        result = await analyze_whatsapp_conversation(
-            WhatsAppAnalysisRequest(
-                conversation_text=conversation_text,
-                customer_id=customer_id
-            )
-        )
+        result = await _analyze_and_persist(
+            conversation_text, customer_id, background_tasks)
 
         return {
             "success": True,
@@ -254,15 +421,26 @@ async def upload_whatsapp_file(
 
 
 @router.get("/tags")
-async def get_all_tags():
+async def get_all_tags(request: Request):
     """Obtiene todos los tags guardados en la BD"""
     try:
-        tags = tag_persistence_service.get_all_tags()
-        return {
-            "success": True,
-            "total_tags": len(tags),
-            "tags": tags
-        }
+        tags, etag = tag_persistence_service.get_all_tags_cached()
+
+        # El cliente ya tiene esta versión del catálogo
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+
+        return ORJSONResponse(
+            {
+                "success": True,
+                "total_tags": len(tags),
+                "tags": tags
+            },
+            headers={
+                "ETag": etag,
+                "Cache-Control": f"max-age={ALL_TAGS_CACHE_TTL_SECONDS}"
+            }
+        )
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error getting tags: {str(e)}")
@@ -289,16 +467,15 @@ async def get_conversation_tags(conversation_id: str):
 async def get_learning_status():
     """Obtiene el estado del sistema de aprendizaje"""
     try:
-        from services.super_agent import super_agent
-        from services.agents import available_agents
-
-        # Estado del Super Agente
-        super_agent_status = super_agent.get_system_status()
-
-        # Estado de agentes individuales
-        agents_status = {}
-        for agent_type, agent in available_agents.items():
-            agents_status[agent_type] = agent.get_learning_summary()
+        # Estado del Super Agente y de cada agente individual, en paralelo
+        available_agents = agents_service.available_agents
+        summary_timestamp = datetime.now().isoformat()
+        super_agent_status, *summaries = await asyncio.gather(
+            asyncio.to_thread(super_agent.get_system_status),
+            *(asyncio.to_thread(agent.get_learning_summary, summary_timestamp)
+              for agent in available_agents.values())
+        )
+        agents_status = dict(zip(available_agents.keys(), summaries))
 
         # Estado general del aprendizaje
         learning_status = {
@@ -306,7 +483,7 @@ async def get_learning_status():
             "individual_agents": agents_status,
             "total_learning_agents": len(available_agents),
             "system_learning_active": True,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
 
         return {
@@ -315,7 +492,6 @@ async def get_learning_status():
         }
 
     except Exception as e:
-        import traceback
         return {
             "success": False,
             "error": str(e),
@@ -327,8 +503,6 @@ async def get_learning_status():
 async def force_system_learning():
     """Fuerza un ciclo de aprendizaje del sistema"""
     try:
-        from services.super_agent import super_agent
-
         # Forzar ciclo de aprendizaje
         learning_result = super_agent._run_optimization_cycle()
 
@@ -336,11 +510,10 @@ async def force_system_learning():
             "success": True,
             "message": "Ciclo de aprendizaje forzado exitosamente",
             "learning_result": learning_result,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
 
     except Exception as e:
-        import traceback
         return {
             "success": False,
             "error": str(e),
@@ -352,21 +525,17 @@ async def force_system_learning():
 async def get_super_agent_learnings():
     """Obtiene todos los aprendizajes del Super Agente desde la base de datos"""
     try:
-        from core.db import get_session
-        from models.agent import AgentLearning as AgentLearningModel
-        from sqlmodel import select
-
         with get_session() as session:
             # Buscar todos los aprendizajes del Super Agente
             learnings = session.exec(
                 select(AgentLearningModel)
                 .where(AgentLearningModel.agent_type == "super_agent")
                 .order_by(AgentLearningModel.created_at.desc())
+                .limit(SUPER_AGENT_LEARNINGS_LIMIT)
             ).all()
 
-            learning_data = []
-            for learning in learnings:
-                learning_data.append({
+            learning_data = [
+                {
                     "id": learning.id,
                     "agent_type": learning.agent_type,
                     "learning_type": learning.learning_type,
@@ -374,23 +543,24 @@ async def get_super_agent_learnings():
                     "confidence_score": learning.confidence_score,
                     "category": learning.category,
                     "metadata": learning.metadata,
-                    "created_at": learning.created_at.isoformat() if learning.created_at else None
-                })
+                    "created_at": learning.created_at
+                }
+                for learning in learnings
+            ]
 
             return {
                 "success": True,
                 "total_learnings": len(learning_data),
                 "learnings": learning_data,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
 
     except Exception as e:
-        import traceback
         print(f"❌ Error obteniendo aprendizajes del Super Agente: {e}")
         return {
             "success": False,
             "error": str(e),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
 
 
@@ -402,8 +572,6 @@ async def verify_webhook(
 ):
     """Verifica el webhook de WhatsApp Business API"""
     try:
-        from services.whatsapp_api import whatsapp_api_service
-
         if hub_mode and hub_verify_token and hub_challenge:
             # Verificación del webhook
             verification_result = whatsapp_api_service.verify_webhook(
@@ -426,34 +594,60 @@ async def verify_webhook(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _as_list(value: Any) -> list:
+    """El valor si es una lista; lista vacía para cualquier otro tipo"""
+    return value if isinstance(value, list) else []
+
+
+def _webhook_messages(body: Any) -> List[dict]:
+    """Mensajes del primer entry del webhook, ignorando los niveles con tipo inesperado"""
+    entries = _as_list(body.get("entry")) if isinstance(body, dict) else []
+    if not entries or not isinstance(entries[0], dict):
+        return []
+
+    messages = []
+    for change in _as_list(entries[0].get("changes")):
+        value = change.get("value") if isinstance(change, dict) else None
+        if isinstance(value, dict):
+            messages.extend(
+                message for message in _as_list(value.get("messages")) if isinstance(message, dict))
+    return messages
+
+
 @router.post("/webhook")
-async def whatsapp_webhook(request: Request):
+async def whatsapp_webhook(request: Request, background_tasks: BackgroundTasks):
     """Webhook para recibir mensajes de WhatsApp Business API"""
     try:
-        # Obtener el cuerpo del request
-        body = await request.json()
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
-        # Verificar si es un mensaje de WhatsApp
-        if "entry" in body and "changes" in body["entry"][0]:
-            changes = body["entry"][0]["changes"]
+    # Payloads sin mensajes (estados, formatos desconocidos o malformados) se confirman sin procesar
+    messages = _webhook_messages(body)
 
-            for change in changes:
-                if change.get("value") and "messages" in change["value"]:
-                    messages = change["value"]["messages"]
+    # Procesar los mensajes en paralelo después de responder el ACK
+    if messages:
+        background_tasks.add_task(process_whatsapp_messages, messages)
 
-                    for message in messages:
-                        # Procesar cada mensaje
-                        await process_whatsapp_message(message)
+    return {"status": "ok"}
 
-        return {"status": "ok"}
 
-    except Exception as e:
-        logger.error(f"❌ Error en webhook de WhatsApp: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+async def process_whatsapp_messages(messages: List[dict]):
+    """Procesa concurrentemente los mensajes de un webhook"""
+    await asyncio.gather(
+        *(process_whatsapp_message(message) for message in messages),
+        return_exceptions=True
+    )
 
 
 async def process_whatsapp_message(message: dict):
     """Procesa un mensaje individual de WhatsApp"""
+    async with _webhook_semaphore:
+        await _process_whatsapp_message(message)
+
+
+async def _process_whatsapp_message(message: dict):
+    """Clasifica, aprende y responde un mensaje de WhatsApp"""
     try:
         # Extraer información del mensaje
         phone_number = message.get("from")
@@ -461,8 +655,8 @@ async def process_whatsapp_message(message: dict):
         message_id = message.get("id")
         timestamp = message.get("timestamp")
 
-        logger.info(
-            f"📱 Mensaje WhatsApp recibido: {phone_number} - {message_text[:50]}...")
+        logger.debug(
+            "📱 Mensaje WhatsApp recibido: %s - %.50s...", phone_number, message_text)
 
         # Crear objeto de conversación
         conversation = Conversation(
@@ -477,39 +671,23 @@ async def process_whatsapp_message(message: dict):
         )
 
         # Procesar con el SuperAgente
-        learning_outcome = super_agent.process_conversation(conversation)
+        learning_outcome = await super_agent.aprocess_conversation(conversation)
 
         # Generar respuesta automática
         response = await generate_whatsapp_response(conversation, learning_outcome)
 
         # Enviar respuesta por WhatsApp
-        from services.whatsapp_api import whatsapp_api_service
-        whatsapp_api_service.send_text_message(phone_number, response)
+        await whatsapp_api_service.send_text_message(phone_number, response)
 
-        logger.info(f"✅ Mensaje procesado y respondido: {message_id}")
+        logger.debug("✅ Mensaje procesado y respondido: %s", message_id)
 
     except Exception as e:
-        logger.error(f"❌ Error procesando mensaje WhatsApp: {e}")
+        logger.error("❌ Error procesando mensaje WhatsApp: %s", e)
 
 
 async def generate_whatsapp_response(conversation: Conversation, learning_outcome: dict) -> str:
     """Genera una respuesta automática para WhatsApp basada en el aprendizaje"""
-    try:
-        # Determinar el tipo de respuesta basándose en la categoría
-        category = conversation.category or "general"
-
-        if category == "ventas":
-            return "¡Hola! Gracias por tu consulta sobre ventas. Nuestro equipo especializado te atenderá en breve. 🛍️"
-        elif category == "soporte":
-            return "¡Hola! Entiendo que necesitas soporte técnico. Nuestro equipo de asistencia te ayudará pronto. 🔧"
-        elif category == "reclamo":
-            return "¡Hola! Lamento que hayas tenido una experiencia negativa. Nuestro equipo de atención al cliente se pondrá en contacto contigo. 📞"
-        else:
-            return "¡Hola! Gracias por contactarnos. Nuestro equipo te atenderá en breve. 😊"
-
-    except Exception as e:
-        logger.error(f"❌ Error generando respuesta WhatsApp: {e}")
-        return "¡Hola! Gracias por contactarnos. Te responderemos pronto. 😊"
+    return CATEGORY_RESPONSES.get(conversation.category, CATEGORY_RESPONSES[None])
 
 
 async def send_whatsapp_message(phone_number: str, message: str):
@@ -517,15 +695,15 @@ async def send_whatsapp_message(phone_number: str, message: str):
     try:
         # Aquí iría la lógica para enviar por WhatsApp Business API
         # Por ahora, solo logueamos
-        logger.info(
-            f"📤 Enviando mensaje WhatsApp a {phone_number}: {message[:50]}...")
+        logger.debug(
+            "📤 Enviando mensaje WhatsApp a %s: %.50s...", phone_number, message)
 
         # TODO: Implementar envío real por WhatsApp Business API
         # Ejemplo de implementación:
         # whatsapp_api.send_message(phone_number, message)
 
     except Exception as e:
-        logger.error(f"❌ Error enviando mensaje WhatsApp: {e}")
+        logger.error("❌ Error enviando mensaje WhatsApp: %s", e)
 
 
 @router.post("/send-message")
@@ -535,16 +713,14 @@ async def send_whatsapp_message_endpoint(
 ):
     """Envía un mensaje de WhatsApp manualmente"""
     try:
-        from services.whatsapp_api import whatsapp_api_service
-
-        success = whatsapp_api_service.send_text_message(phone_number, message)
+        success = await whatsapp_api_service.send_text_message(phone_number, message)
 
         if success:
             return {
                 "success": True,
                 "message": "Mensaje enviado exitosamente",
                 "phone_number": phone_number,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
         else:
             raise HTTPException(
@@ -566,9 +742,7 @@ async def send_template_message_endpoint(
 ):
     """Envía un mensaje de plantilla por WhatsApp"""
     try:
-        from services.whatsapp_api import whatsapp_api_service
-
-        success = whatsapp_api_service.send_template_message(
+        success = await whatsapp_api_service.send_template_message(
             phone_number, template_name, language_code, components
         )
 
@@ -578,7 +752,7 @@ async def send_template_message_endpoint(
                 "message": "Plantilla enviada exitosamente",
                 "phone_number": phone_number,
                 "template": template_name,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
         else:
             raise HTTPException(
@@ -599,9 +773,7 @@ async def send_interactive_message_endpoint(
 ):
     """Envía un mensaje interactivo con botones por WhatsApp"""
     try:
-        from services.whatsapp_api import whatsapp_api_service
-
-        success = whatsapp_api_service.send_interactive_message(
+        success = await whatsapp_api_service.send_interactive_message(
             phone_number, message, buttons
         )
 
@@ -611,7 +783,7 @@ async def send_interactive_message_endpoint(
                 "message": "Mensaje interactivo enviado exitosamente",
                 "phone_number": phone_number,
                 "buttons": buttons,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
         else:
             raise HTTPException(
@@ -628,16 +800,14 @@ async def send_interactive_message_endpoint(
 async def get_message_status_endpoint(message_id: str):
     """Obtiene el estado de un mensaje enviado"""
     try:
-        from services.whatsapp_api import whatsapp_api_service
-
-        status = whatsapp_api_service.get_message_status(message_id)
+        status = await whatsapp_api_service.get_message_status(message_id)
 
         if status:
             return {
                 "success": True,
                 "message_id": message_id,
                 "status": status,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now()
             }
         else:
             raise HTTPException(
@@ -654,8 +824,6 @@ async def get_message_status_endpoint(message_id: str):
 async def get_whatsapp_service_status():
     """Obtiene el estado del servicio de WhatsApp"""
     try:
-        from services.whatsapp_api import whatsapp_api_service
-
         # Verificar configuración
         config_status = {
             "base_url": whatsapp_api_service.base_url,
@@ -669,7 +837,7 @@ async def get_whatsapp_service_status():
             "service": "WhatsApp Business API",
             "status": "active" if all(config_status.values()) else "incomplete_config",
             "configuration": config_status,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         }
 
     except Exception as e:
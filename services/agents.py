@@ -1,32 +1,193 @@
 """
 Servicio de Gestión de Agentes con Sistema de Aprendizaje Individual
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Mapping, Optional, Set, Tuple
+from collections import Counter, deque
 from datetime import datetime
+from functools import lru_cache
+from itertools import count, islice
+from operator import methodcaller
+from bisect import bisect_left
+from types import MappingProxyType
+import asyncio
+import atexit
 import logging
+import queue
+import sys
+import threading
 from models.agent import AgentLearning, AgentLearningCreate
 from core.db import get_session
 from sqlmodel import Session, select
 
 logger = logging.getLogger(__name__)
 
+# Cola de aprendizajes: un hilo escritor los inserta en lote fuera de la ruta de la petición
+LEARNING_BUFFER_MAX_SIZE = 128
+LEARNING_WRITER_JOIN_SECONDS = 5.0
+
+_learning_queue: "queue.Queue[Any]" = queue.Queue()
+_WRITER_STOP = object()
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+
+def _write_learnings(batch: List[AgentLearning]) -> None:
+    """Inserta en BD un lote de aprendizajes en una sola transacción"""
+    try:
+        with get_session() as session:
+            session.bulk_save_objects(batch)
+            session.commit()
+        logger.info("💾 %d aprendizajes de agentes guardados en BD", len(batch))
+    except Exception as e:
+        logger.error(
+            "❌ Error guardando lote de %d aprendizajes en BD: %s", len(batch), e)
+
+
+def _learning_writer_loop() -> None:
+    """Hilo escritor: espera aprendizajes y los guarda en lotes de hasta LEARNING_BUFFER_MAX_SIZE"""
+    while True:
+        item = _learning_queue.get()
+        stop = item is _WRITER_STOP
+        batch = [] if stop else [item]
+
+        # Drenar lo que ya esté encolado sin esperar
+        while not stop and len(batch) < LEARNING_BUFFER_MAX_SIZE:
+            try:
+                item = _learning_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _WRITER_STOP:
+                stop = True
+            else:
+                batch.append(item)
+
+        if batch:
+            _write_learnings(batch)
+        if stop:
+            return
+
+
+def _buffer_learning(learning: AgentLearning) -> None:
+    """Encola un aprendizaje para el hilo escritor, iniciándolo si hace falta"""
+    global _writer_thread
+    if _writer_thread is None:
+        with _writer_lock:
+            if _writer_thread is None:
+                _writer_thread = threading.Thread(
+                    target=_learning_writer_loop, name="agent-learning-writer", daemon=True)
+                _writer_thread.start()
+    _learning_queue.put_nowait(learning)
+
+
+def flush_learning_buffer() -> None:
+    """Detiene el hilo escritor después de guardar todos los aprendizajes pendientes"""
+    global _writer_thread
+    with _writer_lock:
+        writer, _writer_thread = _writer_thread, None
+    if writer is None:
+        return
+    _learning_queue.put(_WRITER_STOP)
+    writer.join(LEARNING_WRITER_JOIN_SECONDS)
+
+
+# Vaciar la cola al cerrar el proceso
+atexit.register(flush_learning_buffer)
+
+# Muestreo del log por aprendizaje (1 de cada N) para no saturar el logging en ráfagas
+LEARNING_LOG_EVERY_N = 100
+_learning_log_counter = count()
+
+# Umbrales de success_rate usados por patrones, sugerencias y ajustes
+_SUCCESS_THRESHOLDS = (0.0, 0.5, 0.7, 0.8)
+
+
+def _success_band(success_rate: Optional[float]) -> Optional[float]:
+    """Reduce success_rate a un valor representativo de su intervalo entre umbrales"""
+    if success_rate is None:
+        return None
+    index = bisect_left(_SUCCESS_THRESHOLDS, success_rate)
+    if index < len(_SUCCESS_THRESHOLDS) and _SUCCESS_THRESHOLDS[index] == success_rate:
+        return _SUCCESS_THRESHOLDS[index]
+    lower = _SUCCESS_THRESHOLDS[index - 1] if index > 0 else -1.0
+    upper = _SUCCESS_THRESHOLDS[index] if index < len(
+        _SUCCESS_THRESHOLDS) else 1.0
+    return (lower + upper) / 2
+
+
+# Plantillas de patrones y sugerencias (solo cambia "pattern" en cada copia)
+_CATEGORY_PATTERN_TEMPLATE = {
+    "type": "category_pattern", "pattern": None, "strength": 0.8, "frequency": 1}
+_TAG_PATTERN_TEMPLATE = {
+    "type": "tag_pattern", "pattern": None, "strength": 0.7, "frequency": 1}
+_SENTIMENT_PATTERN_TEMPLATE = {
+    "type": "sentiment_pattern", "pattern": None, "strength": 0.6, "frequency": 1}
+_OUTCOME_PATTERN_TEMPLATE = {
+    "type": "outcome_pattern", "pattern": None, "strength": 0.9, "frequency": 1}
+
+_PERFORMANCE_SUGGESTION_TEMPLATE = {
+    "type": "performance_improvement",
+    "suggestion": "Mejorar tiempo de respuesta para conversaciones problemáticas",
+    "priority": "high",
+    "confidence": 0.8
+}
+_SPECIALIZATION_SUGGESTION_TEMPLATE = {
+    "type": "specialization_improvement",
+    "suggestion": "Profundizar en conocimientos técnicos de soporte",
+    "priority": "medium",
+    "confidence": 0.7
+}
+_KNOWLEDGE_SUGGESTION_TEMPLATE = {
+    "type": "knowledge_improvement",
+    "suggestion": "Ampliar base de conocimientos sobre resolución de errores",
+    "priority": "high",
+    "confidence": 0.9
+}
+
+# Ajustes de confianza posibles (solo lectura)
+_CONFIDENCE_UP = MappingProxyType({
+    "type": "confidence_increase",
+    "reason": "Conversación exitosa",
+    "adjustment": 0.1,
+    "new_confidence": min(1.0, 0.8 + 0.1)
+})
+_CONFIDENCE_DOWN = MappingProxyType({
+    "type": "confidence_decrease",
+    "reason": "Conversación problemática",
+    "adjustment": -0.1,
+    "new_confidence": max(0.1, 0.8 - 0.1)
+})
+
+# Tags que disparan una sugerencia propia (extensible con más tags)
+_TRIGGER_TAG_SUGGESTIONS = {
+    "error": _KNOWLEDGE_SUGGESTION_TEMPLATE
+}
+_TRIGGER_TAGS = frozenset(_TRIGGER_TAG_SUGGESTIONS)
+
 
 class BaseAgent:
     """Clase base para todos los agentes con capacidades de aprendizaje"""
 
-    def __init__(self, agent_type: str, name: str):
-        self.agent_type = agent_type
-        self.name = name
-        self.learning_history = []
-        self.performance_metrics = {}
-        self.specialization_areas = []
+    __slots__ = ("agent_type", "name", "learning_history",
+                 "performance_metrics", "specialization_areas", "_memory_lock")
+
+    def __init__(self, agent_type: str, name: str) -> None:
+        # Vocabulario finito: una sola copia de cada string en aprendizajes e historial
+        self.agent_type = sys.intern(agent_type)
+        self.name = sys.intern(name)
+        # Memoria local acotada a los últimos 100 aprendizajes
+        self.learning_history = deque(maxlen=100)
+        self.performance_metrics = Counter()
+        self.specialization_areas: Set[str] = set()
+        # Protege las actualizaciones leer-modificar-escribir de la memoria local entre hilos
+        self._memory_lock = threading.Lock()
 
         logger.info(
-            f"🤖 Agente {self.name} ({self.agent_type}) inicializado con capacidades de aprendizaje")
+            "🤖 Agente %s (%s) inicializado con capacidades de aprendizaje", self.name, self.agent_type)
 
     def learn_from_conversation(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> Dict[str, Any]:
         """Aprende de una conversación específica"""
         try:
+            # Un único timestamp por aprendizaje (resultado y memoria local)
             learning_outcome = {
                 "agent_type": self.agent_type,
                 "conversation_id": conversation.get("id"),
@@ -37,24 +198,26 @@ class BaseAgent:
                 "specialization_updates": []
             }
 
-            # 1. Identificar patrones en la conversación
-            patterns = self._identify_conversation_patterns(
-                conversation, outcome)
-            learning_outcome["patterns_identified"] = patterns
-
-            # 2. Generar sugerencias de mejora
-            improvements = self._generate_improvement_suggestions(
-                conversation, outcome, patterns)
-            learning_outcome["improvements_suggested"] = improvements
-
-            # 3. Ajustar niveles de confianza
-            confidence_adjustments = self._adjust_confidence_levels(
-                outcome, patterns)
-            learning_outcome["confidence_adjustments"] = confidence_adjustments
+            # 1-3. Patrones, sugerencias y ajustes (cacheados por entradas relevantes)
+            tags = conversation.get("tags") or []
+            patterns, improvements, confidence_adjustments = self._compute_learning_core(
+                conversation.get("category"),
+                tuple(tags[:3]),
+                _TRIGGER_TAGS.intersection(tags),
+                conversation.get("sentiment"),
+                _success_band(outcome.get("success_rate"))
+            )
+            learning_outcome["patterns_identified"] = [
+                dict(pattern) for pattern in patterns]
+            learning_outcome["improvements_suggested"] = [
+                dict(improvement) for improvement in improvements]
+            learning_outcome["confidence_adjustments"] = [
+                dict(adjustment) for adjustment in confidence_adjustments]
 
             # 4. Actualizar áreas de especialización
-            specialization_updates = self._update_specialization_areas(
-                conversation, outcome)
+            with self._memory_lock:
+                specialization_updates = self._update_specialization_areas(
+                    conversation, outcome)
             learning_outcome["specialization_updates"] = specialization_updates
 
             # 5. Guardar aprendizaje en BD
@@ -63,59 +226,69 @@ class BaseAgent:
             # 6. Actualizar memoria local del agente
             self._update_local_memory(learning_outcome)
 
-            logger.info(
-                f"🧠 Agente {self.name} aprendió de conversación {conversation.get('id')}")
+            # Solo se registra 1 de cada LEARNING_LOG_EVERY_N aprendizajes
+            if next(_learning_log_counter) % LEARNING_LOG_EVERY_N == 0 and logger.isEnabledFor(logging.INFO):
+                logger.info("🧠 Agente %s aprendió de conversación %s",
+                            self.name, conversation.get("id"))
             return learning_outcome
 
         except Exception as e:
-            logger.error(f"❌ Error en aprendizaje del agente {self.name}: {e}")
+            logger.error("❌ Error en aprendizaje del agente %s: %s", self.name, e)
             return {"error": str(e)}
 
+    @lru_cache(maxsize=2048)
+    def _compute_learning_core(self, category: Optional[str], tags_key: Tuple[str, ...],
+                               trigger_tags: frozenset, sentiment: Optional[str],
+                               success_band: Optional[float]) -> Tuple[tuple, tuple, tuple]:
+        """Calcula (patrones, sugerencias, ajustes) a partir de las entradas que los determinan"""
+        # Los tags disparadores solo importan para las sugerencias; los patrones leen tags[:3]
+        tags = list(tags_key)
+        tags.extend(trigger_tags.difference(tags_key))
+        conversation = {"category": category,
+                        "tags": tags, "sentiment": sentiment}
+        outcome = {} if success_band is None else {
+            "success_rate": success_band}
+
+        patterns = self._identify_conversation_patterns(conversation, outcome)
+        improvements = self._generate_improvement_suggestions(
+            conversation, outcome, patterns)
+        confidence_adjustments = self._adjust_confidence_levels(
+            outcome, patterns)
+        return tuple(patterns), tuple(improvements), tuple(confidence_adjustments)
+
     def _identify_conversation_patterns(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Identifica patrones en la conversación para aprendizaje"""
         patterns = []
-
-        try:
-            # Patrón 1: Categoría de conversación
-            if conversation.get("category"):
-                patterns.append({
-                    "type": "category_pattern",
-                    "pattern": f"Conversación de categoría: {conversation['category']}",
-                    "strength": 0.8,
-                    "frequency": 1
-                })
-
-            # Patrón 2: Tags utilizados
-            if conversation.get("tags"):
-                for tag in conversation["tags"][:3]:  # Top 3 tags
-                    patterns.append({
-                        "type": "tag_pattern",
-                        "pattern": f"Tag utilizado: {tag}",
-                        "strength": 0.7,
-                        "frequency": 1
-                    })
-
-            # Patrón 3: Sentimiento del cliente
-            if conversation.get("sentiment"):
-                patterns.append({
-                    "type": "sentiment_pattern",
-                    "pattern": f"Sentimiento del cliente: {conversation['sentiment']}",
-                    "strength": 0.6,
-                    "frequency": 1
-                })
-
-            # Patrón 4: Resultado del procesamiento
-            if outcome.get("success_rate"):
-                success_pattern = "exitoso" if outcome["success_rate"] > 0.7 else "problemático"
-                patterns.append({
-                    "type": "outcome_pattern",
-                    "pattern": f"Conversación {success_pattern}",
-                    "strength": 0.9,
-                    "frequency": 1
-                })
-
-        except Exception as e:
-            logger.error(f"❌ Error identificando patrones: {e}")
+        category = conversation.get("category")
+        tags = conversation.get("tags")
+        sentiment = conversation.get("sentiment")
+        success_rate = outcome.get("success_rate")
+
+        # Patrón 1: Categoría de conversación
+        if category:
+            pattern = _CATEGORY_PATTERN_TEMPLATE.copy()
+            pattern["pattern"] = f"Conversación de categoría: {category}"
+            patterns.append(pattern)
+
+        # Patrón 2: Tags utilizados
+        if tags:
+            for tag in tags[:3]:  # Top 3 tags
+                pattern = _TAG_PATTERN_TEMPLATE.copy()
+                pattern["pattern"] = f"Tag utilizado: {tag}"
+                patterns.append(pattern)
+
+        # Patrón 3: Sentimiento del cliente
+        if sentiment:
+            pattern = _SENTIMENT_PATTERN_TEMPLATE.copy()
+            pattern["pattern"] = f"Sentimiento del cliente: {sentiment}"
+            patterns.append(pattern)
+
+        # Patrón 4: Resultado del procesamiento
+        if success_rate:
+            success_pattern = "exitoso" if success_rate > 0.7 else "problemático"
+            pattern = _OUTCOME_PATTERN_TEMPLATE.copy()
+            pattern["pattern"] = f"Conversación {success_pattern}"
+            patterns.append(pattern)
 
         return patterns
 
@@ -125,201 +298,155 @@ class BaseAgent:
         """Genera sugerencias de mejora basándose en patrones identificados"""
         suggestions = []
 
-        try:
-            # Sugerencia 1: Basada en éxito de la conversación
-            if outcome.get("success_rate", 0) < 0.7:
-                suggestions.append({
-                    "type": "performance_improvement",
-                    "suggestion": "Mejorar tiempo de respuesta para conversaciones problemáticas",
-                    "priority": "high",
-                    "confidence": 0.8
-                })
-
-            # Sugerencia 2: Basada en categoría
-            if conversation.get("category") == "soporte":
-                suggestions.append({
-                    "type": "specialization_improvement",
-                    "suggestion": "Profundizar en conocimientos técnicos de soporte",
-                    "priority": "medium",
-                    "confidence": 0.7
-                })
+        # Sugerencia 1: Basada en éxito de la conversación
+        if outcome.get("success_rate", 0) < 0.7:
+            suggestions.append(_PERFORMANCE_SUGGESTION_TEMPLATE.copy())
 
-            # Sugerencia 3: Basada en tags
-            if conversation.get("tags") and "error" in conversation["tags"]:
-                suggestions.append({
-                    "type": "knowledge_improvement",
-                    "suggestion": "Ampliar base de conocimientos sobre resolución de errores",
-                    "priority": "high",
-                    "confidence": 0.9
-                })
+        # Sugerencia 2: Basada en categoría
+        if conversation.get("category") == "soporte":
+            suggestions.append(_SPECIALIZATION_SUGGESTION_TEMPLATE.copy())
 
-        except Exception as e:
-            logger.error(f"❌ Error generando sugerencias: {e}")
+        # Sugerencia 3: Basada en tags disparadores
+        tags = conversation.get("tags")
+        if tags:
+            for tag in sorted(_TRIGGER_TAGS.intersection(tags)):
+                suggestions.append(_TRIGGER_TAG_SUGGESTIONS[tag].copy())
 
         return suggestions
 
-    def _adjust_confidence_levels(self, outcome: Dict[str, Any], patterns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _adjust_confidence_levels(self, outcome: Dict[str, Any], patterns: List[Dict[str, Any]]) -> List[Mapping[str, Any]]:
         """Ajusta niveles de confianza basándose en resultados"""
         adjustments = []
 
-        try:
-            # Ajuste 1: Basado en éxito de la conversación
-            success_rate = outcome.get("success_rate", 0.5)
-            if success_rate > 0.8:
-                adjustments.append({
-                    "type": "confidence_increase",
-                    "reason": "Conversación exitosa",
-                    "adjustment": 0.1,
-                    "new_confidence": min(1.0, 0.8 + 0.1)
-                })
-            elif success_rate < 0.5:
-                adjustments.append({
-                    "type": "confidence_decrease",
-                    "reason": "Conversación problemática",
-                    "adjustment": -0.1,
-                    "new_confidence": max(0.1, 0.8 - 0.1)
-                })
-
-        except Exception as e:
-            logger.error(f"❌ Error ajustando niveles de confianza: {e}")
+        # Ajuste 1: Basado en éxito de la conversación (learn_from_conversation copia el resultado)
+        success_rate = outcome.get("success_rate", 0.5)
+        if success_rate > 0.8:
+            adjustments.append(_CONFIDENCE_UP)
+        elif success_rate < 0.5:
+            adjustments.append(_CONFIDENCE_DOWN)
 
         return adjustments
 
     def _update_specialization_areas(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Actualiza áreas de especialización del agente"""
         updates = []
+        success_rate = outcome.get("success_rate", 0)
+        specialization_areas = self.specialization_areas
+
+        # Actualización 1: Basada en categoría exitosa
+        if success_rate > 0.8:
+            category = conversation.get("category")
+            if category and category not in specialization_areas:
+                specialization_areas.add(sys.intern(category))
+                updates.append({
+                    "type": "specialization_added",
+                    "area": category,
+                    "reason": "Alto éxito en conversaciones de esta categoría",
+                    "confidence": 0.8
+                })
 
-        try:
-            # Actualización 1: Basada en categoría exitosa
-            if outcome.get("success_rate", 0) > 0.8:
-                category = conversation.get("category")
-                if category and category not in self.specialization_areas:
-                    self.specialization_areas.append(category)
+        # Actualización 2: Basada en tags exitosos
+        tags = conversation.get("tags")
+        if tags and success_rate > 0.7:
+            for tag in tags[:2]:  # Top 2 tags
+                if tag not in specialization_areas:
+                    specialization_areas.add(sys.intern(tag))
                     updates.append({
                         "type": "specialization_added",
-                        "area": category,
-                        "reason": "Alto éxito en conversaciones de esta categoría",
-                        "confidence": 0.8
+                        "area": tag,
+                        "reason": "Éxito en conversaciones con este tag",
+                        "confidence": 0.7
                     })
 
-            # Actualización 2: Basada en tags exitosos
-            if conversation.get("tags") and outcome.get("success_rate", 0) > 0.7:
-                for tag in conversation["tags"][:2]:  # Top 2 tags
-                    if tag not in self.specialization_areas:
-                        self.specialization_areas.append(tag)
-                        updates.append({
-                            "type": "specialization_added",
-                            "area": tag,
-                            "reason": "Éxito en conversaciones con este tag",
-                            "confidence": 0.7
-                        })
-
-        except Exception as e:
-            logger.error(f"❌ Error actualizando áreas de especialización: {e}")
-
         return updates
 
-    def _save_learning_to_db(self, learning_outcome: Dict[str, Any]):
-        """Guarda el aprendizaje del agente en la base de datos"""
+    def _save_learning_to_db(self, learning_outcome: Dict[str, Any]) -> None:
+        """Encola el aprendizaje del agente para guardarlo en lote en la base de datos"""
         try:
-            with get_session() as session:
-                # Guardar patrón principal de aprendizaje
-                learning = AgentLearning(
-                    agent_type=self.agent_type,
-                    learning_type="agent_learning",
-                    content=f"Agente {self.name} aprendió de conversación {learning_outcome.get('conversation_id')}",
-                    confidence_score=0.8,
-                    category="agent_learning",
-                    metadata={
-                        "patterns_identified": len(learning_outcome.get("patterns_identified", [])),
-                        "improvements_suggested": len(learning_outcome.get("improvements_suggested", [])),
-                        "confidence_adjustments": len(learning_outcome.get("confidence_adjustments", [])),
-                        "specialization_updates": len(learning_outcome.get("specialization_updates", []))
-                    }
-                )
-
-                session.add(learning)
-                session.commit()
-
-                logger.info(
-                    f"💾 Aprendizaje del agente {self.name} guardado en BD")
+            # Guardar patrón principal de aprendizaje
+            learning = AgentLearning(
+                agent_type=self.agent_type,
+                learning_type="agent_learning",
+                content=f"Agente {self.name} aprendió de conversación {learning_outcome.get('conversation_id')}",
+                confidence_score=0.8,
+                category="agent_learning",
+                metadata={
+                    "patterns_identified": len(learning_outcome.get("patterns_identified", [])),
+                    "improvements_suggested": len(learning_outcome.get("improvements_suggested", [])),
+                    "confidence_adjustments": len(learning_outcome.get("confidence_adjustments", [])),
+                    "specialization_updates": len(learning_outcome.get("specialization_updates", []))
+                }
+            )
+
+            _buffer_learning(learning)
 
         except Exception as e:
-            logger.error(f"❌ Error guardando aprendizaje en BD: {e}")
+            logger.error("❌ Error guardando aprendizaje en BD: %s", e)
 
-    def _update_local_memory(self, learning_outcome: Dict[str, Any]):
+    def _update_local_memory(self, learning_outcome: Dict[str, Any]) -> None:
         """Actualiza la memoria local del agente"""
-        try:
-            # Agregar a historial de aprendizaje
-            self.learning_history.append({
-                "timestamp": datetime.now().isoformat(),
-                "conversation_id": learning_outcome.get("conversation_id"),
-                "patterns": learning_outcome.get("patterns_identified", []),
-                "improvements": learning_outcome.get("improvements_suggested", []),
-                "confidence_adjustments": learning_outcome.get("confidence_adjustments", [])
-            })
+        entry = {
+            "timestamp": learning_outcome["learning_timestamp"],
+            "conversation_id": learning_outcome.get("conversation_id"),
+            "patterns": learning_outcome.get("patterns_identified", []),
+            "improvements": learning_outcome.get("improvements_suggested", []),
+            "confidence_adjustments": learning_outcome.get("confidence_adjustments", [])
+        }
 
-            # Mantener solo los últimos 100 aprendizajes
-            if len(self.learning_history) > 100:
-                self.learning_history = self.learning_history[-100:]
+        with self._memory_lock:
+            # Agregar a historial de aprendizaje
+            self.learning_history.append(entry)
 
             # Actualizar métricas de rendimiento
             self._update_performance_metrics(learning_outcome)
 
-        except Exception as e:
-            logger.error(f"❌ Error actualizando memoria local: {e}")
-
-    def _update_performance_metrics(self, learning_outcome: Dict[str, Any]):
+    def _update_performance_metrics(self, learning_outcome: Dict[str, Any]) -> None:
         """Actualiza métricas de rendimiento del agente"""
-        try:
-            conversation_id = learning_outcome.get("conversation_id")
-            if conversation_id:
-                # Métrica: Tasa de aprendizaje
-                if "learning_rate" not in self.performance_metrics:
-                    self.performance_metrics["learning_rate"] = 0.0
-
-                # Métrica: Patrones identificados
-                if "patterns_identified" not in self.performance_metrics:
-                    self.performance_metrics["patterns_identified"] = 0
-                self.performance_metrics["patterns_identified"] += len(
-                    learning_outcome.get("patterns_identified", []))
-
-                # Métrica: Mejoras sugeridas
-                if "improvements_suggested" not in self.performance_metrics:
-                    self.performance_metrics["improvements_suggested"] = 0
-                self.performance_metrics["improvements_suggested"] += len(
-                    learning_outcome.get("improvements_suggested", []))
-
-        except Exception as e:
-            logger.error(f"❌ Error actualizando métricas de rendimiento: {e}")
+        if learning_outcome.get("conversation_id"):
+            # Tasa de aprendizaje, patrones identificados y mejoras sugeridas
+            self.performance_metrics.update({
+                "learning_rate": 0.0,
+                "patterns_identified": len(learning_outcome.get("patterns_identified", ())),
+                "improvements_suggested": len(learning_outcome.get("improvements_suggested", ()))
+            })
 
-    def get_learning_summary(self) -> Dict[str, Any]:
+    def get_learning_summary(self, timestamp: Optional[str] = None) -> Dict[str, Any]:
         """Obtiene un resumen del aprendizaje del agente"""
+        # Instantánea bajo el lock: otros hilos modifican la memoria mientras se serializa
+        with self._memory_lock:
+            total_learnings = len(self.learning_history)
+            specialization_areas = sorted(self.specialization_areas)
+            performance_metrics = dict(self.performance_metrics)
+            recent_learnings = list(
+                islice(reversed(self.learning_history), 5))[::-1]
+
         return {
             "agent_type": self.agent_type,
             "name": self.name,
-            "total_learnings": len(self.learning_history),
-            "specialization_areas": self.specialization_areas,
-            "performance_metrics": self.performance_metrics,
-            "recent_learnings": self.learning_history[-5:] if self.learning_history else [],
-            "learning_timestamp": datetime.now().isoformat()
+            "total_learnings": total_learnings,
+            "specialization_areas": specialization_areas,
+            "performance_metrics": performance_metrics,
+            "recent_learnings": recent_learnings,
+            "learning_timestamp": timestamp or datetime.now().isoformat()
         }
 
 
 class SalesAgent(BaseAgent):
     """Agente especializado en ventas con aprendizaje específico"""
 
-    def __init__(self):
+    __slots__ = ("sales_metrics",)
+
+    def __init__(self) -> None:
         super().__init__("sales", "Agente de Ventas")
-        self.specialization_areas = [
-            "ventas", "productos", "cotizaciones", "objeciones"]
+        self.specialization_areas = {
+            "ventas", "productos", "cotizaciones", "objeciones"}
         self.sales_metrics = {
             "conversion_rate": 0.0,
             "average_deal_size": 0.0,
             "sales_cycle_length": 0.0
         }
 
-    def learn_from_sales_conversation(self, conversation: Dict[str, Any], outcome: Dict[str, Any]):
+    def learn_from_sales_conversation(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> Dict[str, Any]:
         """Aprende específicamente de conversaciones de ventas"""
         # Llamar al método base de aprendizaje
         learning_outcome = self.learn_from_conversation(conversation, outcome)
@@ -332,12 +459,12 @@ class SalesAgent(BaseAgent):
 
         return learning_outcome
 
-    def _learn_from_successful_sale(self, conversation: Dict[str, Any], outcome: Dict[str, Any]):
+    def _learn_from_successful_sale(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> None:
         """Aprende de ventas exitosas"""
         # Implementar lógica específica de aprendizaje de ventas exitosas
         pass
 
-    def _learn_from_failed_sale(self, conversation: Dict[str, Any], outcome: Dict[str, Any]):
+    def _learn_from_failed_sale(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> None:
         """Aprende de ventas fallidas"""
         # Implementar lógica específica de aprendizaje de ventas fallidas
         pass
@@ -346,17 +473,19 @@ class SalesAgent(BaseAgent):
 class SupportAgent(BaseAgent):
     """Agente especializado en soporte técnico con aprendizaje específico"""
 
-    def __init__(self):
+    __slots__ = ("support_metrics",)
+
+    def __init__(self) -> None:
         super().__init__("support", "Agente de Soporte")
-        self.specialization_areas = ["soporte",
-            "técnico", "problemas", "soluciones"]
+        self.specialization_areas = {"soporte",
+            "técnico", "problemas", "soluciones"}
         self.support_metrics = {
             "resolution_time": 0.0,
             "first_call_resolution": 0.0,
             "customer_satisfaction": 0.0
         }
 
-    def learn_from_support_conversation(self, conversation: Dict[str, Any], outcome: Dict[str, Any]):
+    def learn_from_support_conversation(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> Dict[str, Any]:
         """Aprende específicamente de conversaciones de soporte"""
         # Llamar al método base de aprendizaje
         learning_outcome = self.learn_from_conversation(conversation, outcome)
@@ -369,12 +498,12 @@ class SupportAgent(BaseAgent):
 
         return learning_outcome
 
-    def _learn_from_resolved_issue(self, conversation: Dict[str, Any], outcome: Dict[str, Any]):
+    def _learn_from_resolved_issue(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> None:
         """Aprende de problemas resueltos"""
         # Implementar lógica específica de aprendizaje de problemas resueltos
         pass
 
-    def _learn_from_unresolved_issue(self, conversation: Dict[str, Any], outcome: Dict[str, Any]):
+    def _learn_from_unresolved_issue(self, conversation: Dict[str, Any], outcome: Dict[str, Any]) -> None:
         """Aprende de problemas no resueltos"""
         # Implementar lógica específica de aprendizaje de problemas no resueltos
         pass
@@ -383,10 +512,12 @@ class SupportAgent(BaseAgent):
 class CoordinatorAgent(BaseAgent):
     """Agente coordinador que gestiona múltiples agentes especializados"""
 
-    def __init__(self):
+    __slots__ = ("coordination_metrics",)
+
+    def __init__(self) -> None:
         super().__init__("coordinator", "Agente Coordinador")
-        self.specialization_areas = ["coordinación",
-            "enrutamiento", "gestión", "optimización"]
+        self.specialization_areas = {"coordinación",
+            "enrutamiento", "gestión", "optimización"}
         self.coordination_metrics = {
             "agents_coordinated": 0,
             "conflicts_resolved": 0,
@@ -406,22 +537,35 @@ class CoordinatorAgent(BaseAgent):
                 "efficiency_score": 0.8
             }
 
-            # Analizar resultados de agentes
-            for agent_type, result in agent_results.items():
+            # Analizar resultados de agentes y consolidar sus acciones en un solo recorrido
+            unified_plan = {
+                "actions": [],
+                "priorities": [],
+                "timeline": {},
+                "resources_needed": []
+            }
+            actions = unified_plan["actions"]
+            agents_coordinated = 0
+            conflicts_detected = 0
+            for result in agent_results.values():
                 if result.get("success", False):
-                    self.coordination_metrics["agents_coordinated"] += 1
+                    agents_coordinated += 1
+                    if "result" in result:
+                        agent_result = result["result"]
+                        if "recommendations" in agent_result:
+                            actions.extend(agent_result["recommendations"])
                 else:
                     # Detectar conflictos
-                    coordination_result["conflicts_detected"] += 1
+                    conflicts_detected += 1
+            self.coordination_metrics["agents_coordinated"] += agents_coordinated
+            coordination_result["conflicts_detected"] = conflicts_detected
 
             # Resolver conflictos (simulado)
             if coordination_result["conflicts_detected"] > 0:
                 coordination_result["conflicts_resolved"] = coordination_result["conflicts_detected"]
                 self.coordination_metrics["conflicts_resolved"] += coordination_result["conflicts_resolved"]
 
-            # Crear plan unificado
-            coordination_result["unified_plan"] = self._create_unified_plan(
-                agent_results)
+            coordination_result["unified_plan"] = unified_plan
 
             # Aprender de la coordinación
             self.learn_from_conversation(conversation, coordination_result)
@@ -429,73 +573,47 @@ class CoordinatorAgent(BaseAgent):
             return coordination_result
 
         except Exception as e:
-            logger.error(f"❌ Error coordinando agentes: {e}")
+            logger.error("❌ Error coordinando agentes: %s", e)
             return {"error": str(e)}
 
-    def _create_unified_plan(self, agent_results: Dict[str, Any]) -> Dict[str, Any]:
-        """Crea un plan unificado basándose en los resultados de todos los agentes"""
-        unified_plan = {
-            "actions": [],
-            "priorities": [],
-            "timeline": {},
-            "resources_needed": []
-        }
-
-        # Consolidar acciones de todos los agentes
-        for agent_type, result in agent_results.items():
-            if result.get("success", False) and "result" in result:
-                agent_result = result["result"]
-                if "recommendations" in agent_result:
-                    unified_plan["actions"].extend(
-                        agent_result["recommendations"])
 
-        return unified_plan
-
-
-# Instancias globales de agentes
-sales_agent = SalesAgent()
-support_agent = SupportAgent()
-coordinator_agent = CoordinatorAgent()
-
-# Diccionario de agentes disponibles
-available_agents = {
-    "sales": sales_agent,
-    "support": support_agent,
-    "coordinator": coordinator_agent
+# Método de aprendizaje especializado por tipo de agente (el resto usa learn_from_conversation)
+_AGENT_LEARN_METHODS = {
+    "sales": "learn_from_sales_conversation",
+    "support": "learn_from_support_conversation"
 }
 
 
 class AgentManager:
     """Gestor central de todos los agentes del sistema"""
 
-    def __init__(self):
-        self.agents = available_agents
+    def __init__(self) -> None:
+        self.agents = _lazy_global("available_agents")
         self.agent_performance = {}
+        self._performance_lock = threading.Lock()
         self.routing_rules = {}
+        # Tabla de despacho: método de aprendizaje de cada agente resuelto una sola vez
+        self._handlers = {
+            agent_type: getattr(agent, _AGENT_LEARN_METHODS.get(agent_type, "learn_from_conversation"))
+            for agent_type, agent in self.agents.items()
+        }
 
         logger.info(
-            f"🤖 AgentManager inicializado con {len(self.agents)} agentes")
+            "🤖 AgentManager inicializado con %d agentes", len(self.agents))
 
     def route_conversation(self, conversation, agent_type: str, context: Dict[str, Any]) -> Dict[str, Any]:
         """Enruta una conversación a un agente específico"""
         try:
-            if agent_type not in self.agents:
+            handler = self._handlers.get(agent_type)
+            if handler is None:
                 logger.warning(
-                    f"⚠️ Agente {agent_type} no encontrado, usando coordinador")
+                    "⚠️ Agente %s no encontrado, usando coordinador", agent_type)
                 agent_type = "coordinator"
+                handler = self._handlers.get(agent_type)
 
-            agent = self.agents.get(agent_type)
-            if agent:
+            if handler:
                 # Procesar con el agente específico
-                if agent_type == "sales":
-                    result = agent.learn_from_sales_conversation(
-                        conversation, context)
-                elif agent_type == "support":
-                    result = agent.learn_from_support_conversation(
-                        conversation, context)
-                else:
-                    result = agent.learn_from_conversation(
-                        conversation, context)
+                result = handler(conversation, context)
 
                 # Actualizar métricas de rendimiento
                 self._update_agent_performance(agent_type, result)
@@ -516,7 +634,7 @@ class AgentManager:
                 }
                 
         except Exception as e:
-            logger.error(f"❌ Error enrutando conversación a {agent_type}: {e}")
+            logger.error("❌ Error enrutando conversación a %s: %s", agent_type, e)
             return {
                 "agent_type": agent_type,
                 "result": None,
@@ -525,6 +643,10 @@ class AgentManager:
                 "timestamp": datetime.now().isoformat()
             }
     
+    async def aroute_conversation(self, conversation, agent_type: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Versión asíncrona de route_conversation para handlers async (no bloquea el event loop)"""
+        return await asyncio.to_thread(self.route_conversation, conversation, agent_type, context)
+
     def get_agent_status(self, agent_type: str) -> Dict[str, Any]:
         """Obtiene el estado de un agente específico"""
         if agent_type in self.agents:
@@ -535,35 +657,67 @@ class AgentManager:
     
     def get_all_agents_status(self) -> Dict[str, Any]:
         """Obtiene el estado de todos los agentes"""
-        status = {}
-        for agent_type, agent in self.agents.items():
-            status[agent_type] = agent.get_learning_summary()
-        return status
+        # Un único timestamp compartido por todos los resúmenes
+        get_summary = methodcaller("get_learning_summary", datetime.now().isoformat())
+        return {agent_type: get_summary(agent) for agent_type, agent in self.agents.items()}
     
-    def _update_agent_performance(self, agent_type: str, result: Dict[str, Any]):
+    def _update_agent_performance(self, agent_type: str, result: Dict[str, Any]) -> None:
         """Actualiza las métricas de rendimiento del agente"""
         try:
-            if agent_type not in self.agent_performance:
-                self.agent_performance[agent_type] = {
+            learned = bool(result.get("patterns_identified") or result.get("improvements_suggested"))
+            last_activity = datetime.now().isoformat()
+
+            # Varias rutas pueden actualizar el mismo agente en paralelo (aroute_conversation)
+            with self._performance_lock:
+                performance = self.agent_performance.setdefault(agent_type, {
                     "total_conversations": 0,
                     "successful_conversations": 0,
                     "learning_count": 0,
                     "last_activity": None
-                }
-            
-            # Actualizar métricas
-            self.agent_performance[agent_type]["total_conversations"] += 1
-            if result.get("success", False):
-                self.agent_performance[agent_type]["successful_conversations"] += 1
-            
-            if result.get("patterns_identified") or result.get("improvements_suggested"):
-                self.agent_performance[agent_type]["learning_count"] += 1
-            
-            self.agent_performance[agent_type]["last_activity"] = datetime.now().isoformat()
+                })
+
+                # Actualizar métricas
+                performance["total_conversations"] += 1
+                if result.get("success", False):
+                    performance["successful_conversations"] += 1
+
+                if learned:
+                    performance["learning_count"] += 1
+
+                performance["last_activity"] = last_activity
             
         except Exception as e:
-            logger.error(f"❌ Error actualizando métricas de rendimiento: {e}")
+            logger.error("❌ Error actualizando métricas de rendimiento: %s", e)
+
+
+# Instancias globales (agentes, diccionario de agentes disponibles y AgentManager).
+# Se crean en el primer acceso vía __getattr__ del módulo (PEP 562). Un
+# "from services.agents import agent_manager" las crea al importar: para diferirlas,
+# importar el módulo y leer el atributo en el primer uso
+_LAZY_GLOBALS = {
+    "sales_agent": SalesAgent,
+    "support_agent": SupportAgent,
+    "coordinator_agent": CoordinatorAgent,
+    "available_agents": lambda: {
+        "sales": _lazy_global("sales_agent"),
+        "support": _lazy_global("support_agent"),
+        "coordinator": _lazy_global("coordinator_agent")
+    },
+    "agent_manager": AgentManager
+}
+_lazy_globals_lock = threading.RLock()
+
+
+def _lazy_global(name: str) -> Any:
+    """Devuelve la instancia global indicada, creándola si aún no existe"""
+    module_globals = globals()
+    with _lazy_globals_lock:
+        if name not in module_globals:
+            module_globals[name] = _LAZY_GLOBALS[name]()
+        return module_globals[name]
 
 
-# Instancia global del AgentManager
-agent_manager = AgentManager()
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_GLOBALS:
+        return _lazy_global(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
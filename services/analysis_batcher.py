@@ -0,0 +1,155 @@
+"""
+Agrupa en micro-lotes las peticiones de análisis de conversaciones
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from core.config import settings
+from services.vector_store import vector_store
+from services.whatsapp_analyzer import whatsapp_analyzer
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisBatcher:
+    """Acumula peticiones hasta max_batch_size o max_wait_ms y las analiza en un solo lote"""
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 10.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        # Lotes en curso: cada lote se procesa en su propia tarea
+        self._batches: Set[asyncio.Task] = set()
+        # Peticiones sin resolver (en cola, en un lote en formación o en proceso)
+        self._pending: Set[asyncio.Future] = set()
+
+    @property
+    def running(self) -> bool:
+        """Indica si el consumidor está activo"""
+        return self._consumer is not None and not self._consumer.done()
+
+    def start(self):
+        """Inicia el consumidor en el event loop actual"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._consumer = asyncio.create_task(self._consume())
+        logger.info(
+            f"🚀 Micro-batching de análisis iniciado (lote={self.max_batch_size}, espera={self.max_wait_ms}ms)")
+
+    async def stop(self):
+        """Detiene el consumidor"""
+        if not self.running:
+            return
+        self._consumer.cancel()
+        for task in self._batches:
+            task.cancel()
+        await asyncio.gather(self._consumer, *self._batches, return_exceptions=True)
+
+        # Las peticiones que quedaron en la cola o en lotes cancelados no deben esperar para siempre
+        for future in list(self._pending):
+            if not future.done():
+                future.set_exception(RuntimeError("batcher stopped"))
+        self._consumer = None
+        self._queue = None
+        self._batches.clear()
+        self._pending.clear()
+        logger.info("🔚 Micro-batching de análisis detenido")
+
+    async def analyze(self, conversation_text: str, customer_id: str) -> Dict[str, Any]:
+        """Encola una conversación y espera su análisis"""
+        if not self.running:
+            # Sin consumidor (p. ej. fuera del lifespan) se analiza directamente
+            return await asyncio.to_thread(
+                whatsapp_analyzer.analyze_conversation_text, conversation_text, customer_id)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        await self._queue.put((conversation_text, customer_id, future))
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[str, str, asyncio.Future]]:
+        """Toma el primer elemento y completa el lote hasta el tamaño o la espera máxima"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _consume(self):
+        """Bucle del consumidor: lanza cada lote en su propia tarea sin esperar a que termine"""
+        while True:
+            batch = await self._collect_batch()
+            task = asyncio.create_task(self._process_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _process_batch(self, batch: List[Tuple[str, str, asyncio.Future]]):
+        """Clasifica cada conversación en paralelo, etiqueta el lote con un solo encode
+        y entrega cada resultado en cuanto está listo; un error solo afecta a su petición"""
+        classified = await asyncio.gather(*(
+            whatsapp_analyzer.aclassify_and_extract(conversation_text)
+            for conversation_text, _, _ in batch
+        ), return_exceptions=True)
+
+        items, futures = [], []
+        for (conversation_text, customer_id, future), result in zip(batch, classified):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Error clasificando conversación del lote: {result}")
+                if not future.done():
+                    future.set_exception(result)
+                continue
+            classification, entities = result
+            items.append((conversation_text, customer_id, classification, entities))
+            futures.append(future)
+
+        if not items:
+            return
+
+        try:
+            analyzed = await asyncio.to_thread(
+                whatsapp_analyzer.analyze_classified_batch, items)
+        except Exception as e:
+            logger.error(f"❌ Error etiquetando lote de {len(items)} conversaciones: {e}")
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        vector_items = []
+        for future, result in zip(futures, analyzed):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Error analizando conversación del lote: {result}")
+                if not future.done():
+                    future.set_exception(result)
+                continue
+            analysis_result, vector_item = result
+            vector_items.append(vector_item)
+            if not future.done():
+                future.set_result(analysis_result)
+
+        # Indexar todos los embeddings del lote en una sola llamada (fuera de la espera de las peticiones)
+        if vector_items:
+            try:
+                await asyncio.to_thread(vector_store.add_batch, vector_items)
+            except Exception as e:
+                logger.error(f"❌ Error indexando lote de {len(vector_items)} conversaciones: {e}")
+
+
+# Instancia global del agrupador
+analysis_batcher = AnalysisBatcher(
+    max_batch_size=settings.ANALYSIS_BATCH_SIZE,
+    max_wait_ms=settings.ANALYSIS_BATCH_WAIT_MS
+)
@@ -1,25 +1,38 @@
-from typing import Iterable
+from typing import Iterable, Iterator
 from dataclasses import dataclass
 from joblib import dump, load
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import SGDClassifier
 from sklearn.svm import LinearSVC
 from sklearn.pipeline import Pipeline
-import csv, os
+from collections import OrderedDict
+import csv, hashlib, os, threading
 
 MODEL_PATH = "models/clf.joblib"
 
+# Pipeline cargado en memoria junto con el mtime del archivo del que se leyó
+_pipeline: Pipeline | None = None
+_pipeline_mtime: float | None = None
+_pipeline_lock = threading.Lock()
+
+# Caché LRU de etiquetas por hash del texto (se vacía al cambiar el pipeline)
+LABEL_CACHE_MAXSIZE = 10_000
+_label_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_label_cache_lock = threading.Lock()
+
 @dataclass
 class TrainItem:
     text: str
     label: str
 
-def load_seed_csv(path: str) -> list[TrainItem]:
-    out = []
+def iter_seed_csv(path: str) -> Iterator[TrainItem]:
     with open(path, newline="", encoding="utf-8") as f:
         rdr = csv.DictReader(f)
         for row in rdr:
-            out.append(TrainItem(text=row["text"], label=row["label"]))
-    return out
+            yield TrainItem(text=row["text"], label=row["label"])
+
+def load_seed_csv(path: str) -> list[TrainItem]:
+    return list(iter_seed_csv(path))
 
 def build_pipeline() -> Pipeline:
     return Pipeline([
@@ -27,15 +40,88 @@ def build_pipeline() -> Pipeline:
         ("clf", LinearSVC())
     ])
 
+def build_stream_pipeline() -> Pipeline:
+    """Pipeline sin vocabulario (hashing) entrenable por lotes con partial_fit"""
+    return Pipeline([
+        ("hv", HashingVectorizer(n_features=2**18, ngram_range=(1,2),
+                                 alternate_sign=False, norm="l2")),
+        ("clf", SGDClassifier(loss="hinge", alpha=1e-5))
+    ])
+
+def _save_pipeline(pipe: Pipeline) -> str:
+    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
+    dump(pipe, MODEL_PATH)
+    _set_pipeline(pipe, os.path.getmtime(MODEL_PATH))
+    return MODEL_PATH
+
+def train_streaming(csv_path: str, chunksize: int = 10_000) -> tuple[str, int]:
+    """Entrena por lotes sin cargar el CSV completo en memoria; devuelve (ruta, muestras)"""
+    # Primera pasada: solo las etiquetas (partial_fit necesita todas las clases de entrada)
+    classes = sorted({item.label for item in iter_seed_csv(csv_path)})
+    pipe = build_stream_pipeline()
+    vectorizer, clf = pipe.named_steps["hv"], pipe.named_steps["clf"]
+
+    samples = 0
+    chunk: list[TrainItem] = []
+    for item in iter_seed_csv(csv_path):
+        chunk.append(item)
+        if len(chunk) >= chunksize:
+            clf.partial_fit(vectorizer.transform([d.text for d in chunk]),
+                            [d.label for d in chunk], classes=classes)
+            samples += len(chunk)
+            chunk = []
+    if chunk:
+        clf.partial_fit(vectorizer.transform([d.text for d in chunk]),
+                        [d.label for d in chunk], classes=classes)
+        samples += len(chunk)
+
+    return _save_pipeline(pipe), samples
+
 def train_and_save(data: Iterable[TrainItem]) -> str:
     X = [d.text for d in data]
     y = [d.label for d in data]
     pipe = build_pipeline()
     pipe.fit(X, y)
-    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
-    dump(pipe, MODEL_PATH)
-    return MODEL_PATH
+    return _save_pipeline(pipe)
+
+def _set_pipeline(pipe: Pipeline, mtime: float) -> None:
+    global _pipeline, _pipeline_mtime
+    with _pipeline_lock:
+        _pipeline, _pipeline_mtime = pipe, mtime
+    with _label_cache_lock:
+        _label_cache.clear()
+
+def get_pipeline() -> Pipeline:
+    """Devuelve el pipeline en memoria; solo se deserializa de disco si el archivo cambió"""
+    mtime = os.path.getmtime(MODEL_PATH)
+    if _pipeline is None or mtime != _pipeline_mtime:
+        _set_pipeline(load(MODEL_PATH), mtime)
+    return _pipeline
+
+def _text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
 
 def predict(texts: list[str]) -> list[str]:
-    pipe: Pipeline = load(MODEL_PATH)
-    return pipe.predict(texts).tolist()
+    """Predice etiquetas; solo los textos no vistos pasan por TF-IDF + SVM"""
+    pipe = get_pipeline()
+    keys = [_text_key(t) for t in texts]
+    labels: dict[bytes, str] = {}
+    with _label_cache_lock:
+        for k in keys:
+            if k in _label_cache:
+                _label_cache.move_to_end(k)
+                labels[k] = _label_cache[k]
+
+    # Textos sin etiqueta en caché (sin repetir duplicados del mismo lote)
+    missing = {k: t for k, t in zip(keys, texts) if k not in labels}
+    if missing:
+        predicted = pipe.predict(list(missing.values())).tolist()
+        labels.update(zip(missing.keys(), predicted))
+        with _label_cache_lock:
+            for k, label in zip(missing.keys(), predicted):
+                _label_cache[k] = label
+                _label_cache.move_to_end(k)
+            while len(_label_cache) > LABEL_CACHE_MAXSIZE:
+                _label_cache.popitem(last=False)
+
+    return [labels[k] for k in keys]
@@ -0,0 +1,103 @@
+"""
+Caché persistente (SQLite) de resultados del LLM por conversación
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import orjson
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Intervalo mínimo (s) entre purgas de entradas vencidas al escribir
+PURGE_INTERVAL_SECONDS = 600
+
+
+def conv_hash(conversation_text: str) -> str:
+    """Hash estable del texto de una conversación"""
+    return hashlib.sha256(conversation_text.encode()).hexdigest()
+
+
+class ConversationCache:
+    """Guarda en disco clasificación/entidades por hash de conversación para no repetir llamadas al LLM"""
+
+    def __init__(self, path: str, ttl_seconds: float = 3600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._last_purge = time.time()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Conexión SQLite creada en el primer uso"""
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS conv_cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)")
+            self._connection = connection
+        return self._connection
+
+    def get(self, key: str) -> Optional[Any]:
+        """Devuelve el valor vigente de la clave o None"""
+        try:
+            with self._lock:
+                row = self.connection.execute(
+                    "SELECT value, expires_at FROM conv_cache WHERE key = ?", (key,)).fetchone()
+                if row is None or row[1] < time.time():
+                    self.stats["misses"] += 1
+                    return None
+                self.stats["hits"] += 1
+            return orjson.loads(row[0])
+        except Exception as e:
+            logger.error(f"❌ Error leyendo caché de conversaciones: {e}")
+            return None
+
+    def set(self, key: str, value: Any):
+        """Guarda el valor de la clave con el TTL configurado"""
+        try:
+            payload = orjson.dumps(value)
+            with self._lock:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO conv_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, payload, time.time() + self.ttl_seconds))
+                self.connection.commit()
+            # Purga oportunista: las claves de conversaciones únicas no se vuelven a leer
+            if time.time() - self._last_purge > PURGE_INTERVAL_SECONDS:
+                self.purge_expired()
+        except Exception as e:
+            logger.error(f"❌ Error guardando caché de conversaciones: {e}")
+
+    def purge_expired(self) -> int:
+        """Elimina las entradas vencidas"""
+        with self._lock:
+            cursor = self.connection.execute(
+                "DELETE FROM conv_cache WHERE expires_at < ?", (time.time(),))
+            self.connection.commit()
+            self._last_purge = time.time()
+            return cursor.rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Aciertos y fallos de la caché"""
+        total = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / total if total else 0.0
+        }
+
+
+# Instancia global de la caché de conversaciones
+conv_cache = ConversationCache(
+    path=os.path.join(settings.DATA_DIR, "conv_cache.sqlite"),
+    ttl_seconds=settings.CONV_CACHE_TTL_SECONDS
+)
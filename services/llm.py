@@ -1,41 +1,230 @@
 import ollama
-from typing import List, Dict, Any, Optional
-import json
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import httpx
+import orjson
+import re
+import threading
 import time
+from collections import Counter
+from core.config import settings
+from core.llm_cache import llm_cache
+
+# System prompts constantes: el prefijo de la petición no cambia entre llamadas y
+# Ollama puede reutilizar su KV cache; el contexto dinámico va en un mensaje aparte
+_INTENT_RESPONSE_FORMAT = """
+        
+        Responde solo con un JSON válido con esta estructura:
+        {
+            "intent": "descripción_de_la_intención",
+            "confidence": 0.95,
+            "urgency": "low/medium/high",
+            "details": "explicación_detallada",
+            "next_steps": ["paso1", "paso2"]
+        }"""
+
+INTENT_SYSTEM_PROMPTS = {
+    "purchase_intent": "Eres un analista de intenciones de compra. Analiza si el cliente tiene intención de comprar y qué tan urgente es." + _INTENT_RESPONSE_FORMAT,
+    "problem_analysis": "Eres un analista de problemas. Identifica el tipo de problema, su severidad y qué tan urgente es la solución." + _INTENT_RESPONSE_FORMAT,
+    "complaint_analysis": "Eres un analista de quejas. Identifica el tipo de queja, su severidad y qué tan urgente es la resolución." + _INTENT_RESPONSE_FORMAT,
+    "general": "Eres un analista de intenciones. Identifica la intención principal del usuario en la conversación." + _INTENT_RESPONSE_FORMAT
+}
+
+ENTITY_SYSTEM_PROMPT = """Eres un extractor de entidades experto. 
+        Extrae información relevante del texto y responde en JSON.
+        
+        Estructura esperada:
+        {
+            "products": ["producto1", "producto2"],
+            "prices": ["$100", "$200"],
+            "dates": ["2024-01-01"],
+            "quantities": ["3", "5"],
+            "sizes": ["M", "L"],
+            "colors": ["rojo", "azul"],
+            "customer_info": {
+                "name": "nombre",
+                "phone": "teléfono",
+                "email": "email"
+            }
+        }"""
+
+AGENT_SYSTEM_PROMPTS = {
+    "ventas": "Eres un agente de ventas amigable y profesional. Ayuda al cliente a encontrar productos, resolver dudas y cerrar ventas.",
+    "soporte": "Eres un agente de soporte técnico. Ayuda a resolver problemas, explicar procesos y dar soluciones claras.",
+    "reclamos": "Eres un agente especializado en manejo de reclamos. Escucha con empatía, documenta el problema y ofrece soluciones.",
+    "general": "Eres un asistente virtual amigable y útil. Responde de manera clara y profesional."
+}
+
+# Bloque de código ```json ... ``` en la respuesta del modelo (compilado una sola vez)
+_JSON_FENCE = re.compile(r"```(?:json)?\s*(\{.*\})\s*```", re.S)
+
+# Cliente HTTP compartido por todas las instancias (un solo pool de conexiones keep-alive)
+_CLIENT = ollama.Client(timeout=settings.OLLAMA_TIMEOUT_SECONDS)
+
+# Contadores de llamadas al modelo (chat, aciertos de caché, errores)
+_METRICS: Counter = Counter()
+# Se incrementan desde hilos de trabajo (to_thread, batchers): += no es atómico
+_metrics_lock = threading.Lock()
+
+
+def _count(metric: str) -> None:
+    """Incrementa un contador de llamadas de forma segura entre hilos"""
+    with _metrics_lock:
+        _METRICS[metric] += 1
 
 
 class OllamaService:
     def __init__(self, model_name: str = "gemma3:1b"):
         self.model_name = model_name
-        self.client = ollama.Client()
+        self._aclient: Optional[ollama.AsyncClient] = None
+        # Transporte propio del cliente asíncrono: se cierra con la API pública de httpx
+        self._atransport: Optional[httpx.AsyncHTTPTransport] = None
+
+    @property
+    def client(self) -> ollama.Client:
+        """Cliente síncrono compartido a nivel de módulo"""
+        return _CLIENT
+
+    @staticmethod
+    def metrics() -> Dict[str, int]:
+        """Copia de los contadores de llamadas al modelo"""
+        with _metrics_lock:
+            return dict(_METRICS)
+
+    @property
+    def aclient(self) -> ollama.AsyncClient:
+        """Cliente asíncrono con pool de conexiones keep-alive (se crea en el primer uso)"""
+        if self._aclient is None:
+            self._atransport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32))
+            # ollama.AsyncClient reenvía los kwargs extra a httpx.AsyncClient
+            self._aclient = ollama.AsyncClient(
+                timeout=settings.OLLAMA_TIMEOUT_SECONDS,
+                transport=self._atransport)
+        return self._aclient
+
+    async def aclose(self):
+        """Cierra el pool de conexiones del cliente asíncrono (ollama.AsyncClient no expone un cierre propio)"""
+        if self._atransport is not None:
+            await self._atransport.aclose()
+            self._atransport = None
+            self._aclient = None
+
+    def _cache_args(self, prompt: str, system_prompt: Optional[str], temperature: float,
+                    context_message: Optional[str],
+                    semantic_cache: bool = False) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+        """(clave, ámbito, prompt) de caché; None si la llamada no es determinista.
+        Ámbito y prompt solo se dan (búsqueda semántica) si la llamada lo pide explícitamente"""
+        # Las llamadas de baja temperatura son deterministas: se sirven desde caché
+        if temperature > settings.LLM_CACHE_MAX_TEMPERATURE:
+            return None
+        cache_prompt = f"{context_message}\n\n{prompt}" if context_message else prompt
+        key = llm_cache.make_key(
+            self.model_name, system_prompt, cache_prompt, temperature)
+        if not semantic_cache:
+            return key, None, None
+        return (
+            key,
+            llm_cache.make_scope(self.model_name, system_prompt, temperature),
+            cache_prompt
+        )
+
+    def _chat_request(self, prompt: str, system_prompt: Optional[str], temperature: float,
+                      context_message: Optional[str]) -> Dict[str, Any]:
+        """Argumentos de la llamada a /api/chat"""
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+
+        # El contexto dinámico va después del system prompt para no romper el prefijo común
+        if context_message:
+            messages.append({"role": "user", "content": context_message})
+
+        messages.append({"role": "user", "content": prompt})
+
+        return {
+            "model": self.model_name,
+            "messages": messages,
+            "options": {
+                "temperature": temperature,
+                "top_p": 0.9,
+                "top_k": 40
+            }
+        }
+
+    def generate(self, prompt: str, system_prompt: str = None, temperature: float = 0.7,
+                 context: Optional[str] = None, semantic_cache: bool = False) -> str:
+        """Genera texto usando el modelo local (semantic_cache: aceptar respuestas de prompts parecidos)"""
+        context_message = f"Contexto adicional: {context}" if context else None
+        cache_args = self._cache_args(
+            prompt, system_prompt, temperature, context_message, semantic_cache)
+        if cache_args:
+            cached = llm_cache.get(*cache_args)
+            if cached is not None:
+                _count("cache_hit")
+                return cached
 
-    def generate(self, prompt: str, system_prompt: str = None, temperature: float = 0.7) -> str:
-        """Genera texto usando el modelo local"""
         try:
-            messages = []
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
+            _count("chat")
+            response = self.client.chat(**self._chat_request(
+                prompt, system_prompt, temperature, context_message))
+
+            content = response['message']['content']
+            if cache_args:
+                llm_cache.set(cache_args[0], content, *cache_args[1:])
+            return content
+
+        except Exception as e:
+            _count("error")
+            print(f"Error generating with Ollama: {e}")
+            return f"Error: {str(e)}"
 
-            messages.append({"role": "user", "content": prompt})
+    async def agenerate(self, prompt: str, system_prompt: str = None, temperature: float = 0.7,
+                        context: Optional[str] = None, semantic_cache: bool = False) -> str:
+        """Versión asíncrona de generate: no bloquea el event loop y permite solapar llamadas"""
+        context_message = f"Contexto adicional: {context}" if context else None
+        cache_args = self._cache_args(
+            prompt, system_prompt, temperature, context_message, semantic_cache)
+        if cache_args:
+            cached = await asyncio.to_thread(llm_cache.get, *cache_args)
+            if cached is not None:
+                _count("cache_hit")
+                return cached
 
-            response = self.client.chat(
-                model=self.model_name,
-                messages=messages,
-                options={
-                    "temperature": temperature,
-                    "top_p": 0.9,
-                    "top_k": 40
-                }
-            )
+        try:
+            _count("chat")
+            response = await self.aclient.chat(**self._chat_request(
+                prompt, system_prompt, temperature, context_message))
 
-            return response['message']['content']
+            content = response['message']['content']
+            if cache_args:
+                await asyncio.to_thread(
+                    llm_cache.set, cache_args[0], content, *cache_args[1:])
+            return content
 
         except Exception as e:
+            _count("error")
             print(f"Error generating with Ollama: {e}")
             return f"Error: {str(e)}"
 
-    def classify_conversation(self, conversation: str, categories: List[str]) -> Dict[str, Any]:
-        """Clasifica una conversación en categorías predefinidas"""
+    @staticmethod
+    def _parse_json(response: str) -> Dict[str, Any]:
+        """Parsea la respuesta JSON del modelo, quitando el bloque de código si lo hay"""
+        match = _JSON_FENCE.search(response)
+        payload = match.group(1) if match else response.strip()
+
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Texto alrededor del JSON: quedarse con el primer "{" hasta el último "}"
+            start, end = payload.find("{"), payload.rfind("}")
+            if start < 0 or end <= start:
+                raise
+            return orjson.loads(payload[start:end + 1])
+
+    @staticmethod
+    def _classification_prompts(conversation: str, categories: List[str]) -> Tuple[str, str]:
+        """(system_prompt, prompt) de clasificación"""
         system_prompt = f"""Eres un clasificador experto de conversaciones. 
         Debes clasificar la conversación en una de estas categorías: {', '.join(categories)}
         
@@ -49,114 +238,99 @@ class OllamaService:
         }}"""
 
         prompt = f"Clasifica esta conversación:\n\n{conversation}"
+        return system_prompt, prompt
+
+    @staticmethod
+    def _classification_fallback(error: Exception) -> Dict[str, Any]:
+        print(f"Error parsing classification: {error}")
+        return {
+            "category": "unknown",
+            "confidence": 0.0,
+            "reasoning": f"Error parsing response: {str(error)}",
+            "tags": [],
+            "sentiment": "neutral"
+        }
+
+    @staticmethod
+    def _entities_fallback(error: Exception) -> Dict[str, Any]:
+        print(f"Error extracting entities: {error}")
+        return {
+            "products": [],
+            "prices": [],
+            "dates": [],
+            "quantities": [],
+            "sizes": [],
+            "colors": [],
+            "customer_info": {},
+            "error": str(error)
+        }
+
+    def classify_conversation(self, conversation: str, categories: List[str]) -> Dict[str, Any]:
+        """Clasifica una conversación en categorías predefinidas"""
+        system_prompt, prompt = self._classification_prompts(
+            conversation, categories)
 
         try:
             response = self.generate(prompt, system_prompt, temperature=0.3)
+            return self._parse_json(response)
+
+        except Exception as e:
+            return self._classification_fallback(e)
 
-            # Intentar parsear JSON
-            if response.startswith("```json"):
-                response = response.split("```json")[1].split("```")[0]
-            elif response.startswith("```"):
-                response = response.split("```")[1].split("```")[0]
+    async def aclassify_conversation(self, conversation: str, categories: List[str]) -> Dict[str, Any]:
+        """Versión asíncrona de classify_conversation"""
+        system_prompt, prompt = self._classification_prompts(
+            conversation, categories)
 
-            result = json.loads(response.strip())
-            return result
+        try:
+            response = await self.agenerate(prompt, system_prompt, temperature=0.3)
+            return self._parse_json(response)
 
         except Exception as e:
-            print(f"Error parsing classification: {e}")
-            return {
-                "category": "unknown",
-                "confidence": 0.0,
-                "reasoning": f"Error parsing response: {str(e)}",
-                "tags": [],
-                "sentiment": "neutral"
-            }
+            return self._classification_fallback(e)
+
+    async def classify_many(self, conversations: List[str], categories: List[str]) -> List[Dict[str, Any]]:
+        """Clasifica varias conversaciones con peticiones concurrentes a Ollama"""
+        return await asyncio.gather(*(
+            self.aclassify_conversation(conversation, categories)
+            for conversation in conversations
+        ))
 
     def extract_entities(self, text: str) -> Dict[str, Any]:
         """Extrae entidades del texto (productos, precios, fechas, etc.)"""
-        system_prompt = """Eres un extractor de entidades experto. 
-        Extrae información relevante del texto y responde en JSON.
-        
-        Estructura esperada:
-        {
-            "products": ["producto1", "producto2"],
-            "prices": ["$100", "$200"],
-            "dates": ["2024-01-01"],
-            "quantities": ["3", "5"],
-            "sizes": ["M", "L"],
-            "colors": ["rojo", "azul"],
-            "customer_info": {
-                "name": "nombre",
-                "phone": "teléfono",
-                "email": "email"
-            }
-        }"""
-
         prompt = f"Extrae entidades de este texto:\n\n{text}"
 
         try:
-            response = self.generate(prompt, system_prompt, temperature=0.1)
+            response = self.generate(
+                prompt, ENTITY_SYSTEM_PROMPT, temperature=0.1)
+            return self._parse_json(response)
 
-            # Limpiar respuesta
-            if response.startswith("```json"):
-                response = response.split("```json")[1].split("```")[0]
-            elif response.startswith("```"):
-                response = response.split("```")[1].split("```")[0]
+        except Exception as e:
+            return self._entities_fallback(e)
 
-            result = json.loads(response.strip())
-            return result
+    async def aextract_entities(self, text: str) -> Dict[str, Any]:
+        """Versión asíncrona de extract_entities"""
+        prompt = f"Extrae entidades de este texto:\n\n{text}"
+
+        try:
+            response = await self.agenerate(
+                prompt, ENTITY_SYSTEM_PROMPT, temperature=0.1)
+            return self._parse_json(response)
 
         except Exception as e:
-            print(f"Error extracting entities: {e}")
-            return {
-                "products": [],
-                "prices": [],
-                "dates": [],
-                "quantities": [],
-                "sizes": [],
-                "colors": [],
-                "customer_info": {}
-            }
+            return self._entities_fallback(e)
 
     def analyze_intent(self, conversation: str, context: str = "", intent_type: str = "general") -> Dict[str, Any]:
         """Analiza la intención del usuario en una conversación"""
-
-        intent_prompts = {
-            "purchase_intent": "Eres un analista de intenciones de compra. Analiza si el cliente tiene intención de comprar y qué tan urgente es.",
-            "problem_analysis": "Eres un analista de problemas. Identifica el tipo de problema, su severidad y qué tan urgente es la solución.",
-            "complaint_analysis": "Eres un analista de quejas. Identifica el tipo de queja, su severidad y qué tan urgente es la resolución.",
-            "general": "Eres un analista de intenciones. Identifica la intención principal del usuario en la conversación."
-        }
-
-        system_prompt = intent_prompts.get(
-            intent_type, intent_prompts["general"])
-        system_prompt += """
-        
-        Responde solo con un JSON válido con esta estructura:
-        {
-            "intent": "descripción_de_la_intención",
-            "confidence": 0.95,
-            "urgency": "low/medium/high",
-            "details": "explicación_detallada",
-            "next_steps": ["paso1", "paso2"]
-        }"""
-
-        if context:
-            system_prompt += f"\n\nContexto adicional: {context}"
+        system_prompt = INTENT_SYSTEM_PROMPTS.get(
+            intent_type, INTENT_SYSTEM_PROMPTS["general"])
 
         prompt = f"Analiza la intención en esta conversación:\n\n{conversation}"
 
         try:
-            response = self.generate(prompt, system_prompt, temperature=0.3)
-
-            # Limpiar respuesta
-            if response.startswith("```json"):
-                response = response.split("```json")[1].split("```")[0]
-            elif response.startswith("```"):
-                response = response.split("```")[1].split("```")[0]
-
-            result = json.loads(response.strip())
-            return result
+            response = self.generate(
+                prompt, system_prompt, temperature=0.3, context=context)
+            return self._parse_json(response)
 
         except Exception as e:
             print(f"Error analyzing intent: {e}")
@@ -170,22 +344,12 @@ class OllamaService:
 
     def generate_response(self, conversation: str, context: str = "", agent_type: str = "general") -> str:
         """Genera una respuesta apropiada para la conversación"""
-
-        agent_prompts = {
-            "ventas": "Eres un agente de ventas amigable y profesional. Ayuda al cliente a encontrar productos, resolver dudas y cerrar ventas.",
-            "soporte": "Eres un agente de soporte técnico. Ayuda a resolver problemas, explicar procesos y dar soluciones claras.",
-            "reclamos": "Eres un agente especializado en manejo de reclamos. Escucha con empatía, documenta el problema y ofrece soluciones.",
-            "general": "Eres un asistente virtual amigable y útil. Responde de manera clara y profesional."
-        }
-
-        system_prompt = agent_prompts.get(agent_type, agent_prompts["general"])
-
-        if context:
-            system_prompt += f"\n\nContexto adicional: {context}"
+        system_prompt = AGENT_SYSTEM_PROMPTS.get(
+            agent_type, AGENT_SYSTEM_PROMPTS["general"])
 
         prompt = f"Conversación:\n{conversation}\n\nResponde de manera apropiada:"
 
-        return self.generate(prompt, system_prompt, temperature=0.7)
+        return self.generate(prompt, system_prompt, temperature=0.7, context=context)
 
     def list_models(self) -> List[str]:
         """Lista los modelos disponibles en Ollama"""
@@ -203,6 +367,7 @@ class OllamaService:
             models = self.list_models()
             if model_name in models:
                 self.model_name = model_name
+                llm_cache.clear()
                 return True
             else:
                 print(
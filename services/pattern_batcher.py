@@ -0,0 +1,209 @@
+"""
+Agrupa en micro-lotes las búsquedas de conversaciones similares del Super Agente
+"""
+import asyncio
+import concurrent.futures
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import cast, literal, union_all
+from sqlalchemy.dialects.postgresql import JSONB, array
+from sqlmodel import Session, select
+
+from core.config import settings
+from core.db import get_session
+from models.conversation import Conversation as ConversationModel
+
+logger = logging.getLogger(__name__)
+
+# Conversaciones recientes que se consideran por conjunto de tags y por categoría
+TAG_LOOKUP_LIMIT = 15
+CATEGORY_LOOKUP_LIMIT = 10
+
+# Espera máxima (s) de un hilo de trabajo por su lote antes de consultar directamente
+LOOKUP_BLOCKING_TIMEOUT_SECONDS = 5.0
+
+LookupKey = Tuple[str, Any]
+
+
+def lookup_keys(tags: List[str], category: Optional[str]) -> List[LookupKey]:
+    """Claves de búsqueda de una conversación: su conjunto de tags y su categoría"""
+    keys = [("tags", tuple(tags))] if tags else []
+    return keys + [("category", category)]
+
+
+def fetch_similar_conversations(session: Session, keys: Iterable[LookupKey]) -> Dict[LookupKey, List[Any]]:
+    """Conversaciones más recientes para cada tag/categoría en una sola consulta (UNION ALL)"""
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+
+    queries = []
+    for position, (kind, value) in enumerate(keys):
+        if kind == "tags":
+            # Solapamiento con cualquiera de los tags (?| sobre tags_json::jsonb, índice GIN)
+            condition = cast(ConversationModel.tags_json, JSONB).op("?|")(
+                array(list(value)))
+            limit = TAG_LOOKUP_LIMIT
+        else:
+            condition = ConversationModel.category == value
+            limit = CATEGORY_LOOKUP_LIMIT
+
+        # +1 para poder descartar la conversación de quien consulta
+        queries.append(
+            select(literal(position).label("lookup"), ConversationModel.id,
+                   ConversationModel.category, ConversationModel.sentiment,
+                   ConversationModel.tags_json, ConversationModel.created_at)
+            .where(condition)
+            .order_by(ConversationModel.created_at.desc())
+            .limit(limit + 1)
+        )
+
+    results = {key: [] for key in keys}
+    for row in session.execute(union_all(*queries)).all():
+        results[keys[row.lookup]].append(row)
+
+    # UNION ALL no garantiza el orden de cada subconsulta
+    for rows in results.values():
+        rows.sort(key=lambda row: row.created_at, reverse=True)
+
+    return results
+
+
+def split_lookup(tags: List[str], category: Optional[str], rows: Dict[LookupKey, List[Any]],
+                 exclude_id: Any = None) -> Dict[str, Any]:
+    """Reparte las filas entre tags y categoría excluyendo la propia conversación"""
+    def without_self(key: LookupKey, limit: int) -> List[Any]:
+        return [row for row in rows.get(key, []) if row.id != exclude_id][:limit]
+
+    return {
+        "tags": without_self(("tags", tuple(tags)), TAG_LOOKUP_LIMIT),
+        "category": without_self(("category", category), CATEGORY_LOOKUP_LIMIT)
+    }
+
+
+class PatternLookupBatcher:
+    """Acumula búsquedas de patrones hasta max_batch_size o max_wait_ms y las resuelve con una sola consulta"""
+
+    def __init__(self, max_batch_size: int = 16, max_wait_ms: float = 20.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Hilo propio para las consultas: no compite con el executor por defecto,
+        # donde esperan los hilos de trabajo bloqueados en lookup_blocking
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    @property
+    def running(self) -> bool:
+        """Indica si el consumidor está activo"""
+        return self._consumer is not None and not self._consumer.done()
+
+    def start(self):
+        """Inicia el consumidor en el event loop actual"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pattern-lookup")
+        self._queue = asyncio.Queue()
+        self._consumer = asyncio.create_task(self._consume())
+        logger.info(
+            f"🚀 Micro-batching de patrones iniciado (lote={self.max_batch_size}, espera={self.max_wait_ms}ms)")
+
+    async def stop(self):
+        """Detiene el consumidor"""
+        if not self.running:
+            return
+        self._consumer.cancel()
+        try:
+            await self._consumer
+        except asyncio.CancelledError:
+            pass
+        self._consumer = None
+        self._loop = None
+        self._executor.shutdown(wait=False)
+        self._executor = None
+        logger.info("🔚 Micro-batching de patrones detenido")
+
+    async def lookup(self, tags: List[str], category: Optional[str], exclude_id: Any = None) -> Dict[str, Any]:
+        """Encola la búsqueda de una conversación y espera sus filas"""
+        keys = lookup_keys(tags, category)
+        if not self.running:
+            rows = await asyncio.to_thread(self._fetch, keys)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((keys, future))
+            rows = await future
+        return split_lookup(tags, category, rows, exclude_id)
+
+    def lookup_blocking(self, tags: List[str], category: Optional[str], exclude_id: Any = None,
+                        session: Optional[Session] = None) -> Dict[str, Any]:
+        """Versión síncrona para hilos de trabajo; sin consumidor (o desde el event loop) consulta directamente"""
+        try:
+            asyncio.get_running_loop()
+            in_event_loop = True
+        except RuntimeError:
+            in_event_loop = False
+
+        if self.running and not in_event_loop:
+            future = asyncio.run_coroutine_threadsafe(
+                self.lookup(tags, category, exclude_id), self._loop)
+            try:
+                return future.result(timeout=LOOKUP_BLOCKING_TIMEOUT_SECONDS)
+            except concurrent.futures.TimeoutError:
+                future.cancel()
+                logger.warning(
+                    "⚠️ Lote de patrones sin respuesta a tiempo, consultando directamente")
+
+        keys = lookup_keys(tags, category)
+        rows = fetch_similar_conversations(
+            session, keys) if session else self._fetch(keys)
+        return split_lookup(tags, category, rows, exclude_id)
+
+    @staticmethod
+    def _fetch(keys: List[LookupKey]) -> Dict[LookupKey, List[Any]]:
+        """Ejecuta la consulta agrupada con una sesión propia"""
+        with get_session() as session:
+            return fetch_similar_conversations(session, keys)
+
+    async def _collect_batch(self) -> List[Tuple[List[LookupKey], asyncio.Future]]:
+        """Toma el primer elemento y completa el lote hasta el tamaño o la espera máxima"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _consume(self):
+        """Bucle del consumidor: una consulta por lote y reparto de filas a cada petición"""
+        while True:
+            batch = await self._collect_batch()
+            try:
+                rows = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._fetch, [key for keys, _ in batch for key in keys])
+                for keys, future in batch:
+                    if not future.done():
+                        future.set_result({key: rows[key] for key in keys})
+            except Exception as e:
+                logger.error(f"❌ Error buscando patrones para lote de {len(batch)} conversaciones: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+# Instancia global del agrupador
+pattern_lookup_batcher = PatternLookupBatcher(
+    max_batch_size=settings.PATTERN_LOOKUP_BATCH_SIZE,
+    max_wait_ms=settings.PATTERN_LOOKUP_BATCH_WAIT_MS
+)
@@ -1,25 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
 from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+from lxml.cssselect import CSSSelector
+import httpx
 
-def fetch_html(url: str, wait_selector: str | None = None, timeout_ms: int = 8000) -> str:
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
+USER_AGENT = ("Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/124.0 Safari/537.36")
+
+# Selectores CSS compilados a XPath una sola vez
+_SEL_CARD = CSSSelector(".product-card, .item, .col-product", translator="html")
+_SEL_TITLE = CSSSelector(".title, .product-title", translator="html")
+_SEL_PRICE = CSSSelector(".price, .product-price", translator="html")
+
+# Cliente HTTP compartido (pool de conexiones) para páginas estáticas
+_http_client = httpx.Client(
+    headers={"User-Agent": USER_AGENT}, follow_redirects=True)
+
+# La API síncrona de Playwright queda ligada al hilo que la inicia: un único hilo
+# dueño del navegador lo reutiliza entre llamadas en lugar de lanzar Chromium cada vez
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="playwright")
+_PW = None
+_BROWSER = None
+
+def _get_browser():
+    global _PW, _BROWSER
+    if _BROWSER is None or not _BROWSER.is_connected():
+        if _PW is None:
+            _PW = sync_playwright().start()
+        _BROWSER = _PW.chromium.launch(
+            headless=True,
+            args=["--disable-gpu", "--no-sandbox", "--disable-dev-shm-usage"])
+    return _BROWSER
+
+def _fetch(url: str, wait_selector: str | None, timeout_ms: int) -> str:
+    context = _get_browser().new_context()
+    try:
+        page = context.new_page()
         page.goto(url, timeout=timeout_ms)
         if wait_selector:
             page.wait_for_selector(wait_selector, timeout=timeout_ms)
-        html = page.content()
-        browser.close()
-    return html
+        return page.content()
+    finally:
+        context.close()
+
+def _close_browser():
+    global _PW, _BROWSER
+    if _BROWSER is not None:
+        _BROWSER.close()
+        _BROWSER = None
+    if _PW is not None:
+        _PW.stop()
+        _PW = None
+
+def shutdown():
+    """Cierra el navegador en su hilo dueño y libera los clientes (desde el lifespan de la app,
+    antes de que el intérprete deje de aceptar tareas en el executor)"""
+    _executor.submit(_close_browser).result()
+    _executor.shutdown()
+    _http_client.close()
+
+def fetch_html(url: str, wait_selector: str | None = None, timeout_ms: int = 8000) -> str:
+    return _executor.submit(_fetch, url, wait_selector, timeout_ms).result()
+
+def fetch_html_fast(url: str, timeout_ms: int = 8000) -> str:
+    """Descarga el HTML sin navegador (páginas estáticas)"""
+    response = _http_client.get(url, timeout=timeout_ms / 1000)
+    response.raise_for_status()
+    return response.text
+
+def scrape(url: str, wait_selector: str | None = None, timeout_ms: int = 8000) -> list[dict]:
+    """Extrae productos usando HTTP directo y solo recurre a Chromium si hace falta renderizar"""
+    if not wait_selector:
+        try:
+            items = extract_products(fetch_html_fast(url, timeout_ms))
+            if items:
+                return items
+        except httpx.HTTPError:
+            pass
+    return extract_products(fetch_html(url, wait_selector, timeout_ms))
+
+def _text(element) -> str:
+    """Texto del elemento con cada fragmento recortado (equivale a get_text(strip=True))"""
+    return "".join(fragment.strip() for fragment in element.itertext())
 
 def extract_products(html: str):
-    soup = BeautifulSoup(html, "lxml")
+    if not html.strip():
+        return []
+    try:
+        root = lxml_html.fromstring(html)
+    except ValueError:
+        # lxml no acepta str con declaración de encoding
+        root = lxml_html.fromstring(html.encode("utf-8"))
     items = []
-    for card in soup.select(".product-card, .item, .col-product"):
-        title_el = card.select_one(".title, .product-title")
-        price_el = card.select_one(".price, .product-price")
-        title = title_el.get_text(strip=True) if title_el else None
-        price = price_el.get_text(strip=True) if price_el else None
+    for card in _SEL_CARD(root):
+        titles = _SEL_TITLE(card)
+        prices = _SEL_PRICE(card)
+        title = _text(titles[0]) if titles else None
+        price = _text(prices[0]) if prices else None
         if title:
             items.append({"title": title, "price": price})
     return items
@@ -2,55 +2,220 @@
 Servicio de Tagging Inteligente usando Machine Learning
 """
 from typing import List, Dict, Any, Optional, Tuple
-from sklearn.cluster import KMeans
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import torch
+import hashlib
+import heapq
+import os
+import threading
 import json
 import re
-from collections import Counter
+from collections import OrderedDict
+from functools import lru_cache
 import logging
+from core.config import settings
+
+try:
+    # Opcional: búsqueda multipatrón Aho-Corasick en una sola pasada
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Máximo de embeddings de texto (normalizados) en la caché LRU
+TEXT_EMBEDDING_CACHE_MAXSIZE = 1024
+
+
+def _configure_torch():
+    """Ajusta los hilos de PyTorch: en contenedores suele quedarse en 1 hilo"""
+    num_threads = max(1, (os.cpu_count() or 2) // 2)
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Solo se puede fijar antes del primer trabajo paralelo del proceso
+        pass
+    logger.info(f"✅ PyTorch configurado con {num_threads} hilos")
+
+
+@lru_cache(maxsize=None)
+def _load_encoder(embedding_model: str, encoder_backend: str) -> SentenceTransformer:
+    """Carga el encoder con el backend indicado (una vez por proceso); si no está disponible usa PyTorch"""
+    if encoder_backend != "torch":
+        try:
+            # ONNX Runtime/OpenVINO: grafo optimizado sin overhead de autograd
+            encoder = SentenceTransformer(
+                embedding_model, backend=encoder_backend)
+            logger.info(f"✅ Backend del encoder: {encoder_backend}")
+            return encoder
+        except Exception as e:
+            logger.warning(
+                f"⚠️ Backend {encoder_backend} no disponible ({e}), usando torch")
+
+    _configure_torch()
+    encoder = SentenceTransformer(embedding_model)
+
+    # En GPU el forward en FP16 reduce a la mitad el tráfico de memoria
+    if encoder.device.type == "cuda":
+        encoder.half()
+        logger.info("✅ Encoder en FP16 (cuda)")
+
+    return encoder
+
 
 class SmartTaggingService:
     """Servicio inteligente de etiquetado usando ML"""
 
-    def __init__(self, embedding_model: str = "all-MiniLM-L6-v2"):
+    def __init__(self, embedding_model: str = "all-MiniLM-L6-v2", int8_tags: bool = False,
+                 encoder_backend: str = "torch"):
         self.embedding_model = embedding_model
-        self.encoder = None
-        self.tfidf_vectorizer = None
+        self.encoder_backend = encoder_backend
+        self.int8_tags = int8_tags
         self.tag_clusters = {}
         self.predefined_tags = self._load_predefined_tags()
         self.tag_synonyms = self._load_tag_synonyms()
 
-        # Inicializar modelos
-        self._initialize_models()
+        # Índice inverso etiqueta -> categoría (la primera categoría que la contiene)
+        self._tag_to_category: Dict[str, str] = {}
+        for category, tags in self.predefined_tags.items():
+            for tag in tags:
+                self._tag_to_category.setdefault(tag, category)
+
+        # Etiquetas relacionadas precalculadas por (categoría, etiqueta): hasta 3 de la misma categoría
+        self._related_tags: Dict[Tuple[str, str], Tuple[str, ...]] = {
+            (category, tag): tuple(
+                related_tag for related_tag in tags[:3] if related_tag != tag)
+            for category, tags in self.predefined_tags.items()
+            for tag in tags
+        }
+
+        # Etiquetas predefinidas aplanadas y matriz (N, D) de sus embeddings normalizados
+        self._tag_names: List[str] = []
+        self._tag_categories: List[str] = []
+        self._tag_embeddings: Optional[np.ndarray] = None
+        # Variante int8 opcional: matriz cuantizada por filas y la escala de cada fila
+        self._tag_embeddings_i8: Optional[np.ndarray] = None
+        self._tag_scales: Optional[np.ndarray] = None
+        # Copia de la matriz residente en GPU cuando el encoder corre en cuda
+        self._tag_embeddings_device: Optional[torch.Tensor] = None
+
+        # Caché LRU de embeddings de texto por hash (textos repetidos no pasan por el encoder)
+        self._text_embedding_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._text_embedding_cache_lock = threading.Lock()
+
+        # Plantillas de etiquetas por palabra clave/sinónimo y autómata que las busca
+        self._keyword_tags: List[Dict[str, Any]] = []
+        self._keyword_patterns: List[Tuple[str, int]] = []
+        self._keyword_automaton = None
+        self._build_keyword_index()
+
+        # Los modelos se inicializan en el primer acceso a `encoder`
+        self._encoder: Optional[SentenceTransformer] = None
+        self._models_initialized = False
+        self._models_lock = threading.Lock()
+
+    @property
+    def encoder(self) -> Optional[SentenceTransformer]:
+        """Encoder de embeddings; se carga (junto con la matriz de etiquetas) en el primer uso"""
+        if not self._models_initialized:
+            with self._models_lock:
+                if not self._models_initialized:
+                    self._initialize_models()
+                    self._models_initialized = True
+        return self._encoder
 
     def _initialize_models(self):
         """Inicializa los modelos de ML"""
         try:
-            # Inicializar encoder de embeddings
-            self.encoder = SentenceTransformer(self.embedding_model)
+            # Inicializar encoder de embeddings (compartido entre instancias del mismo modelo)
+            self._encoder = _load_encoder(
+                self.embedding_model, self.encoder_backend)
             logger.info(f"✅ Encoder inicializado: {self.embedding_model}")
 
-            # Inicializar vectorizador TF-IDF
-            self.tfidf_vectorizer = TfidfVectorizer(
-                max_features=1000,
-                stop_words='english',
-                ngram_range=(1, 2),
-                min_df=2
-            )
-            logger.info("✅ TF-IDF vectorizador inicializado")
+            # Codificar una sola vez las etiquetas predefinidas
+            self._build_tag_embeddings()
 
         except Exception as e:
             logger.error(f"❌ Error inicializando modelos: {e}")
-            self.encoder = None
-            self.tfidf_vectorizer = None
+            self._encoder = None
+
+    def _build_tag_embeddings(self):
+        """Precalcula los embeddings normalizados de todas las etiquetas predefinidas"""
+        tag_names = [
+            tag for tags in self.predefined_tags.values() for tag in tags]
+        tag_categories = [
+            category for category, tags in self.predefined_tags.items() for _ in tags]
+        tag_embeddings = self._encoder.encode(
+            tag_names,
+            batch_size=64,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype(np.float32)
+
+        if self.int8_tags:
+            # Cuantización simétrica por fila: 1 byte por componente en lugar de 4
+            self._tag_embeddings_i8, self._tag_scales = self._quantize_int8(
+                tag_embeddings)
+        else:
+            self._tag_embeddings = tag_embeddings
+            if self._encoder.device.type == "cuda":
+                self._tag_embeddings_device = torch.from_numpy(tag_embeddings).to(
+                    self._encoder.device, dtype=torch.float16)
+
+        self._tag_names = tag_names
+        self._tag_categories = tag_categories
+        logger.info(
+            f"✅ Embeddings de {len(self._tag_names)} etiquetas predefinidas precalculados")
+
+    def _build_keyword_index(self):
+        """Precompila las palabras clave y sinónimos en un autómata Aho-Corasick (o una lista si no está disponible)"""
+        # Plantillas en el mismo orden que el recorrido original: etiquetas por categoría y luego sinónimos
+        for category, category_tags in self.predefined_tags.items():
+            for tag in category_tags:
+                self._keyword_patterns.append(
+                    (tag.lower(), len(self._keyword_tags)))
+                self._keyword_tags.append({
+                    "name": tag,
+                    "category": category,
+                    "type": "keyword",
+                    "confidence": 0.8,
+                    "source": "predefined"
+                })
+
+        for tag, synonyms in self.tag_synonyms.items():
+            index = len(self._keyword_tags)
+            self._keyword_tags.append({
+                "name": tag,
+                "category": self._get_tag_category(tag),
+                "type": "synonym",
+                "confidence": 0.7,
+                "source": "synonym_match"
+            })
+            for synonym in synonyms:
+                self._keyword_patterns.append((synonym.lower(), index))
+
+        if ahocorasick is None:
+            logger.warning(
+                f"⚠️ pyahocorasick no instalado: palabras clave con búsqueda de subcadenas ({len(self._keyword_patterns)} patrones)")
+            return
+
+        # Cada patrón apunta a todas las plantillas que activa
+        pattern_indices: Dict[str, List[int]] = {}
+        for pattern, index in self._keyword_patterns:
+            pattern_indices.setdefault(pattern, []).append(index)
+
+        automaton = ahocorasick.Automaton()
+        for pattern, indices in pattern_indices.items():
+            automaton.add_word(pattern, (pattern, tuple(indices)))
+        automaton.make_automaton()
+        self._keyword_automaton = automaton
+        logger.info(
+            f"✅ Autómata de palabras clave con {len(pattern_indices)} patrones")
 
     def _load_predefined_tags(self) -> Dict[str, List[str]]:
         """Carga etiquetas predefinidas por categoría"""
@@ -98,96 +263,198 @@ class SmartTaggingService:
     def generate_smart_tags(self, text: str, category: str = None,
                             max_tags: int = 8) -> List[Dict[str, Any]]:
         """Genera etiquetas inteligentes para un texto"""
-        try:
-            # 1. Extraer etiquetas basadas en palabras clave
-            keyword_tags = self._extract_keyword_tags(text)
-
-            # 2. Generar etiquetas semánticas
-            semantic_tags = self._generate_semantic_tags(text, max_tags // 2)
+        return self.generate_smart_tags_batch([text], [category], max_tags)[0]
 
-            # 3. Combinar y priorizar etiquetas
-            all_tags = keyword_tags + semantic_tags
-            prioritized_tags = self._prioritize_tags(
-                all_tags, category, max_tags)
+    def generate_smart_tags_batch(self, texts: List[str], categories: Optional[List[str]] = None,
+                                  max_tags: int = 8) -> List[List[Dict[str, Any]]]:
+        """Genera etiquetas inteligentes para varios textos con un solo encode del lote"""
+        if not texts:
+            return []
+        if categories is None:
+            categories = [None] * len(texts)
+
+        # Etiquetas semánticas de todos los textos de una vez
+        semantic_batch = self._generate_semantic_tags_batch(
+            texts, max_tags // 2)
+
+        # 1-2. Por texto: etiquetas por palabras clave (y dónde aparecen) y priorización;
+        # el texto se pasa a minúsculas una sola vez por llamada
+        prepared: List[Optional[Tuple[List[Dict[str, Any]], Optional[Dict[str, List[int]]], str]]] = []
+        for text, category, semantic_tags in zip(texts, categories, semantic_batch):
+            try:
+                text_lower = text.lower()
+                keyword_tags, occurrences = self._extract_keyword_tags(
+                    text, text_lower)
+                prioritized_tags = self._prioritize_tags(
+                    keyword_tags + semantic_tags, category, max_tags)
+                prepared.append((prioritized_tags, occurrences, text_lower))
+            except Exception as e:
+                logger.error(f"❌ Error generando etiquetas: {e}")
+                prepared.append(None)
+
+        # 3. Pesos de todas las etiquetas del lote en una sola operación vectorizada
+        batch_tags = []
+        frequencies = []
+        for text, item in zip(texts, prepared):
+            if item is None:
+                continue
+            prioritized_tags, occurrences, text_lower = item
+            for tag in prioritized_tags:
+                batch_tags.append(tag)
+                frequencies.append(self._tag_frequency(
+                    tag["name"], text, occurrences, text_lower))
+        weights = self._calculate_tag_weights(batch_tags, frequencies).tolist()
+
+        # 4. Agregar metadatos (los dicts se materializan solo aquí)
+        results = []
+        offset = 0
+        for text, category, item in zip(texts, categories, prepared):
+            if item is None:
+                results.append(self._fallback_tags(category, max_tags))
+                continue
 
-            # 4. Agregar metadatos
-            enhanced_tags = self._enhance_tags(prioritized_tags, text)
+            prioritized_tags, occurrences, text_lower = item
+            tag_weights = weights[offset:offset + len(prioritized_tags)]
+            offset += len(prioritized_tags)
+            try:
+                enhanced_tags = self._enhance_tags(
+                    prioritized_tags, text, tag_weights, occurrences, text_lower)
 
-            logger.info(
-                f"✅ Generadas {len(enhanced_tags)} etiquetas inteligentes")
-            return enhanced_tags
+                logger.info(
+                    f"✅ Generadas {len(enhanced_tags)} etiquetas inteligentes")
+                results.append(enhanced_tags)
 
-        except Exception as e:
-            logger.error(f"❌ Error generando etiquetas: {e}")
-            return self._fallback_tags(category, max_tags)
+            except Exception as e:
+                logger.error(f"❌ Error generando etiquetas: {e}")
+                results.append(self._fallback_tags(category, max_tags))
 
-    def _extract_keyword_tags(self, text: str) -> List[Dict[str, Any]]:
-        """Extrae etiquetas basadas en palabras clave"""
-        tags = []
-        text_lower = text.lower()
+        return results
 
-        # Buscar etiquetas predefinidas en el texto
-        for category, category_tags in self.predefined_tags.items():
-            for tag in category_tags:
-                if tag.lower() in text_lower:
-                    tags.append({
-                        "name": tag,
-                        "category": category,
-                        "type": "keyword",
-                        "confidence": 0.8,
-                        "source": "predefined"
-                    })
-
-        # Buscar sinónimos
-        for tag, synonyms in self.tag_synonyms.items():
-            for synonym in synonyms:
-                if synonym.lower() in text_lower:
-                    tags.append({
-                        "name": tag,
-                        "category": self._get_tag_category(tag),
-                        "type": "synonym",
-                        "confidence": 0.7,
-                        "source": "synonym_match"
-                    })
-                    break
+    def _extract_keyword_tags(self, text: str, text_lower: Optional[str] = None
+                              ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, List[int]]]]:
+        """Extrae etiquetas basadas en palabras clave y, con el autómata, las posiciones de cada patrón"""
+        if text_lower is None:
+            text_lower = text.lower()
+        occurrences = None
+
+        # Buscar etiquetas predefinidas y sinónimos en el texto
+        if self._keyword_automaton is not None:
+            # Una sola pasada sobre el texto para todos los patrones
+            matched = set()
+            occurrences = {}
+            for end_idx, (pattern, indices) in self._keyword_automaton.iter(text_lower):
+                matched.update(indices)
+                occurrences.setdefault(pattern, []).append(
+                    end_idx - len(pattern) + 1)
+        else:
+            matched = {index for pattern, index in self._keyword_patterns
+                       if pattern in text_lower}
 
-        return tags
+        return [dict(self._keyword_tags[index]) for index in sorted(matched)], occurrences
 
     def _generate_semantic_tags(self, text: str, max_tags: int) -> List[Dict[str, Any]]:
         """Genera etiquetas usando embeddings semánticos"""
-        if not self.encoder:
-            return []
+        return self._generate_semantic_tags_batch([text], max_tags)[0]
+
+    def _generate_semantic_tags_batch(self, texts: List[str], max_tags: int) -> List[List[Dict[str, Any]]]:
+        """Genera etiquetas semánticas de varios textos con un solo encode y un solo producto de matrices"""
+        if not self.encoder or not self._tag_names or max_tags <= 0:
+            return [[] for _ in texts]
 
         try:
-            # Generar embedding del texto
-            text_embedding = self.encoder.encode([text])[0]
-
-            # Comparar con embeddings de etiquetas predefinidas
-            semantic_tags = []
-
-            for category, category_tags in self.predefined_tags.items():
-                for tag in category_tags:
-                    tag_embedding = self.encoder.encode([tag])[0]
-                    similarity = cosine_similarity(
-                        [text_embedding], [tag_embedding]
-                    )[0][0]
-
-                    if similarity > 0.3:  # Umbral de similitud
-                        semantic_tags.append({
-                            "name": tag,
-                            "category": category,
-                            "type": "semantic",
-                            "confidence": float(similarity),
-                            "source": "semantic_analysis"
-                        })
-
-            # Ordenar por confianza y limitar
-            semantic_tags.sort(key=lambda x: x["confidence"], reverse=True)
-            return semantic_tags[:max_tags]
+            if self._tag_embeddings_device is not None:
+                # En GPU: embeddings y producto sin pasar por CPU, solo se copian las similitudes
+                text_embeddings = self.encoder.encode(
+                    texts, batch_size=32, convert_to_tensor=True, normalize_embeddings=True,
+                    show_progress_bar=False)
+                similarities = (text_embeddings.to(torch.float16) @ self._tag_embeddings_device.T
+                                ).float().cpu().numpy()
+            else:
+                # Embeddings normalizados de todos los textos (solo se codifican los no cacheados)
+                text_embeddings = self._encode_texts(texts)
+
+                # Similitud coseno (B, N) contra todas las etiquetas en un solo producto de matrices
+                similarities = self._tag_similarities(text_embeddings)
+
+            similarities = similarities.astype(np.float32, copy=False)
+            return [self._top_semantic_tags(row, max_tags) for row in similarities]
 
         except Exception as e:
             logger.error(f"❌ Error en análisis semántico: {e}")
-            return []
+            return [[] for _ in texts]
+
+    @staticmethod
+    def _text_key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """Embeddings normalizados (B, D); los textos ya vistos salen de la caché LRU"""
+        keys = [self._text_key(text) for text in texts]
+        embeddings: Dict[bytes, np.ndarray] = {}
+        with self._text_embedding_cache_lock:
+            for key in keys:
+                if key in self._text_embedding_cache:
+                    self._text_embedding_cache.move_to_end(key)
+                    embeddings[key] = self._text_embedding_cache[key]
+
+        # Textos sin embedding en caché (sin repetir duplicados del mismo lote)
+        missing = {key: text for key, text in zip(keys, texts) if key not in embeddings}
+        if missing:
+            # El encoder agrupa por longitud
+            encoded = self.encoder.encode(
+                list(missing.values()), batch_size=32, convert_to_numpy=True,
+                normalize_embeddings=True, show_progress_bar=False
+            ).astype(np.float32, copy=False)
+            embeddings.update(zip(missing.keys(), encoded))
+            with self._text_embedding_cache_lock:
+                for key, embedding in zip(missing.keys(), encoded):
+                    self._text_embedding_cache[key] = embedding
+                    self._text_embedding_cache.move_to_end(key)
+                while len(self._text_embedding_cache) > TEXT_EMBEDDING_CACHE_MAXSIZE:
+                    self._text_embedding_cache.popitem(last=False)
+
+        return np.stack([embeddings[key] for key in keys])
+
+    @staticmethod
+    def _quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Cuantiza cada fila a int8 con su propia escala (max|x| / 127)"""
+        scales = np.abs(embeddings).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        quantized = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+
+    def _tag_similarities(self, text_embeddings: np.ndarray) -> np.ndarray:
+        """Similitud coseno (B, N) entre textos normalizados y la matriz de etiquetas"""
+        if self._tag_embeddings_i8 is None:
+            return text_embeddings @ self._tag_embeddings.T
+
+        # Producto entero acumulado en int32 y reescalado con las escalas de ambos lados
+        text_i8, text_scales = self._quantize_int8(text_embeddings)
+        dots = text_i8.astype(np.int32) @ self._tag_embeddings_i8.astype(np.int32).T
+        return dots.astype(np.float32) * text_scales[:, None] * self._tag_scales[None, :]
+
+    def _top_semantic_tags(self, similarities: np.ndarray, max_tags: int) -> List[Dict[str, Any]]:
+        """Etiquetas sobre el umbral con mayor similitud, ordenadas por confianza"""
+        candidates = np.flatnonzero(similarities > 0.3)  # Umbral de similitud
+        if len(candidates) > max_tags:
+            candidates = candidates[np.argpartition(
+                similarities[candidates], -max_tags)[-max_tags:]]
+
+        # Ordenar por confianza
+        candidates = candidates[np.argsort(
+            -similarities[candidates], kind="stable")]
+
+        # Conversión a tipos Python una sola vez, solo para las etiquetas elegidas
+        return [
+            {
+                "name": self._tag_names[i],
+                "category": self._tag_categories[i],
+                "type": "semantic",
+                "confidence": confidence,
+                "source": "semantic_analysis"
+            }
+            for i, confidence in zip(candidates.tolist(), similarities[candidates].tolist())
+        ]
 
     def _prioritize_tags(self, tags: List[Dict[str, Any]],
                          category: str = None, max_tags: int = 8) -> List[Dict[str, Any]]:
@@ -206,74 +473,78 @@ class SmartTaggingService:
                 if tag["confidence"] > unique_tags[tag_name]["confidence"]:
                     unique_tags[tag_name] = tag
 
-        # Convertir de vuelta a lista
-        unique_tags_list = list(unique_tags.values())
-
-        # Priorizar etiquetas de la categoría específica
-        if category:
-            category_tags = [
-                t for t in unique_tags_list if t["category"] == category]
-            other_tags = [
-                t for t in unique_tags_list if t["category"] != category]
-
-            # Ordenar por confianza
-            category_tags.sort(key=lambda x: x["confidence"], reverse=True)
-            other_tags.sort(key=lambda x: x["confidence"], reverse=True)
-
-            # Combinar priorizando la categoría
-            prioritized = category_tags + other_tags
-        else:
-            # Ordenar solo por confianza
-            prioritized = sorted(unique_tags_list,
-                                 key=lambda x: x["confidence"], reverse=True)
-
-        return prioritized[:max_tags]
-
-    def _enhance_tags(self, tags: List[Dict[str, Any]],
-                      text: str) -> List[Dict[str, Any]]:
+        # Priorizar etiquetas de la categoría específica y luego por confianza
+        # (nlargest es estable: mismo resultado que ordenar y cortar, en O(N log max_tags))
+        return heapq.nlargest(
+            max_tags,
+            unique_tags.values(),
+            key=lambda x: (bool(category) and x["category"] == category, x["confidence"])
+        )
+
+    def _enhance_tags(self, tags: List[Dict[str, Any]], text: str, weights: List[float],
+                      occurrences: Optional[Dict[str, List[int]]] = None,
+                      text_lower: Optional[str] = None) -> List[Dict[str, Any]]:
         """Mejora las etiquetas con metadatos adicionales"""
         enhanced_tags = []
 
-        for tag in tags:
+        for tag, weight in zip(tags, weights):
             enhanced_tag = tag.copy()
 
             # Agregar metadatos adicionales
-            enhanced_tag["weight"] = self._calculate_tag_weight(tag, text)
+            enhanced_tag["weight"] = weight
             enhanced_tag["context"] = self._extract_tag_context(
-                tag["name"], text)
+                tag["name"], text, occurrences, text_lower)
             enhanced_tag["related_tags"] = self._find_related_tags(tag)
 
             enhanced_tags.append(enhanced_tag)
 
         return enhanced_tags
 
-    def _calculate_tag_weight(self, tag: Dict[str, Any], text: str) -> float:
-        """Calcula el peso de una etiqueta basado en el contexto"""
-        base_weight = tag["confidence"]
+    def _tag_frequency(self, tag_name: str, text: str,
+                       occurrences: Optional[Dict[str, List[int]]] = None,
+                       text_lower: Optional[str] = None) -> int:
+        """Número de apariciones de una etiqueta en el texto"""
+        tag_lower = tag_name.lower()
+        if occurrences is not None:
+            # Frecuencia ya contada en la pasada del autómata
+            return len(occurrences.get(tag_lower, ()))
+        return (text_lower if text_lower is not None
+                else text.lower()).count(tag_lower)
+
+    @staticmethod
+    def _calculate_tag_weights(tags: List[Dict[str, Any]], frequencies: List[int]) -> np.ndarray:
+        """Calcula el peso de cada etiqueta basado en el contexto (vectorizado sobre todo el lote)"""
+        confidences = np.fromiter(
+            (tag["confidence"] for tag in tags), dtype=np.float64, count=len(tags))
+        frequencies = np.asarray(frequencies, dtype=np.int64)
+        is_keyword = np.fromiter(
+            (tag["type"] == "keyword" for tag in tags), dtype=bool, count=len(tags))
 
         # Aumentar peso si aparece múltiples veces
-        text_lower = text.lower()
-        tag_lower = tag["name"].lower()
-        frequency = text_lower.count(tag_lower)
-
-        if frequency > 1:
-            base_weight += min(0.2, frequency * 0.05)
+        weights = confidences + np.where(
+            frequencies > 1, np.minimum(0.2, frequencies * 0.05), 0.0)
 
         # Aumentar peso si es de la categoría principal del texto
-        if tag["type"] == "keyword":
-            base_weight += 0.1
+        weights += np.where(is_keyword, 0.1, 0.0)
 
-        return min(1.0, base_weight)
+        return np.minimum(1.0, weights)
 
-    def _extract_tag_context(self, tag_name: str, text: str) -> str:
+    def _extract_tag_context(self, tag_name: str, text: str,
+                             occurrences: Optional[Dict[str, List[int]]] = None,
+                             text_lower: Optional[str] = None) -> str:
         """Extrae el contexto alrededor de una etiqueta"""
         try:
             # Buscar la etiqueta en el texto
             tag_lower = tag_name.lower()
-            text_lower = text.lower()
+            if occurrences is not None:
+                # Primera posición ya encontrada en la pasada del autómata
+                positions = occurrences.get(tag_lower)
+                start_idx = positions[0] if positions else -1
+            else:
+                start_idx = (text_lower if text_lower is not None
+                             else text.lower()).find(tag_lower)
 
-            if tag_lower in text_lower:
-                start_idx = text_lower.find(tag_lower)
+            if start_idx >= 0:
                 end_idx = start_idx + len(tag_name)
 
                 # Extraer contexto (50 caracteres antes y después)
@@ -291,25 +562,20 @@ class SmartTaggingService:
 
     def _find_related_tags(self, tag: Dict[str, Any]) -> List[str]:
         """Encuentra etiquetas relacionadas"""
-        related = []
-
-        # Buscar en la misma categoría
         category = tag["category"]
-        if category in self.predefined_tags:
-            category_tags = self.predefined_tags[category]
-            # Agregar hasta 3 etiquetas relacionadas
-            for related_tag in category_tags[:3]:
-                if related_tag != tag["name"]:
-                    related.append(related_tag)
+        related = self._related_tags.get((category, tag["name"]))
+        if related is not None:
+            return list(related)
 
-        return related
+        # Etiqueta fuera de las predefinidas: buscar en la misma categoría
+        category_tags = self.predefined_tags.get(category, [])
+        # Agregar hasta 3 etiquetas relacionadas
+        return [related_tag for related_tag in category_tags[:3]
+                if related_tag != tag["name"]]
 
     def _get_tag_category(self, tag_name: str) -> str:
         """Obtiene la categoría de una etiqueta"""
-        for category, tags in self.predefined_tags.items():
-            if tag_name in tags:
-                return category
-        return "general"
+        return self._tag_to_category.get(tag_name, "general")
 
     def _fallback_tags(self, category: str = None, max_tags: int = 5) -> List[Dict[str, Any]]:
         """Etiquetas de respaldo si falla el análisis"""
@@ -375,4 +641,6 @@ class SmartTaggingService:
 
 
 # Instancia global del servicio de tagging
-smart_tagging_service = SmartTaggingService()
+smart_tagging_service = SmartTaggingService(
+    int8_tags=settings.SMART_TAGGING_INT8_TAGS,
+    encoder_backend=settings.EMBEDDING_BACKEND)
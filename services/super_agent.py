@@ -9,27 +9,64 @@ from models.customer import CustomerProfile as CustomerProfileModel
 from models.conversation import Conversation as ConversationModel
 from sqlmodel import Session, select
 from core.db import get_session
+from core.config import settings
 from models.metric import AgentMetrics
 from models.customer import CustomerProfile
 from models.conversation import Conversation
 from models.agent_models import AgentAction, AgentMemory
 from services.smart_tagging import smart_tagging_service
-from services.agents import agent_manager
+# Módulo (no sus instancias): los agentes globales se crean en el primer uso
+from services import agents as agents_service
 from services.vector_store import vector_store
 from services.llm import llm_service
+from services.pattern_batcher import pattern_lookup_batcher
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
+import asyncio
+import copy
+import hashlib
 import json
 import logging
-from collections import defaultdict, Counter
-import numpy as np
-from sklearn.cluster import KMeans
-from sklearn.feature_extraction.text import TfidfVectorizer
+import re
+import threading
+import time
+from collections import defaultdict, Counter, OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
 import pytz
 
 # Configuración de zona horaria
 COLOMBIA_TZ = pytz.timezone("America/Bogota")
 
+# Máximo de entradas que conserva cada historial de la memoria global
+MEMORY_HISTORY_MAXLEN = 10_000
+
+# UUID en hexadecimal, con o sin guiones
+_UUID_RE = re.compile(
+    r"[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}", re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def _is_valid_uuid(uuid_string: str) -> bool:
+    """Verifica si un string es un UUID válido (sin construir UUID ni capturar excepciones)"""
+    return bool(uuid_string) and _UUID_RE.fullmatch(uuid_string) is not None
+
+
+@contextmanager
+def _session_scope(session: Optional[Session] = None):
+    """Usa la sesión recibida (deshaciendo la transacción si algo falla) o abre una propia"""
+    if session is None:
+        with get_session() as own_session:
+            yield own_session
+        return
+
+    try:
+        yield session
+    except Exception:
+        # La sesión es compartida: dejarla utilizable para los pasos siguientes
+        session.rollback()
+        raise
+
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -47,16 +84,10 @@ class SuperAgent:
         self.creation_date = datetime.now()
 
         # Memoria central del sistema
-        self.global_memory = {
-            "customer_patterns": {},      # Patrones de comportamiento de clientes
-            "conversation_trends": {},    # Tendencias en conversaciones
-            "agent_performance": {},      # Rendimiento de agentes
-            "business_insights": {},      # Insights de negocio
-            "learning_cycles": [],        # Ciclos de aprendizaje
-            "optimization_history": [],   # Historial de optimizaciones
-            "agent_optimizations": [],    # Optimizaciones de agentes
-            "routing_optimizations": []   # Optimizaciones de enrutamiento
-        }
+        self.global_memory = self.new_global_memory()
+
+        # Total de ciclos de aprendizaje (no disminuye cuando el historial descarta entradas)
+        self.total_learning_cycles = 0
 
         # Métricas agregadas
         self.aggregated_metrics = {
@@ -75,6 +106,10 @@ class SuperAgent:
             "memory_retention_days": 90   # Días de retención de memoria
         }
 
+        # Caché de búsquedas de enrutamiento: firma -> (expira_en, (patrones, aprendizajes, cliente))
+        self._routing_cache: "OrderedDict[str, Tuple[float, Tuple[List[Dict[str, Any]], ...]]]" = OrderedDict()
+        self._routing_cache_lock = threading.Lock()
+
         # Estado del sistema
         self.last_optimization = datetime.now()
         self.is_learning = False
@@ -86,6 +121,24 @@ class SuperAgent:
         logger.info(
             "🧠 Super Agente inicializado - Sistema de aprendizaje activo")
 
+    @staticmethod
+    def new_global_memory() -> Dict[str, Any]:
+        """Memoria global vacía; los historiales son acotados (se descartan las entradas más antiguas)"""
+        return {
+            "customer_patterns": {},      # Patrones de comportamiento de clientes
+            "conversation_trends": {},    # Tendencias en conversaciones
+            "agent_performance": {},      # Rendimiento de agentes
+            "business_insights": {},      # Insights de negocio
+            # Ciclos de aprendizaje
+            "learning_cycles": deque(maxlen=MEMORY_HISTORY_MAXLEN),
+            # Historial de optimizaciones
+            "optimization_history": deque(maxlen=MEMORY_HISTORY_MAXLEN),
+            # Optimizaciones de agentes
+            "agent_optimizations": deque(maxlen=MEMORY_HISTORY_MAXLEN),
+            # Optimizaciones de enrutamiento
+            "routing_optimizations": deque(maxlen=MEMORY_HISTORY_MAXLEN)
+        }
+
     def _register_in_database(self):
         """Registra el Super Agente en la base de datos"""
         try:
@@ -107,7 +160,7 @@ class SuperAgent:
                     existing_super_agent.updated_at = datetime.now()
                     existing_super_agent.metadata = {
                         "uptime_hours": 0,
-                        "total_learning_cycles": len(self.global_memory["learning_cycles"]),
+                        "total_learning_cycles": self.total_learning_cycles,
                         "total_optimizations": self.optimization_count
                     }
                     session.add(existing_super_agent)
@@ -155,14 +208,75 @@ class SuperAgent:
             # 1. Análisis inicial de la conversación
             initial_analysis = self._analyze_conversation_context(conversation)
 
-            # 2. 🆕 APLICAR APRENDIZAJES PARA ENRUTAMIENTO INTELIGENTE
-            intelligent_routing = self._apply_learnings_for_routing(
-                conversation)
+            # Una sola sesión para todos los pasos que usan la BD (la conexión se
+            # toma del pool en la primera consulta)
+            with get_session() as session:
+                # 2. 🆕 APLICAR APRENDIZAJES PARA ENRUTAMIENTO INTELIGENTE
+                intelligent_routing = self._apply_learnings_for_routing(
+                    conversation, session=session)
+                # Cerrar la transacción de lectura antes de enrutar a los agentes
+                # para no retener la conexión inactiva dentro de una transacción
+                session.commit()
+                logger.info(
+                    f"🧠 Enrutamiento inteligente basado en aprendizajes: {intelligent_routing}")
+
+                # 3. Enrutar a agentes especializados usando aprendizajes
+                agent_results = self._route_to_specialized_agents_with_learnings(
+                    conversation, initial_analysis, intelligent_routing)
+
+                # 4. Sintetizar resultados de todos los agentes
+                synthesis = self._synthesize_agent_results(
+                    agent_results, conversation)
+
+                # 5. Aprender del proceso completo
+                learning_outcome = self._learn_from_conversation(
+                    conversation, synthesis, session=session)
+
+                # 6. 🆕 APLICAR OPTIMIZACIONES BASADAS EN APRENDIZAJES
+                if intelligent_routing.get("optimization_applied", False):
+                    logger.info(
+                        f"🔧 Optimizaciones aplicadas basándose en aprendizajes")
+
+                # 7. Guardar aprendizajes en BD
+                self._save_learnings_to_db(
+                    conversation, learning_outcome, session=session)
+
+                # 8. Actualizar métricas
+                self._update_metrics_in_db(
+                    conversation, synthesis, session=session)
+
+                # 9-10. Actualizar memoria global y ciclo de aprendizaje
+                self._finalize_learning(
+                    conversation, synthesis, learning_outcome, session=session)
+
+            return self._processing_result(
+                conversation, intelligent_routing, agent_results, synthesis, learning_outcome)
+
+        except Exception as e:
+            logger.error(f"❌ Error procesando conversación: {e}")
+            return {"error": str(e)}
+
+    async def aprocess_conversation(self, conversation: Conversation) -> Dict[str, Any]:
+        """
+        Versión asíncrona de process_conversation: los pasos independientes
+        (consultas a BD y agentes) se ejecutan en paralelo sin bloquear el event loop
+        """
+        try:
+            logger.info(
+                f"🧠 Super Agente procesando conversación: {conversation.id}")
+
+            # 1-2. Análisis inicial y enrutamiento por aprendizajes (consultas independientes)
+            initial_analysis, intelligent_routing = await asyncio.gather(
+                asyncio.to_thread(
+                    self._analyze_conversation_context, conversation),
+                asyncio.to_thread(
+                    self._apply_learnings_for_routing, conversation)
+            )
             logger.info(
                 f"🧠 Enrutamiento inteligente basado en aprendizajes: {intelligent_routing}")
 
-            # 3. Enrutar a agentes especializados usando aprendizajes
-            agent_results = self._route_to_specialized_agents_with_learnings(
+            # 3. Enrutar a todos los agentes especializados a la vez
+            agent_results = await self._aroute_to_specialized_agents_with_learnings(
                 conversation, initial_analysis, intelligent_routing)
 
             # 4. Sintetizar resultados de todos los agentes
@@ -170,41 +284,58 @@ class SuperAgent:
                 agent_results, conversation)
 
             # 5. Aprender del proceso completo
-            learning_outcome = self._learn_from_conversation(
-                conversation, synthesis)
+            learning_outcome = await asyncio.to_thread(
+                self._learn_from_conversation, conversation, synthesis)
 
             # 6. 🆕 APLICAR OPTIMIZACIONES BASADAS EN APRENDIZAJES
             if intelligent_routing.get("optimization_applied", False):
                 logger.info(
                     f"🔧 Optimizaciones aplicadas basándose en aprendizajes")
 
-            # 7. Guardar aprendizajes en BD
-            self._save_learnings_to_db(conversation, learning_outcome)
-
-            # 8. Actualizar métricas
-            self._update_metrics_in_db(conversation, synthesis)
+            # 7-8. Guardar aprendizajes y actualizar métricas en BD en paralelo
+            await asyncio.gather(
+                asyncio.to_thread(
+                    self._save_learnings_to_db, conversation, learning_outcome),
+                asyncio.to_thread(
+                    self._update_metrics_in_db, conversation, synthesis)
+            )
 
-            # 9. Actualizar memoria global
-            self._update_global_memory(
-                conversation, synthesis, learning_outcome)
-
-            # 10. Verificar si hay aprendizajes significativos
-            if self._has_significant_learning(learning_outcome):
-                self._trigger_learning_cycle(learning_outcome)
+            # 9-10. Actualizar memoria global y ciclo de aprendizaje
+            await asyncio.to_thread(
+                self._finalize_learning, conversation, synthesis, learning_outcome)
 
-            return {
-                "conversation_id": conversation.id,
-                "intelligent_routing": intelligent_routing,
-                "agent_results": agent_results,
-                "synthesis": synthesis,
-                "learning_outcome": learning_outcome,
-                "optimizations_applied": intelligent_routing.get("optimization_applied", False)
-            }
+            return self._processing_result(
+                conversation, intelligent_routing, agent_results, synthesis, learning_outcome)
 
         except Exception as e:
             logger.error(f"❌ Error procesando conversación: {e}")
             return {"error": str(e)}
 
+    def _finalize_learning(self, conversation: Conversation, synthesis: Dict[str, Any],
+                           learning_outcome: Dict[str, Any], session: Optional[Session] = None):
+        """Actualiza la memoria global y dispara un ciclo de aprendizaje si es significativo"""
+        # Actualizar memoria global
+        self._update_global_memory(
+            conversation, synthesis, learning_outcome, session=session)
+
+        # Verificar si hay aprendizajes significativos
+        if self._has_significant_learning(learning_outcome):
+            self._trigger_learning_cycle(learning_outcome)
+
+    @staticmethod
+    def _processing_result(conversation: Conversation, intelligent_routing: Dict[str, Any],
+                           agent_results: Dict[str, Any], synthesis: Dict[str, Any],
+                           learning_outcome: Dict[str, Any]) -> Dict[str, Any]:
+        """Respuesta de process_conversation"""
+        return {
+            "conversation_id": conversation.id,
+            "intelligent_routing": intelligent_routing,
+            "agent_results": agent_results,
+            "synthesis": synthesis,
+            "learning_outcome": learning_outcome,
+            "optimizations_applied": intelligent_routing.get("optimization_applied", False)
+        }
+
     def _analyze_conversation_context(self, conversation: Conversation) -> Dict[str, Any]:
         """Analiza el contexto completo de una conversación"""
         context = {
@@ -258,12 +389,7 @@ class SuperAgent:
 
     def _is_valid_uuid(self, uuid_string: str) -> bool:
         """Verifica si un string es un UUID válido"""
-        try:
-            import uuid
-            uuid.UUID(uuid_string)
-            return True
-        except ValueError:
-            return False
+        return _is_valid_uuid(uuid_string)
 
     def _route_to_specialized_agents(self, conversation: Conversation,
                                      context: Dict[str, Any]) -> Dict[str, Any]:
@@ -279,7 +405,7 @@ class SuperAgent:
             for agent_type in required_agents:
                 logger.info(f"🧠 Enrutando a agente: {agent_type}")
 
-                agent_result = agent_manager.route_conversation(
+                agent_result = agents_service.agent_manager.route_conversation(
                     conversation,
                     agent_type=agent_type,
                     context=context
@@ -298,7 +424,57 @@ class SuperAgent:
             logger.error(f"❌ Error enrutando a agentes: {e}")
             return {"error": str(e)}
 
-    def _apply_learnings_for_routing(self, conversation: Conversation) -> Dict[str, Any]:
+    def _routing_signature(self, conversation: Conversation) -> str:
+        """Firma de los datos que consultan las búsquedas de enrutamiento: categoría, sentimiento, tags y cliente"""
+        customer_id = conversation.customer_id if conversation.customer_id and self._is_valid_uuid(
+            conversation.customer_id) else ""
+        # Los mismos 3 tags y en el mismo orden que usa la búsqueda de patrones
+        payload = f"{conversation.category}|{conversation.sentiment}|{conversation.tags[:3]}|{customer_id}"
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def _find_routing_inputs(self, session: Session, conversation: Conversation) -> Tuple[
+            List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Resultados de las búsquedas de aprendizajes, cacheados por firma de conversación (TTL)"""
+        signature = self._routing_signature(conversation)
+        now = time.monotonic()
+
+        with self._routing_cache_lock:
+            cached = self._routing_cache.get(signature)
+            if cached is not None and cached[0] > now:
+                self._routing_cache.move_to_end(signature)
+                logger.info(
+                    f"⚡ Búsquedas de enrutamiento desde caché para conversación: {conversation.id}")
+                similar_patterns, agent_learnings, customer_patterns = copy.deepcopy(
+                    cached[1])
+                # La entrada pudo calcularse para otra conversación: excluir la propia
+                similar_patterns = [
+                    p for p in similar_patterns if p["conversation_id"] != conversation.id]
+                return similar_patterns, agent_learnings, customer_patterns
+
+        # 1. Buscar patrones similares en conversaciones previas
+        similar_patterns = self._find_similar_conversation_patterns(
+            session, conversation)
+
+        # 2. Buscar aprendizajes de agentes para esta categoría
+        agent_learnings = self._find_agent_learnings_for_category(
+            session, conversation.category)
+
+        # 3. Buscar patrones de éxito del cliente
+        customer_patterns = self._find_customer_success_patterns(
+            session, conversation.customer_id)
+
+        inputs = (similar_patterns, agent_learnings, customer_patterns)
+        with self._routing_cache_lock:
+            self._routing_cache[signature] = (
+                now + settings.ROUTING_CACHE_TTL_SECONDS, copy.deepcopy(inputs))
+            self._routing_cache.move_to_end(signature)
+            while len(self._routing_cache) > settings.ROUTING_CACHE_MAXSIZE:
+                self._routing_cache.popitem(last=False)
+
+        return inputs
+
+    def _apply_learnings_for_routing(self, conversation: Conversation,
+                                     session: Optional[Session] = None) -> Dict[str, Any]:
         """Usa aprendizajes acumulados para tomar decisiones inteligentes de enrutamiento"""
         try:
             logger.info(
@@ -312,19 +488,11 @@ class SuperAgent:
                 "optimization_applied": False
             }
 
-            with get_session() as session:
-                # 1. Buscar patrones similares en conversaciones previas
-                similar_patterns = self._find_similar_conversation_patterns(
+            with _session_scope(session) as session:
+                # 1-3. Patrones similares, aprendizajes de agentes y patrones del cliente
+                similar_patterns, agent_learnings, customer_patterns = self._find_routing_inputs(
                     session, conversation)
 
-                # 2. Buscar aprendizajes de agentes para esta categoría
-                agent_learnings = self._find_agent_learnings_for_category(
-                    session, conversation.category)
-
-                # 3. Buscar patrones de éxito del cliente
-                customer_patterns = self._find_customer_success_patterns(
-                    session, conversation.customer_id)
-
                 # 4. Tomar decisión basada en aprendizajes
                 if similar_patterns or agent_learnings or customer_patterns:
                     routing_decision = self._make_intelligent_routing_decision(
@@ -365,48 +533,43 @@ class SuperAgent:
         try:
             patterns = []
 
-            # Buscar conversaciones con tags similares
-            if conversation.tags:
-                # Usar solo los 3 tags más importantes
-                for tag in conversation.tags[:3]:
-                    # Buscar conversaciones que contengan este tag
-                    similar_conversations = session.exec(
-                        select(ConversationModel)
-                        # Usar .any() en lugar de .contains()
-                        .where(ConversationModel.tags.any(tag))
-                        .where(ConversationModel.id != conversation.id)
-                        .order_by(ConversationModel.created_at.desc())
-                        .limit(5)
-                    ).all()
-
-                    for similar_conv in similar_conversations:
-                        patterns.append({
-                            "type": "tag_similarity",
-                            "tag": tag,
-                            "conversation_id": similar_conv.id,
-                            "category": similar_conv.category,
-                            "sentiment": similar_conv.sentiment,
-                            "success_rate": self._get_conversation_success_rate(similar_conv.id),
-                            "similarity_score": 0.8
-                        })
-
-            # Buscar conversaciones de la misma categoría con sentimiento similar
-            category_conversations = session.exec(
-                select(ConversationModel)
-                .where(ConversationModel.category == conversation.category)
-                .where(ConversationModel.id != conversation.id)
-                .order_by(ConversationModel.created_at.desc())
-                .limit(10)
-            ).all()
+            # Tags (solo los 3 más importantes) y categoría en una consulta agrupada
+            # con las de otras conversaciones en curso
+            top_tags = conversation.tags[:3]
+            lookup = pattern_lookup_batcher.lookup_blocking(
+                top_tags, conversation.category, conversation.id, session=session)
+
+            # Tasa de éxito de todas las conversaciones encontradas de una vez
+            success_rates = self._get_conversation_success_rates(
+                [row.id for row in lookup["tags"]] +
+                [row.id for row in lookup["category"]])
+
+            # Conversaciones que comparten alguno de los tags
+            for similar_conv in lookup["tags"]:
+                conv_tags = set(json.loads(similar_conv.tags_json or "[]"))
+                shared_tags = [tag for tag in top_tags if tag in conv_tags]
+                if not shared_tags:
+                    continue
+                patterns.append({
+                    "type": "tag_similarity",
+                    "tag": shared_tags[0],
+                    "shared_tags": shared_tags,
+                    "conversation_id": similar_conv.id,
+                    "category": similar_conv.category,
+                    "sentiment": similar_conv.sentiment,
+                    "success_rate": success_rates[similar_conv.id],
+                    "similarity_score": round(0.8 * len(shared_tags) / len(top_tags), 3)
+                })
 
-            for cat_conv in category_conversations:
+            # Conversaciones de la misma categoría con sentimiento similar
+            for cat_conv in lookup["category"]:
                 if cat_conv.sentiment == conversation.sentiment:
                     patterns.append({
                         "type": "category_sentiment_similarity",
                         "conversation_id": cat_conv.id,
                         "category": cat_conv.category,
                         "sentiment": cat_conv.sentiment,
-                        "success_rate": self._get_conversation_success_rate(cat_conv.id),
+                        "success_rate": success_rates[cat_conv.id],
                         "similarity_score": 0.7
                     })
 
@@ -414,6 +577,8 @@ class SuperAgent:
 
         except Exception as e:
             logger.error(f"❌ Error encontrando patrones de conversación: {e}")
+            # La sesión es compartida: deshacer para no abortar las escrituras posteriores
+            session.rollback()
             return []
 
     def _find_agent_learnings_for_category(self, session: Session, category: str) -> List[Dict[str, Any]]:
@@ -421,9 +586,12 @@ class SuperAgent:
         try:
             learnings = []
 
-            # Buscar aprendizajes de agentes para esta categoría
+            # Buscar aprendizajes de agentes para esta categoría (solo las columnas usadas;
+            # resuelto por el índice parcial ix_agent_learnings_category_confidence)
             agent_learnings = session.exec(
-                select(AgentLearningModel)
+                select(AgentLearningModel.agent_type, AgentLearningModel.learning_type,
+                       AgentLearningModel.content, AgentLearningModel.confidence_score,
+                       AgentLearningModel.category, AgentLearningModel.created_at)
                 .where(AgentLearningModel.category == category)
                 .where(AgentLearningModel.confidence_score > 0.6)
                 .order_by(AgentLearningModel.confidence_score.desc())
@@ -444,6 +612,8 @@ class SuperAgent:
 
         except Exception as e:
             logger.error(f"❌ Error encontrando aprendizajes de agentes: {e}")
+            # La sesión es compartida: deshacer para no abortar las escrituras posteriores
+            session.rollback()
             return []
 
     def _find_customer_success_patterns(self, session: Session, customer_id: str) -> List[Dict[str, Any]]:
@@ -462,8 +632,11 @@ class SuperAgent:
                 .limit(10)
             ).all()
 
+            success_rates = self._get_conversation_success_rates(
+                [conv.id for conv in customer_conversations])
+
             for conv in customer_conversations:
-                success_rate = self._get_conversation_success_rate(conv.id)
+                success_rate = success_rates[conv.id]
                 if success_rate > 0.7:  # Solo conversaciones exitosas
                     patterns.append({
                         "type": "customer_success_pattern",
@@ -480,6 +653,8 @@ class SuperAgent:
         except Exception as e:
             logger.error(
                 f"❌ Error encontrando patrones de éxito del cliente: {e}")
+            # La sesión es compartida: deshacer para no abortar las escrituras posteriores
+            session.rollback()
             return []
 
     def _make_intelligent_routing_decision(self, conversation: Conversation,
@@ -498,30 +673,32 @@ class SuperAgent:
 
             # 1. Analizar patrones de conversaciones similares
             if similar_patterns:
-                successful_categories = [
-                    p["category"] for p in similar_patterns if p.get("success_rate", 0) > 0.7]
+                # Las 2 categorías exitosas más frecuentes
+                successful_categories = Counter(
+                    p["category"] for p in similar_patterns if p.get("success_rate", 0) > 0.7)
                 if successful_categories:
                     routing_decision["recommended_agents"].extend(
-                        successful_categories[:2])
+                        category for category, _ in successful_categories.most_common(2))
                     routing_decision["patterns_used"].append(
                         "conversation_similarity")
 
             # 2. Analizar aprendizajes de agentes
             if agent_learnings:
-                successful_agents = [l["agent_type"] for l in agent_learnings if l.get(
-                    "confidence_score", 0) > 0.8]
+                # Los 2 agentes con más aprendizajes de alta confianza
+                successful_agents = Counter(l["agent_type"] for l in agent_learnings if l.get(
+                    "confidence_score", 0) > 0.8)
                 if successful_agents:
                     routing_decision["recommended_agents"].extend(
-                        successful_agents[:2])
+                        agent_type for agent_type, _ in successful_agents.most_common(2))
                     routing_decision["patterns_used"].append("agent_learnings")
 
             # 3. Analizar patrones de éxito del cliente
             if customer_patterns:
-                customer_success_categories = [
-                    p["category"] for p in customer_patterns if p.get("success_rate", 0) > 0.8]
+                customer_success_categories = Counter(
+                    p["category"] for p in customer_patterns if p.get("success_rate", 0) > 0.8)
                 if customer_success_categories:
                     routing_decision["recommended_agents"].extend(
-                        customer_success_categories[:2])
+                        category for category, _ in customer_success_categories.most_common(2))
                     routing_decision["patterns_used"].append(
                         "customer_success_patterns")
 
@@ -529,9 +706,9 @@ class SuperAgent:
             if len(routing_decision["recommended_agents"]) < 2:
                 routing_decision["recommended_agents"].append("coordinator")
 
-            # 5. Eliminar duplicados y calcular confianza
+            # 5. Eliminar duplicados (conservando el orden de prioridad), limitar y calcular confianza
             routing_decision["recommended_agents"] = list(
-                set(routing_decision["recommended_agents"]))
+                dict.fromkeys(routing_decision["recommended_agents"]))[:3]
 
             # Calcular confianza basada en la cantidad y calidad de patrones
             pattern_count = len(routing_decision["patterns_used"])
@@ -578,19 +755,20 @@ class SuperAgent:
             logger.error(f"❌ Error aplicando optimizaciones: {e}")
             return []
 
-    def _get_conversation_success_rate(self, conversation_id: str) -> float:
-        """Calcula la tasa de éxito de una conversación basándose en métricas"""
+    def _get_conversation_success_rates(self, conversation_ids: List[Any]) -> Dict[Any, float]:
+        """Calcula la tasa de éxito de varias conversaciones a la vez (una consulta, no una por fila)"""
         try:
             # Por ahora, retornar un valor por defecto
-            # En el futuro, esto debería calcularse basándose en:
+            # En el futuro, esto debería calcularse con una sola consulta agregada
+            # (conversation_id IN ...) basándose en:
             # - Tiempo de resolución
             # - Satisfacción del cliente
             # - Métricas del agente
             # - Estado de la conversación
-            return 0.8  # Valor por defecto
+            return dict.fromkeys(conversation_ids, 0.8)  # Valor por defecto
         except Exception as e:
-            logger.error(f"❌ Error calculando tasa de éxito: {e}")
-            return 0.5
+            logger.error(f"❌ Error calculando tasas de éxito: {e}")
+            return dict.fromkeys(conversation_ids, 0.5)
 
     def _determine_required_agents(self, conversation: Conversation,
                                    context: Dict[str, Any]) -> List[str]:
@@ -615,7 +793,7 @@ class SuperAgent:
         # Agente de coordinación siempre presente
         required_agents.append("coordinator")
 
-        return list(set(required_agents))  # Eliminar duplicados
+        return list(dict.fromkeys(required_agents))  # Eliminar duplicados
 
     def _coordinate_agents(self, agent_results: Dict[str, Any],
                            conversation: Conversation) -> Dict[str, Any]:
@@ -665,12 +843,14 @@ class SuperAgent:
         return synthesis
 
     def _learn_from_conversation(self, conversation: Conversation,
-                                 synthesis: Dict[str, Any]) -> Dict[str, Any]:
+                                 synthesis: Dict[str, Any],
+                                 session: Optional[Session] = None) -> Dict[str, Any]:
         """Aprende de la conversación completa"""
         try:
             learning_outcome = {
                 "conversation_id": conversation.id,
-                "learning_timestamp": datetime.now().isoformat(),
+                # Mismo instante que la síntesis: una sola lectura del reloj por conversación
+                "learning_timestamp": synthesis.get("timestamp") or datetime.now().isoformat(),
                 "patterns_identified": [],
                 "system_improvements": [],
                 "agent_optimizations": [],
@@ -692,7 +872,7 @@ class SuperAgent:
 
             # Actualizar memoria global
             self._update_global_memory(
-                conversation, synthesis, learning_outcome)
+                conversation, synthesis, learning_outcome, session=session)
 
             # Verificar si hay aprendizajes significativos
             if self._has_significant_learning(learning_outcome):
@@ -925,6 +1105,7 @@ class SuperAgent:
             }
 
             self.global_memory["learning_cycles"].append(learning_cycle)
+            self.total_learning_cycles += 1
 
             # Marcar fin del ciclo
             self.is_learning = False
@@ -992,7 +1173,7 @@ class SuperAgent:
                 "version": self.version,
                 "status": "active" if not self.is_learning else "learning",
                 "uptime_hours": (datetime.now() - self.creation_date).total_seconds() / 3600,
-                "learning_cycles": len(self.global_memory["learning_cycles"]),
+                "learning_cycles": self.total_learning_cycles,
                 "optimization_count": self.optimization_count,
                 "last_optimization": self.last_optimization.isoformat()
             },
@@ -1487,7 +1668,7 @@ class SuperAgent:
             performance = {
                 "total_conversations": self.aggregated_metrics["total_conversations"],
                 "success_rate": self.aggregated_metrics["success_rate"],
-                "learning_cycles": len(self.global_memory["learning_cycles"]),
+                "learning_cycles": self.total_learning_cycles,
                 "optimization_count": self.optimization_count
             }
             return performance
@@ -1736,6 +1917,8 @@ class SuperAgent:
 
         except Exception as e:
             logger.error(f"❌ Error optimizando parámetros de agentes: {e}")
+            # La sesión es compartida: deshacer para no abortar las escrituras posteriores
+            session.rollback()
             return []
 
     def _optimize_routing_from_learnings(self, session: Session, conversation: Conversation,
@@ -1772,6 +1955,8 @@ class SuperAgent:
 
         except Exception as e:
             logger.error(f"❌ Error optimizando enrutamiento: {e}")
+            # La sesión es compartida: deshacer para no abortar las escrituras posteriores
+            session.rollback()
             return []
 
     def _apply_agent_parameter_optimization(self, optimization: Dict[str, Any]) -> bool:
@@ -1848,32 +2033,11 @@ class SuperAgent:
         try:
             agent_results = {}
 
-            # Usar agentes recomendados por el sistema de aprendizaje
-            recommended_agents = intelligent_routing.get(
-                "recommended_agents", [])
-
-            if recommended_agents and intelligent_routing.get("learning_based", False):
-                logger.info(
-                    f"🧠 Usando enrutamiento basado en aprendizajes: {recommended_agents}")
-
-                for agent_type in recommended_agents:
-                    try:
-                        agent_result = self._process_with_specific_agent(
-                            conversation, agent_type, initial_analysis)
-                        if agent_result:
-                            agent_results[agent_type] = agent_result
-                    except Exception as e:
-                        logger.error(f"❌ Error con agente {agent_type}: {e}")
-                        agent_results[agent_type] = {"error": str(e)}
-            else:
-                logger.info(
-                    f"⚠️ Usando enrutamiento por defecto para categoría: {conversation.category}")
-                # Enrutamiento por defecto
-                default_agent = conversation.category if conversation.category else "coordinator"
-                agent_result = self._process_with_specific_agent(
-                    conversation, default_agent, initial_analysis)
+            for agent_type in self._agents_for_routing(conversation, intelligent_routing):
+                agent_result = self._run_specific_agent(
+                    conversation, agent_type, initial_analysis)
                 if agent_result:
-                    agent_results[default_agent] = agent_result
+                    agent_results[agent_type] = agent_result
 
             return agent_results
 
@@ -1881,6 +2045,55 @@ class SuperAgent:
             logger.error(f"❌ Error enrutando a agentes especializados: {e}")
             return {"error": str(e)}
 
+    async def _aroute_to_specialized_agents_with_learnings(self, conversation: Conversation,
+                                                           initial_analysis: Dict[str, Any],
+                                                           intelligent_routing: Dict[str, Any]) -> Dict[str, Any]:
+        """Versión asíncrona: todos los agentes procesan la conversación en paralelo"""
+        try:
+            agent_types = self._agents_for_routing(
+                conversation, intelligent_routing)
+
+            results = await asyncio.gather(*(
+                asyncio.to_thread(self._run_specific_agent,
+                                  conversation, agent_type, initial_analysis)
+                for agent_type in agent_types
+            ))
+
+            return {
+                agent_type: agent_result
+                for agent_type, agent_result in zip(agent_types, results)
+                if agent_result
+            }
+
+        except Exception as e:
+            logger.error(f"❌ Error enrutando a agentes especializados: {e}")
+            return {"error": str(e)}
+
+    def _agents_for_routing(self, conversation: Conversation,
+                            intelligent_routing: Dict[str, Any]) -> List[str]:
+        """Agentes a usar: los recomendados por el sistema de aprendizaje o el de la categoría"""
+        recommended_agents = intelligent_routing.get("recommended_agents", [])
+
+        if recommended_agents and intelligent_routing.get("learning_based", False):
+            logger.info(
+                f"🧠 Usando enrutamiento basado en aprendizajes: {recommended_agents}")
+            return list(recommended_agents)
+
+        logger.info(
+            f"⚠️ Usando enrutamiento por defecto para categoría: {conversation.category}")
+        # Enrutamiento por defecto
+        return [conversation.category if conversation.category else "coordinator"]
+
+    def _run_specific_agent(self, conversation: Conversation, agent_type: str,
+                            initial_analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """Procesa con un agente aislando sus errores del resto"""
+        try:
+            return self._process_with_specific_agent(
+                conversation, agent_type, initial_analysis)
+        except Exception as e:
+            logger.error(f"❌ Error con agente {agent_type}: {e}")
+            return {"error": str(e)}
+
     def _process_with_specific_agent(self, conversation: Conversation, agent_type: str,
                                      initial_analysis: Dict[str, Any]) -> Dict[str, Any]:
         """Procesa la conversación con un agente específico"""
@@ -1937,7 +2150,8 @@ class SuperAgent:
 
     def _update_global_memory(self, conversation: Conversation,
                               synthesis: Dict[str, Any],
-                              learning_outcome: Dict[str, Any]):
+                              learning_outcome: Dict[str, Any],
+                              session: Optional[Session] = None):
         """Actualiza la memoria global y guarda aprendizajes en la base de datos"""
         try:
             # Actualizar memoria en memoria
@@ -1949,7 +2163,7 @@ class SuperAgent:
             }
 
             # Actualizar métricas en la base de datos
-            self._update_metrics_in_db(conversation, synthesis)
+            self._update_metrics_in_db(conversation, synthesis, session=session)
 
             # Actualizar métricas globales
             self._update_global_metrics(conversation, synthesis)
@@ -1960,10 +2174,11 @@ class SuperAgent:
         except Exception as e:
             logger.error(f"❌ Error actualizando memoria global: {e}")
 
-    def _save_learnings_to_db(self, conversation: Conversation, learning_outcome: Dict[str, Any]):
+    def _save_learnings_to_db(self, conversation: Conversation, learning_outcome: Dict[str, Any],
+                              session: Optional[Session] = None):
         """Guarda los aprendizajes en la base de datos"""
         try:
-            with get_session() as session:
+            with _session_scope(session) as session:
                 # 🚨 VALIDACIÓN: Verificar si ya existe un aprendizaje para esta conversación
                 # Usar una búsqueda más simple para evitar errores de metadata
                 existing_learning = session.exec(
@@ -1986,6 +2201,10 @@ class SuperAgent:
                 business_insights = len(
                     learning_outcome.get('business_insights', []))
 
+                # Marca de tiempo del aprendizaje, compartida por todos los registros
+                learning_timestamp = learning_outcome.get(
+                    "learning_timestamp") or datetime.now().isoformat()
+
                 # Crear contenido más descriptivo
                 content = f"Super Agente aprendió de conversación {conversation.id[:8]}... - {patterns_count} patrones, {agent_optimizations} optimizaciones, {business_insights} insights"
 
@@ -2002,28 +2221,27 @@ class SuperAgent:
                         "agent_optimizations": agent_optimizations,
                         "business_insights": business_insights,
                         "tags_analyzed": conversation.tags or [],
-                        "learning_timestamp": datetime.now().isoformat()
+                        "learning_timestamp": learning_timestamp
                     }
                 )
 
-                session.add(learning)
+                # 🆕 Aprendizajes específicos de tags, patrones identificados e insights de negocio
+                learnings = [learning]
+                if conversation.tags:
+                    learnings.extend(self._build_tag_learnings(
+                        conversation, learning_timestamp))
+                learnings.extend(self._build_pattern_learnings(
+                    conversation, learning_outcome, learning_timestamp))
+                learnings.extend(self._build_business_insight_learnings(
+                    conversation, learning_outcome, learning_timestamp))
+
+                # Un solo INSERT en lote y un solo commit para todos los registros
+                session.bulk_save_objects(learnings)
                 session.commit()
 
                 logger.info(
-                    f"💾 Aprendizaje del Super Agente guardado en BD para conversación: {conversation.id}")
-
-                # 🆕 También guardar aprendizajes específicos de tags si existen
-                if conversation.tags:
-                    self._save_tag_learnings_to_db(
-                        session, conversation, learning_outcome)
-
-                # 🆕 Guardar aprendizajes de patrones identificados
-                self._save_pattern_learnings_to_db(
-                    session, conversation, learning_outcome)
-
-                # 🆕 Guardar insights de negocio
-                self._save_business_insights_to_db(
-                    session, conversation, learning_outcome)
+                    f"💾 Aprendizaje del Super Agente guardado en BD para conversación: {conversation.id} "
+                    f"({len(learnings)} registros)")
 
                 # 🆕 ACTUALIZAR MÉTRICAS DEL SUPER AGENTE EN LA BD
                 self._update_super_agent_metrics(
@@ -2034,99 +2252,68 @@ class SuperAgent:
             import traceback
             logger.error(f"🔍 Traceback: {traceback.format_exc()}")
 
-    def _save_tag_learnings_to_db(self, session: Session, conversation: Conversation, learning_outcome: Dict[str, Any]):
-        """Guarda aprendizajes específicos relacionados con tags"""
-        try:
-            # Solo los 3 tags más importantes
-            for tag in conversation.tags[:3]:
-                # Crear aprendizaje específico del tag
-                tag_learning = AgentLearningModel(
-                    agent_type="super_agent",
-                    learning_type="tag_learning",
-                    content=f"Super Agente aprendió del tag '{tag}' en conversación {conversation.id[:8]}...",
-                    confidence_score=0.7,
-                    category=conversation.category or "general",
-                    metadata={
-                        "conversation_id": conversation.id,
-                        "tag_analyzed": tag,
-                        "tag_context": conversation.category,
-                        "learning_timestamp": datetime.now().isoformat()
-                    }
-                )
-
-                session.add(tag_learning)
-
-            session.commit()
-            logger.info(
-                f"🏷️ Aprendizajes de tags del Super Agente guardados en BD")
-
-        except Exception as e:
-            logger.error(f"❌ Error guardando aprendizajes de tags: {e}")
-
-    def _save_pattern_learnings_to_db(self, session: Session, conversation: Conversation, learning_outcome: Dict[str, Any]):
-        """Guarda aprendizajes de patrones específicos identificados"""
-        try:
-            patterns = learning_outcome.get('patterns_identified', [])
-
-            for pattern in patterns[:5]:  # Solo los 5 patrones más importantes
-                # Crear aprendizaje específico del patrón
-                pattern_learning = AgentLearningModel(
-                    agent_type="super_agent",
-                    learning_type="pattern_learning",
-                    content=f"Super Agente identificó patrón: {pattern.get('type', 'unknown')} - {pattern.get('pattern', 'Sin descripción')[:50]}...",
-                    confidence_score=pattern.get('confidence', 0.7),
-                    category=conversation.category or "general",
-                    metadata={
-                        "conversation_id": conversation.id,
-                        "pattern_type": pattern.get('type', 'unknown'),
-                        "pattern_description": pattern.get('pattern', ''),
-                        "pattern_confidence": pattern.get('confidence', 0.7),
-                        "data_points": pattern.get('data_points', 1),
-                        "learning_timestamp": datetime.now().isoformat()
-                    }
-                )
-
-                session.add(pattern_learning)
-
-            if patterns:
-                session.commit()
-                logger.info(
-                    f"🔍 Aprendizajes de patrones del Super Agente guardados en BD: {len(patterns)} patrones")
-
-        except Exception as e:
-            logger.error(f"❌ Error guardando aprendizajes de patrones: {e}")
-
-    def _save_business_insights_to_db(self, session: Session, conversation: Conversation, learning_outcome: Dict[str, Any]):
-        """Guarda insights de negocio identificados por el Super Agente"""
-        try:
-            insights = learning_outcome.get('business_insights', [])
-
-            for insight in insights[:3]:  # Solo los 3 insights más importantes
-                # Crear aprendizaje específico del insight
-                insight_learning = AgentLearningModel(
-                    agent_type="super_agent",
-                    learning_type="business_insight",
-                    content=f"Super Agente identificó insight: {insight.get('type', 'unknown')} - {insight.get('content', 'Sin descripción')[:50]}...",
-                    confidence_score=insight.get('confidence', 0.7),
-                    category=conversation.category or "general",
-                    metadata={
-                        "conversation_id": conversation.id,
-                        "insight_type": insight.get('type', 'unknown'),
-                        "insight_content": insight.get('content', ''),
-                        "insight_confidence": insight.get('confidence', 0.7),
-                        "learning_timestamp": datetime.now().isoformat()
-                    }
-                )
-
-                session.add(insight_learning)
-
-            if insights:
-                session.commit()
-                logger.info(
-                    f"💡 Insights de negocio del Super Agente guardados en BD: {len(insights)} insights")
-
-        except Exception as e:
-            logger.error(f"❌ Error guardando insights de negocio: {e}")
+    def _build_tag_learnings(self, conversation: Conversation,
+                             learning_timestamp: str) -> List[AgentLearningModel]:
+        """Aprendizajes específicos relacionados con tags (solo los 3 más importantes)"""
+        return [
+            AgentLearningModel(
+                agent_type="super_agent",
+                learning_type="tag_learning",
+                content=f"Super Agente aprendió del tag '{tag}' en conversación {conversation.id[:8]}...",
+                confidence_score=0.7,
+                category=conversation.category or "general",
+                metadata={
+                    "conversation_id": conversation.id,
+                    "tag_analyzed": tag,
+                    "tag_context": conversation.category,
+                    "learning_timestamp": learning_timestamp
+                }
+            )
+            for tag in conversation.tags[:3]
+        ]
+
+    def _build_pattern_learnings(self, conversation: Conversation, learning_outcome: Dict[str, Any],
+                                 learning_timestamp: str) -> List[AgentLearningModel]:
+        """Aprendizajes de los patrones identificados (solo los 5 más importantes)"""
+        return [
+            AgentLearningModel(
+                agent_type="super_agent",
+                learning_type="pattern_learning",
+                content=f"Super Agente identificó patrón: {pattern.get('type', 'unknown')} - {pattern.get('pattern', 'Sin descripción')[:50]}...",
+                confidence_score=pattern.get('confidence', 0.7),
+                category=conversation.category or "general",
+                metadata={
+                    "conversation_id": conversation.id,
+                    "pattern_type": pattern.get('type', 'unknown'),
+                    "pattern_description": pattern.get('pattern', ''),
+                    "pattern_confidence": pattern.get('confidence', 0.7),
+                    "data_points": pattern.get('data_points', 1),
+                    "learning_timestamp": learning_timestamp
+                }
+            )
+            for pattern in learning_outcome.get('patterns_identified', [])[:5]
+        ]
+
+    def _build_business_insight_learnings(self, conversation: Conversation, learning_outcome: Dict[str, Any],
+                                          learning_timestamp: str) -> List[AgentLearningModel]:
+        """Aprendizajes de los insights de negocio identificados (solo los 3 más importantes)"""
+        return [
+            AgentLearningModel(
+                agent_type="super_agent",
+                learning_type="business_insight",
+                content=f"Super Agente identificó insight: {insight.get('type', 'unknown')} - {insight.get('content', 'Sin descripción')[:50]}...",
+                confidence_score=insight.get('confidence', 0.7),
+                category=conversation.category or "general",
+                metadata={
+                    "conversation_id": conversation.id,
+                    "insight_type": insight.get('type', 'unknown'),
+                    "insight_content": insight.get('content', ''),
+                    "insight_confidence": insight.get('confidence', 0.7),
+                    "learning_timestamp": learning_timestamp
+                }
+            )
+            for insight in learning_outcome.get('business_insights', [])[:3]
+        ]
 
     def _update_super_agent_metrics(self, session: Session, conversation: Conversation, learning_outcome: Dict[str, Any]):
         """Actualiza las métricas del Super Agente en la base de datos"""
@@ -2162,7 +2349,7 @@ class SuperAgent:
                 # Actualizar metadatos
                 super_agent_record.metadata.update({
                     "uptime_hours": (datetime.now() - self.creation_date).total_seconds() / 3600,
-                    "total_learning_cycles": len(self.global_memory.get("learning_cycles", [])),
+                    "total_learning_cycles": self.total_learning_cycles,
                     "total_optimizations": self.optimization_count,
                     "last_conversation_processed": conversation.id,
                     "last_learning_timestamp": datetime.now().isoformat()
@@ -2182,10 +2369,11 @@ class SuperAgent:
             logger.error(
                 f"❌ Error actualizando métricas del Super Agente: {e}")
 
-    def _update_metrics_in_db(self, conversation: Conversation, synthesis: Dict[str, Any]):
+    def _update_metrics_in_db(self, conversation: Conversation, synthesis: Dict[str, Any],
+                              session: Optional[Session] = None):
         """Actualiza métricas en la base de datos"""
         try:
-            with get_session() as session:
+            with _session_scope(session) as session:
                 # Crear métrica del agente
                 metric = AgentMetricModel(
                     agent_id="super_agent",
@@ -2243,14 +2431,13 @@ class SuperAgent:
                 # Actualizar métricas
                 super_agent_record.total_conversations_processed = self.aggregated_metrics[
                     "total_conversations"]
-                super_agent_record.total_learnings_generated = len(
-                    self.global_memory["learning_cycles"])
+                super_agent_record.total_learnings_generated = self.total_learning_cycles
                 super_agent_record.success_rate = self.aggregated_metrics["success_rate"]
 
                 # Actualizar metadata
                 super_agent_record.agent_metadata = {
                     "uptime_hours": (datetime.now() - self.creation_date).total_seconds() / 3600,
-                    "total_learning_cycles": len(self.global_memory["learning_cycles"]),
+                    "total_learning_cycles": self.total_learning_cycles,
                     "total_optimizations": self.optimization_count,
                     "total_patterns": len(self.global_memory["customer_patterns"]),
                     "total_trends": len(self.global_memory["conversation_trends"]),
@@ -2264,7 +2451,7 @@ class SuperAgent:
                 session.commit()
 
                 logger.info(
-                    f"💾 Memoria sincronizada con BD - Ciclos: {len(self.global_memory['learning_cycles'])}, Optimizaciones: {self.optimization_count}")
+                    f"💾 Memoria sincronizada con BD - Ciclos: {self.total_learning_cycles}, Optimizaciones: {self.optimization_count}")
 
         except Exception as e:
             logger.error(f"❌ Error sincronizando memoria con BD: {e}")
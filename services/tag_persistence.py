@@ -1,11 +1,15 @@
 """
 Servicio para persistir tags en la base de datos
 """
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from uuid import uuid4
 from datetime import datetime
 
+import orjson
+
 print("🚨 IMPORTANDO tag_persistence.py")
 
 try:
@@ -35,6 +39,9 @@ except Exception as e:
 logger = logging.getLogger(__name__)
 print("✅ Logger configurado")
 
+# Tiempo de vida del catálogo de tags cacheado
+ALL_TAGS_CACHE_TTL_SECONDS = 30
+
 
 class TagPersistenceService:
     """Servicio para persistir tags en la base de datos"""
@@ -42,6 +49,8 @@ class TagPersistenceService:
     def __init__(self):
         print("🚨 CONSTRUCTOR TagPersistenceService llamado")
         self.logger = logger
+        # (timestamp, tags, etag) del último get_all_tags
+        self._all_tags_cache: Optional[Tuple[float, List[Dict[str, Any]], str]] = None
         print("✅ TagPersistenceService inicializado")
 
     def _cleanup_session_on_error(self, session: Session):
@@ -102,37 +111,8 @@ class TagPersistenceService:
                 print(f"✅ DEBUG: Conversación {conversation_id} validada")
 
                 # Validar customer_id y convertirlo a UUID si es necesario
-                valid_customer_id = None
-                if customer_id and customer_id != "None":
-                    try:
-                        # Si es un UUID válido, usarlo directamente
-                        if len(customer_id) == 36 and '-' in customer_id:
-                            valid_customer_id = customer_id
-                        else:
-                            # Si no es UUID válido, intentar crear un customer profile
-                            from models.customer import CustomerProfile
-                            try:
-                                # Crear customer profile temporal sin validar UUID
-                                customer = CustomerProfile(
-                                    name=f"Cliente {customer_id}",
-                                    phone=customer_id if customer_id.startswith(
-                                        '+') else None,
-                                    email=f"{customer_id}@temp.com"
-                                )
-                                session.add(customer)
-                                session.flush()  # Para obtener el ID
-                                print(
-                                    f"✅ DEBUG: Customer profile creado con ID: {customer.id}")
-                                valid_customer_id = str(customer.id)
-                            except Exception as customer_error:
-                                print(
-                                    f"⚠️ WARNING: Error creando customer profile: {customer_error}")
-                                print(f"🔍 DEBUG: Continuando con customer_id=None")
-                                valid_customer_id = None
-                    except Exception as e:
-                        print(f"⚠️ WARNING: Error validando customer_id: {e}")
-                        print(f"🔍 DEBUG: Continuando con customer_id=None")
-                        valid_customer_id = None
+                valid_customer_id = self._resolve_customer_id(
+                    session, customer_id)
 
                 print(f"🔍 DEBUG: customer_id validado: {valid_customer_id}")
 
@@ -184,6 +164,7 @@ class TagPersistenceService:
                 print(
                     f"🔍 DEBUG save_tags_to_database: Intentando commit de {len(saved_tags)} tags...")
                 session.commit()
+                self.invalidate_tags_cache()
                 print(f"✅ DEBUG save_tags_to_database: Commit exitoso!")
 
                 self.logger.info(
@@ -207,6 +188,129 @@ class TagPersistenceService:
 
             return False
 
+    def save_tags_bulk(self,
+                       session: Session,
+                       tags: List[Tag],
+                       conversation_id: str,
+                       customer_id: Optional[str],
+                       category: str) -> bool:
+        """
+        Guarda un lote de tags dentro de la transacción del llamador
+
+        A diferencia de save_tags_to_database, no abre sesión ni hace commit:
+        los tags existentes se resuelven con una sola consulta, los nuevos se
+        insertan con session.add_all y todo queda pendiente del commit que
+        haga quien creó la conversación.
+
+        Args:
+            session: Sesión activa donde ya se agregó la conversación
+            tags: Objetos Tag construidos por el llamador
+            conversation_id: ID de la conversación
+            customer_id: ID del cliente
+            category: Categoría de la conversación
+
+        Returns:
+            bool: True si el lote quedó agregado a la sesión
+        """
+        # Deduplicar por nombre conservando el primer tag del lote
+        tags_by_name: Dict[str, Tag] = {}
+        for tag in tags:
+            tag.name = (tag.name or '').lower().strip()
+            if tag.name and tag.name not in tags_by_name:
+                tags_by_name[tag.name] = tag
+
+        if not tags_by_name:
+            return False
+
+        try:
+            # Savepoint: si falla el lote, la conversación sigue intacta
+            with session.begin_nested():
+                valid_customer_id = self._resolve_customer_id(
+                    session, customer_id)
+                self._ensure_category_exists(session, category)
+
+                # Una sola consulta para todos los tags ya existentes
+                existing_tags = {
+                    tag.name: tag
+                    for tag in session.exec(
+                        select(Tag).where(Tag.name.in_(list(tags_by_name)))
+                    ).all()
+                }
+
+                now = datetime.now()
+                persisted_tags: List[Tag] = []
+                new_tags: List[Tag] = []
+                for name, tag in tags_by_name.items():
+                    existing_tag = existing_tags.get(name)
+                    if existing_tag:
+                        existing_tag.usage_count += 1
+                        existing_tag.updated_at = now
+                        if existing_tag.confidence_score < tag.confidence_score:
+                            existing_tag.confidence_score = tag.confidence_score
+                        persisted_tags.append(existing_tag)
+                    else:
+                        tag.usage_count = 1
+                        new_tags.append(tag)
+                        persisted_tags.append(tag)
+
+                session.add_all(new_tags)
+                session.flush()  # Para obtener los IDs de los tags nuevos
+
+                session.add_all([
+                    TagUsage(
+                        tag_id=tag.id,
+                        conversation_id=conversation_id,
+                        customer_id=valid_customer_id,
+                        confidence_score=tags_by_name[tag.name].confidence_score,
+                        usage_context="whatsapp_analysis"
+                    )
+                    for tag in persisted_tags
+                ])
+                session.flush()
+
+            self.logger.info(
+                f"✅ {len(tags_by_name)} tags agregados en lote para conversación {conversation_id} ({len(new_tags)} nuevos)")
+            return True
+
+        except Exception as e:
+            self.logger.error(f"❌ Error guardando tags en lote: {e}")
+            return False
+
+    def _resolve_customer_id(self, session: Session, customer_id: Optional[str]) -> Optional[str]:
+        """Valida el customer_id o crea un perfil de cliente temporal"""
+        if not customer_id or customer_id == "None":
+            return None
+
+        try:
+            # Si es un UUID válido, usarlo directamente
+            if len(customer_id) == 36 and '-' in customer_id:
+                return customer_id
+
+            # Si no es UUID válido, intentar crear un customer profile
+            from models.customer import CustomerProfile
+            try:
+                # Crear customer profile temporal sin validar UUID
+                customer = CustomerProfile(
+                    name=f"Cliente {customer_id}",
+                    phone=customer_id if customer_id.startswith(
+                        '+') else None,
+                    email=f"{customer_id}@temp.com"
+                )
+                session.add(customer)
+                session.flush()  # Para obtener el ID
+                print(
+                    f"✅ DEBUG: Customer profile creado con ID: {customer.id}")
+                return str(customer.id)
+            except Exception as customer_error:
+                print(
+                    f"⚠️ WARNING: Error creando customer profile: {customer_error}")
+                print(f"🔍 DEBUG: Continuando con customer_id=None")
+                return None
+        except Exception as e:
+            print(f"⚠️ WARNING: Error validando customer_id: {e}")
+            print(f"🔍 DEBUG: Continuando con customer_id=None")
+            return None
+
     def _create_or_update_tag(self, session: Session, tag_data: Dict[str, Any], category: str) -> Optional[Tag]:
         """Crea o actualiza un tag individual"""
         try:
@@ -442,6 +546,21 @@ class TagPersistenceService:
             print(f"🔍 Traceback completo: {traceback.format_exc()}")
             return []
 
+    def get_all_tags_cached(self) -> Tuple[List[Dict[str, Any]], str]:
+        """Obtiene todos los tags y su ETag, cacheados durante ALL_TAGS_CACHE_TTL_SECONDS"""
+        cached = self._all_tags_cache
+        if cached and time.monotonic() - cached[0] < ALL_TAGS_CACHE_TTL_SECONDS:
+            return cached[1], cached[2]
+
+        tags = self.get_all_tags()
+        etag = f'W/"{hashlib.blake2b(orjson.dumps(tags), digest_size=8).hexdigest()}"'
+        self._all_tags_cache = (time.monotonic(), tags, etag)
+        return tags, etag
+
+    def invalidate_tags_cache(self):
+        """Descarta el catálogo de tags cacheado"""
+        self._all_tags_cache = None
+
     def test_persistence(self) -> bool:
         """Método de prueba para verificar la funcionalidad"""
         try:
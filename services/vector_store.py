@@ -5,13 +5,16 @@ import pickle
 import os
 from sentence_transformers import SentenceTransformer
 from models.vector import VectorItem
-import json
+from core.config import settings
+import orjson
 
 
 class VectorStore:
-    def __init__(self, model_name: str = "paraphrase-MiniLM-L3-v2", index_path: str = "models/vector_index.faiss"):
+    def __init__(self, model_name: str = "paraphrase-MiniLM-L3-v2", index_path: str = "models/vector_index.faiss",
+                 binary_quantization: bool = False, rerank_candidates: int = 50):
         self.model_name = model_name
         self.index_path = index_path
+        self.rerank_candidates = rerank_candidates
         try:
             self.encoder = SentenceTransformer(model_name)
             self.dimension = self.encoder.get_sentence_embedding_dimension()
@@ -32,6 +35,50 @@ class VectorStore:
         self.items: List[VectorItem] = []
         self.load_index()
 
+        # Índice binario (1 bit por dimensión) para preseleccionar candidatos por Hamming
+        self.binary_index = None
+        if binary_quantization and self.encoder and self.dimension % 8 == 0:
+            self.binary_index = faiss.IndexBinaryFlat(self.dimension)
+            self._rebuild_binary_index()
+
+    @staticmethod
+    def _binarize(vectors: np.ndarray) -> np.ndarray:
+        """Cuantiza embeddings a bits por signo, empaquetados en uint8"""
+        return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+    def _add_to_index(self, embeddings: np.ndarray):
+        """Añade embeddings al index FAISS y al índice binario si está activo"""
+        self.index.add(embeddings)
+        if self.binary_index is not None:
+            self.binary_index.add(self._binarize(embeddings))
+
+    def _rebuild_binary_index(self):
+        """Regenera el índice binario a partir de los embeddings del index FAISS"""
+        self.binary_index.reset()
+        if self.index.ntotal:
+            self.binary_index.add(self._binarize(
+                self.index.reconstruct_n(0, self.index.ntotal)))
+
+    def _search_index(self, vectors: np.ndarray, k: int):
+        """(scores, indices) de los k vecinos; con índice binario reordena sus candidatos por producto punto"""
+        if self.binary_index is None or self.index.ntotal <= self.rerank_candidates:
+            return self.index.search(vectors, k)
+
+        _, candidates = self.binary_index.search(
+            self._binarize(vectors), self.rerank_candidates)
+
+        scores = np.full((len(vectors), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(vectors), k), -1, dtype=np.int64)
+        for row, (vector, row_candidates) in enumerate(zip(vectors, candidates)):
+            row_candidates = row_candidates[row_candidates >= 0]
+            candidate_scores = self.index.reconstruct_batch(
+                row_candidates) @ vector
+            top = np.argsort(-candidate_scores)[:k]
+            scores[row, :len(top)] = candidate_scores[top]
+            indices[row, :len(top)] = row_candidates[top]
+
+        return scores, indices
+
     def add_item(self, item: VectorItem) -> str:
         """Añade un item al vector store"""
         if not self.encoder:
@@ -39,7 +86,7 @@ class VectorStore:
             self.items.append(item)
             return item.id
 
-        if not item.embedding:
+        if item.embedding is None:
             try:
                 item.embedding = self.encoder.encode([item.text])[0]
             except Exception as e:
@@ -48,7 +95,7 @@ class VectorStore:
                 return item.id
 
         # Añadir al index
-        self.index.add(item.embedding.reshape(1, -1))
+        self._add_to_index(item.embedding.reshape(1, -1))
         self.items.append(item)
 
         return item.id
@@ -66,7 +113,7 @@ class VectorStore:
             embeddings = self.encoder.encode(texts)
 
             # Añadir embeddings al index
-            self.index.add(embeddings)
+            self._add_to_index(embeddings)
 
             # Actualizar items con sus embeddings
             for item, embedding in zip(items, embeddings):
@@ -81,46 +128,83 @@ class VectorStore:
 
     def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
         """Busca items similares al query"""
+        return self.batch_search([query], k)[0]
+
+    def batch_search(self, queries: List[str], k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Busca items similares para varios queries con un solo encode y una sola búsqueda FAISS"""
+        if not queries:
+            return []
+
         if not self.encoder:
             print("⚠️ Embeddings deshabilitados - búsqueda por texto simple")
             # Búsqueda simple por texto
-            results = []
-            query_lower = query.lower()
-            for item in self.items:
-                if query_lower in item.text.lower():
-                    results.append({
-                        "id": item.id,
-                        "text": item.text,
-                        "metadata": item.metadata,
-                        "similarity_score": 0.8  # Score falso
-                    })
-            return results[:k]
+            all_results = []
+            for query in queries:
+                results = []
+                query_lower = query.lower()
+                for item in self.items:
+                    if query_lower in item.text.lower():
+                        results.append({
+                            "id": item.id,
+                            "text": item.text,
+                            "metadata": item.metadata,
+                            "similarity_score": 0.8  # Score falso
+                        })
+                all_results.append(results[:k])
+            return all_results
 
         try:
-            query_embedding = self.encoder.encode([query])
+            query_embeddings = self.encoder.encode(
+                queries, batch_size=32, convert_to_numpy=True)
+        except Exception as e:
+            print(f"⚠️ Error en búsqueda: {e}")
+            return [[] for _ in queries]
+
+        return self.batch_search_by_vectors(query_embeddings, k)
+
+    def encode(self, text: str) -> Optional[np.ndarray]:
+        """Embedding de un texto (None si los embeddings están deshabilitados o fallan)"""
+        if not self.encoder:
+            return None
+        try:
+            return self.encoder.encode([text], convert_to_numpy=True)[0]
+        except Exception as e:
+            print(f"⚠️ Error generando embedding: {e}")
+            return None
 
-            # Buscar en el index
-            scores, indices = self.index.search(query_embedding, k)
+    def search_by_vector(self, vector: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+        """Busca items similares a un embedding ya calculado (sin volver a codificar)"""
+        return self.batch_search_by_vectors(vector.reshape(1, -1), k)[0]
+
+    def batch_search_by_vectors(self, vectors: np.ndarray, k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Busca items similares para una matriz de embeddings con una sola búsqueda FAISS"""
+        try:
+            # Buscar en el index (una sola búsqueda para todos los queries)
+            scores, indices = self._search_index(
+                np.ascontiguousarray(vectors, dtype=np.float32), k)
 
             # Verificar que hay resultados
             if len(scores) == 0 or len(indices) == 0:
-                return []
-
-            results = []
-            for score, idx in zip(scores[0], indices[0]):
-                if idx < len(self.items):
-                    item = self.items[idx]
-                    results.append({
-                        "id": item.id,
-                        "text": item.text,
-                        "metadata": item.metadata,
-                        "similarity_score": float(score)
-                    })
-
-            return results
+                return [[] for _ in vectors]
+
+            all_results = []
+            for query_scores, query_indices in zip(scores, indices):
+                results = []
+                for score, idx in zip(query_scores, query_indices):
+                    if 0 <= idx < len(self.items):
+                        item = self.items[idx]
+                        results.append({
+                            "id": item.id,
+                            "text": item.text,
+                            "metadata": item.metadata,
+                            "similarity_score": float(score)
+                        })
+                all_results.append(results)
+
+            return all_results
         except Exception as e:
             print(f"⚠️ Error en búsqueda: {e}")
-            return []
+            return [[] for _ in vectors]
 
     def save_index(self):
         """Guarda el index y los items"""
@@ -140,8 +224,8 @@ class VectorStore:
             })
 
         items_path = self.index_path.replace(".faiss", "_items.json")
-        with open(items_path, 'w', encoding='utf-8') as f:
-            json.dump(items_data, f, ensure_ascii=False, indent=2)
+        with open(items_path, 'wb') as f:
+            f.write(orjson.dumps(items_data, option=orjson.OPT_INDENT_2))
 
     def load_index(self):
         """Carga el index guardado"""
@@ -152,8 +236,8 @@ class VectorStore:
                 # Cargar items
                 items_path = self.index_path.replace(".faiss", "_items.json")
                 if os.path.exists(items_path):
-                    with open(items_path, 'r', encoding='utf-8') as f:
-                        items_data = json.load(f)
+                    with open(items_path, 'rb') as f:
+                        items_data = orjson.loads(f.read())
 
                     self.items = []
                     for item_data in items_data:
@@ -174,8 +258,8 @@ class VectorStore:
             items_path = self.index_path.replace(".faiss", "_items.json")
             if os.path.exists(items_path):
                 try:
-                    with open(items_path, 'r', encoding='utf-8') as f:
-                        items_data = json.load(f)
+                    with open(items_path, 'rb') as f:
+                        items_data = orjson.loads(f.read())
 
                     self.items = []
                     for item_data in items_data:
@@ -191,4 +275,7 @@ class VectorStore:
 
 
 # Instancia global del vector store
-vector_store = VectorStore()
+vector_store = VectorStore(
+    binary_quantization=settings.VECTOR_BINARY_QUANTIZATION,
+    rerank_candidates=settings.VECTOR_RERANK_CANDIDATES
+)
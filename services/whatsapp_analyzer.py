@@ -1,12 +1,23 @@
+import asyncio
 import re
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from services.llm import llm_service
+from services.conv_cache import conv_cache, conv_hash
 
 from services.vector_store import vector_store
 from services.tag_persistence import tag_persistence_service
 from models.whatsapp import WhatsAppMessage, WhatsAppConversation
 import uuid
+import orjson
+
+# Categorías de clasificación de conversaciones
+CONVERSATION_CATEGORIES = ["ventas", "soporte", "reclamo", "consulta", "otro"]
+
+# Patrón común de export de WhatsApp
+# [DD/MM/YYYY, HH:MM:SS] Nombre: Mensaje
+WHATSAPP_EXPORT_RE = re.compile(
+    r'\[(\d{2}/\d{2}/\d{4}), (\d{2}:\d{2}:\d{2})\] (.+?): (.+)')
 
 
 class WhatsAppAnalyzer:
@@ -18,17 +29,13 @@ class WhatsAppAnalyzer:
         """Parsea un export de WhatsApp y extrae conversaciones"""
         conversations = []
 
-        # Patrón común de export de WhatsApp
-        # [DD/MM/YYYY, HH:MM:SS] Nombre: Mensaje
-        pattern = r'\[(\d{2}/\d{2}/\d{4}), (\d{2}:\d{2}:\d{2})\] (.+?): (.+)'
-
         current_conversation = None
         current_messages = []
 
         lines = export_text.split('\n')
 
         for line in lines:
-            match = re.match(pattern, line.strip())
+            match = WHATSAPP_EXPORT_RE.match(line.strip())
             if match:
                 date_str, time_str, sender, content = match.groups()
 
@@ -83,18 +90,11 @@ class WhatsAppAnalyzer:
         """Analiza una conversación completa usando LLM"""
 
         # Preparar texto de la conversación
-        conversation_text = "\n".join([
-            f"[{msg.timestamp.strftime('%H:%M')}] {msg.sender}: {msg.content}"
-            for msg in conversation.messages
-        ])
-
-        # Clasificar conversación
-        categories = ["ventas", "soporte", "reclamo", "consulta", "otro"]
-        classification = llm_service.classify_conversation(
-            conversation_text, categories)
+        conversation_text = conversation.transcript
 
-        # Extraer entidades
-        entities = llm_service.extract_entities(conversation_text)
+        # Clasificar conversación y extraer entidades (cacheado por conversación)
+        classification, entities = self._classify_and_extract(
+            conversation_text)
 
         # Actualizar conversación
         conversation.category = classification.get("category", "otro")
@@ -127,7 +127,9 @@ class WhatsAppAnalyzer:
                 "smart_tags": smart_tags,  # Incluir etiquetas inteligentes completas
                 "start_date": conversation.start_date.isoformat(),
                 "message_count": len(conversation.messages)
-            }
+            },
+            # Embedding cacheado en la conversación: se reutiliza en búsquedas posteriores
+            embedding=conversation.get_embedding(vector_store.encode)
         )
         vector_store.add_item(vector_item)
 
@@ -156,6 +158,57 @@ class WhatsAppAnalyzer:
 
     def analyze_conversation_text(self, conversation_text: str, customer_id: str) -> Dict[str, Any]:
         """Analiza texto de conversación directamente y crea la conversación internamente"""
+        classification, entities = self._classify_and_extract(
+            conversation_text)
+        analyzed = self.analyze_classified_batch(
+            [(conversation_text, customer_id, classification, entities)])[0]
+        if isinstance(analyzed, Exception):
+            raise analyzed
+        analysis_result, vector_item = analyzed
+
+        # Guardar en vector store para búsquedas futuras
+        vector_store.add_item(vector_item)
+        return analysis_result
+
+    def analyze_classified_batch(self, items: List[Tuple[str, str, Dict[str, Any], Dict[str, Any]]]
+                                 ) -> List[Any]:
+        """Etiqueta un lote de (texto, customer_id, clasificación, entidades) con un solo encode;
+        retorna (análisis, VectorItem sin indexar) por elemento, o la excepción si ese elemento falló"""
+        texts = [conversation_text for conversation_text, _, _, _ in items]
+        categories = [classification.get("category", "otro")
+                      for _, _, classification, _ in items]
+
+        smart_tags_batch = self._generate_smart_tags_batch(texts, categories)
+
+        analyzed = []
+        for (conversation_text, customer_id, classification, entities), smart_tags in zip(items, smart_tags_batch):
+            try:
+                analyzed.append(self._build_analysis(
+                    conversation_text, customer_id, classification, entities, smart_tags))
+            except Exception as e:
+                analyzed.append(e)
+        return analyzed
+
+    @staticmethod
+    def _generate_smart_tags_batch(texts: List[str], categories: List[str]) -> List[List[Dict[str, Any]]]:
+        """Etiquetas inteligentes del lote; si falla, listas vacías (se usan los tags del LLM)"""
+        from services.smart_tagging import smart_tagging_service
+
+        try:
+            smart_tags_batch = smart_tagging_service.generate_smart_tags_batch(
+                texts, categories, max_tags=8)
+            print(
+                f"🔍 DEBUG: Tags generados por smart_tagging para {len(texts)} textos")
+            return smart_tags_batch
+        except Exception as e:
+            import traceback
+            print(f"❌ ERROR en smart_tagging_service.generate_smart_tags_batch: {e}")
+            print(f"🔍 Traceback completo: {traceback.format_exc()}")
+            return [[] for _ in texts]
+
+    def _build_analysis(self, conversation_text: str, customer_id: str, classification: Dict[str, Any],
+                        entities: Dict[str, Any], smart_tags: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], Any]:
+        """Arma el análisis de un texto ya clasificado y etiquetado y su VectorItem sin indexar"""
 
         # Crear una conversación temporal para análisis
         conversation_id = str(uuid.uuid4())
@@ -168,37 +221,9 @@ class WhatsAppAnalyzer:
             last_activity=datetime.now()
         )
 
-        # Clasificar conversación
-        categories = ["ventas", "soporte", "reclamo", "consulta", "otro"]
-        classification = llm_service.classify_conversation(
-            conversation_text, categories)
-
-        # Extraer entidades
-        entities = llm_service.extract_entities(conversation_text)
-
         # Actualizar conversación
         temp_conversation.category = classification.get("category", "otro")
 
-        # Generar etiquetas inteligentes usando el nuevo servicio
-        from services.smart_tagging import smart_tagging_service
-        print(f"🔍 DEBUG: Generando tags para texto: '{conversation_text}'")
-        print(f"🔍 DEBUG: Categoría: {temp_conversation.category}")
-
-        try:
-            smart_tags = smart_tagging_service.generate_smart_tags(
-                text=conversation_text,
-                category=temp_conversation.category,
-                max_tags=8
-            )
-            print(
-                f"🔍 DEBUG: Tags generados por smart_tagging: {len(smart_tags)} tags")
-            print(f"🔍 DEBUG: smart_tags contenido: {smart_tags}")
-        except Exception as e:
-            import traceback
-            print(f"❌ ERROR en smart_tagging_service.generate_smart_tags: {e}")
-            print(f"🔍 Traceback completo: {traceback.format_exc()}")
-            smart_tags = []
-
         # Si no se generaron tags inteligentes, usar los del LLM
         if not smart_tags and "tags" in classification:
             llm_tags = classification["tags"]
@@ -221,11 +246,10 @@ class WhatsAppAnalyzer:
         temp_conversation.tags = [tag["name"] for tag in smart_tags]
         print(
             f"🔍 DEBUG: Tags asignados a temp_conversation: {temp_conversation.tags}")
-        print(f"🔍 DEBUG: smart_tags original: {smart_tags}")
         temp_conversation.sentiment = classification.get(
             "sentiment", "neutral")
 
-        # Guardar en vector store para búsquedas futuras
+        # Preparar item para el vector store (lo indexa el llamador)
         from models.vector import VectorItem
         vector_item = VectorItem(
             id=temp_conversation.id,
@@ -237,7 +261,6 @@ class WhatsAppAnalyzer:
                 "customer_id": customer_id
             }
         )
-        vector_store.add_item(vector_item)
 
         # 🔴 COMENTADO: La persistencia de tags ahora se hace desde la ruta
         # después de crear la conversación en la BD
@@ -265,8 +288,6 @@ class WhatsAppAnalyzer:
         #     print(f"❌ Error persistiendo tags en BD: {e}")
         #     print(f"🔍 Traceback: {traceback.format_exc()}")
 
-        print(
-            f"🔍 DEBUG: Tags en insights del return: {temp_conversation.tags}")
         return {
             "conversation_id": temp_conversation.id,
             "classification": classification,
@@ -286,12 +307,69 @@ class WhatsAppAnalyzer:
                 "sentiment": temp_conversation.sentiment,
                 "tags": temp_conversation.tags
             }
-        }
+        }, vector_item
+
+    @staticmethod
+    def _analysis_cache_key(conversation_text: str) -> str:
+        """Clave en disco de la clasificación/entidades de un texto para el modelo actual"""
+        return f"analysis:{llm_service.model_name}:{conv_hash(conversation_text)}"
+
+    @staticmethod
+    def _is_cacheable(classification: Dict[str, Any], entities: Dict[str, Any]) -> bool:
+        """No cachear las respuestas de error del clasificador ni del extractor"""
+        return classification.get("category") != "unknown" and "error" not in entities
+
+    def _classify_and_extract(self, conversation_text: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Clasifica la conversación y extrae entidades, reutilizando el resultado guardado en disco"""
+        cache_key = self._analysis_cache_key(conversation_text)
+        cached = conv_cache.get(cache_key)
+        if cached is not None:
+            return cached["classification"], cached["entities"]
+
+        classification = llm_service.classify_conversation(
+            conversation_text, CONVERSATION_CATEGORIES)
+        entities = llm_service.extract_entities(conversation_text)
+
+        if self._is_cacheable(classification, entities):
+            conv_cache.set(
+                cache_key, {"classification": classification, "entities": entities})
+
+        return classification, entities
+
+    async def aclassify_and_extract(self, conversation_text: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Versión asíncrona de _classify_and_extract: clasificación y entidades en llamadas concurrentes"""
+        cache_key = self._analysis_cache_key(conversation_text)
+        cached = await asyncio.to_thread(conv_cache.get, cache_key)
+        if cached is not None:
+            return cached["classification"], cached["entities"]
+
+        classification, entities = await asyncio.gather(
+            llm_service.aclassify_conversation(
+                conversation_text, CONVERSATION_CATEGORIES),
+            llm_service.aextract_entities(conversation_text)
+        )
+
+        if self._is_cacheable(classification, entities):
+            await asyncio.to_thread(
+                conv_cache.set, cache_key, {"classification": classification, "entities": entities})
+
+        return classification, entities
 
     def search_similar_conversations(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
         """Busca conversaciones similares usando vector store"""
         return vector_store.search(query, k)
 
+    def search_similar_to_conversation(self, conversation: WhatsAppConversation, k: int = 5) -> List[Dict[str, Any]]:
+        """Busca conversaciones similares a una conversación reutilizando su embedding cacheado"""
+        embedding = conversation.get_embedding(vector_store.encode)
+        if embedding is None:
+            return vector_store.search(conversation.transcript, k)
+        return vector_store.search_by_vector(embedding, k)
+
+    def search_similar_conversations_batch(self, queries: List[str], k: int = 5) -> List[List[Dict[str, Any]]]:
+        """Busca conversaciones similares para varios queries en una sola búsqueda"""
+        return vector_store.batch_search(queries, k)
+
     def generate_response_suggestion(self, conversation: WhatsAppConversation, context: str = "") -> str:
         """Genera sugerencias de respuesta basadas en el contexto"""
 
@@ -367,8 +445,6 @@ class WhatsAppAnalyzer:
 
     def save_conversations(self, filepath: str):
         """Guarda las conversaciones en un archivo JSON"""
-        import json
-
         data = []
         for conv in self.conversations.values():
             conv_data = {
@@ -395,15 +471,13 @@ class WhatsAppAnalyzer:
             }
             data.append(conv_data)
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(filepath, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
     def load_conversations(self, filepath: str):
         """Carga conversaciones desde un archivo JSON"""
-        import json
-
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(filepath, 'rb') as f:
+            data = orjson.loads(f.read())
 
         for conv_data in data:
             messages = []
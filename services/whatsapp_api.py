@@ -4,7 +4,7 @@ Servicio de Integración con WhatsApp Business API
 
 Maneja la comunicación bidireccional con WhatsApp Business API
 """
-import requests
+import httpx
 import json
 import logging
 from typing import Dict, Any, Optional
@@ -23,8 +23,28 @@ class WhatsAppAPIService:
         self.access_token = os.getenv("WHATSAPP_ACCESS_TOKEN")
         self.verify_token = os.getenv("WHATSAPP_VERIFY_TOKEN", "agent99_verify_token")
         
+        # Cliente HTTP compartido (keep-alive); se crea al primer uso
+        self._client: Optional[httpx.AsyncClient] = None
+
         if not all([self.phone_number_id, self.access_token]):
             logger.warning("⚠️ Configuración de WhatsApp Business API incompleta")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Cliente HTTP asíncrono compartido por todas las llamadas"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=5.0,
+                limits=httpx.Limits(max_connections=100,
+                                    max_keepalive_connections=50)
+            )
+        return self._client
+
+    async def aclose(self):
+        """Cierra el cliente HTTP compartido"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
     
     def verify_webhook(self, mode: str, token: str, challenge: str) -> Optional[str]:
         """Verifica el webhook de WhatsApp"""
@@ -39,7 +59,7 @@ class WhatsAppAPIService:
             logger.error(f"❌ Error verificando webhook: {e}")
             return None
     
-    def send_text_message(self, phone_number: str, message: str) -> bool:
+    async def send_text_message(self, phone_number: str, message: str) -> bool:
         """Envía un mensaje de texto por WhatsApp"""
         try:
             if not all([self.phone_number_id, self.access_token]):
@@ -60,7 +80,7 @@ class WhatsAppAPIService:
                 "text": {"body": message}
             }
             
-            response = requests.post(url, headers=headers, json=data)
+            response = await self.client.post(url, headers=headers, json=data)
             
             if response.status_code == 200:
                 logger.info(f"✅ Mensaje WhatsApp enviado a {phone_number}")
@@ -73,7 +93,7 @@ class WhatsAppAPIService:
             logger.error(f"❌ Error enviando mensaje WhatsApp: {e}")
             return False
     
-    def send_template_message(self, phone_number: str, template_name: str, 
+    async def send_template_message(self, phone_number: str, template_name: str, 
                             language_code: str = "es", components: list = None) -> bool:
         """Envía un mensaje de plantilla por WhatsApp"""
         try:
@@ -101,7 +121,7 @@ class WhatsAppAPIService:
             if components:
                 data["template"]["components"] = components
             
-            response = requests.post(url, headers=headers, json=data)
+            response = await self.client.post(url, headers=headers, json=data)
             
             if response.status_code == 200:
                 logger.info(f"✅ Plantilla WhatsApp enviada a {phone_number}")
@@ -114,7 +134,7 @@ class WhatsAppAPIService:
             logger.error(f"❌ Error enviando plantilla WhatsApp: {e}")
             return False
     
-    def send_interactive_message(self, phone_number: str, message: str, 
+    async def send_interactive_message(self, phone_number: str, message: str, 
                                buttons: list) -> bool:
         """Envía un mensaje interactivo con botones por WhatsApp"""
         try:
@@ -150,7 +170,7 @@ class WhatsAppAPIService:
                 }
             }
             
-            response = requests.post(url, headers=headers, json=data)
+            response = await self.client.post(url, headers=headers, json=data)
             
             if response.status_code == 200:
                 logger.info(f"✅ Mensaje interactivo WhatsApp enviado a {phone_number}")
@@ -163,7 +183,7 @@ class WhatsAppAPIService:
             logger.error(f"❌ Error enviando mensaje interactivo WhatsApp: {e}")
             return False
     
-    def get_message_status(self, message_id: str) -> Optional[Dict[str, Any]]:
+    async def get_message_status(self, message_id: str) -> Optional[Dict[str, Any]]:
         """Obtiene el estado de un mensaje enviado"""
         try:
             if not all([self.phone_number_id, self.access_token]):
@@ -176,7 +196,7 @@ class WhatsAppAPIService:
                 "Authorization": f"Bearer {self.access_token}"
             }
             
-            response = requests.get(url, headers=headers)
+            response = await self.client.get(url, headers=headers)
             
             if response.status_code == 200:
                 return response.json()